@@ -22,6 +22,39 @@ class Bmc(object):
         """Set the target chassis state for a node."""
         pass
 
+    def get_chassis_states(self, remote_access_objects):
+        """
+        Get the chassis state of many nodes. Plugins that can ask many BMCs at once should override this, this one asks
+        them one after another.
+        :return: list of the states (or the RuntimeError that reading it raised), in the order of remote_access_objects
+        """
+        results = list()
+        for remote_access_object in remote_access_objects:
+            try:
+                results.append(self.get_chassis_state(remote_access_object))
+            except RuntimeError as error:
+                results.append(error)
+        return results
+
+    def set_chassis_states(self, remote_access_objects, new_state):
+        """
+        Set the chassis of many nodes to new_state. Plugins that can change many BMCs at once should override this,
+        this one changes them one after another.
+        :return: list of what set_chassis_state returned (or the RuntimeError it raised), in the order of
+                 remote_access_objects
+        """
+        results = list()
+        for remote_access_object in remote_access_objects:
+            try:
+                results.append(self.set_chassis_state(remote_access_object, new_state))
+            except RuntimeError as error:
+                results.append(error)
+        return results
+
+    def set_settle_limit(self, remote_access_object, max_seconds):
+        """Set the longest time a chassis state change of this BMC may take, None for the plugin default."""
+        pass
+
     def get_version(self, device_list, bmc_list):
         """Read the bios image info for a compute node"""
         pass
@@ -5,22 +5,75 @@
 """
 Plugin to talk to the BMC using IPMI versions 1.5 and 2.0.
 """
-from time import sleep
+import threading
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor
 from ...plugin import DeclarePlugin
 from ...utilities.utilities import Utilities
 from ..bmc import Bmc
 
 
+class SettleHistory(object):
+    """How long each BMC (by address) took to reach a new chassis state, and the longest it may take."""
+    SAMPLES = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = dict()
+        self._limits = dict()
+
+    def record(self, address, seconds):
+        """Remember that the BMC reached a new state after seconds."""
+        with self._lock:
+            samples = self._samples.setdefault(address, list())
+            samples.append(seconds)
+            del samples[:-self.SAMPLES]
+
+    def expected(self, address):
+        """The median of the recent settle times of the BMC, None if it never settled yet."""
+        with self._lock:
+            samples = sorted(self._samples.get(address, list()))
+        if not samples:
+            return None
+        return samples[len(samples) // 2]
+
+    def set_limit(self, address, seconds):
+        """The longest a state change of the BMC is confirmed for, None for the plugin default."""
+        with self._lock:
+            if seconds is None:
+                self._limits.pop(address, None)
+            else:
+                self._limits[address] = seconds
+
+    def limit(self, address, default):
+        """The longest a state change of the BMC is confirmed for."""
+        with self._lock:
+            return self._limits.get(address, default)
+
+
 @DeclarePlugin('ipmi_util', 100)
 class BmcIpmiUtil(Bmc):
-    """Implement Bmc contract using IPMI."""
+    """Implement Bmc contract using IPMI.
+
+    After 'on' or 'off' the plugin polls the chassis state until it changed: first after the time the BMC needed
+    before (or first_check_seconds), then backing off up to max_poll_seconds between checks, for at most the limit of
+    the BMC (the bmc_settle_max_seconds of its profile) or max_settle_seconds, and raises a RuntimeError if the state
+    didn't change by then. A limit of 0 turns the confirmation off. What was learned is kept for all instances of the
+    plugin in settle_history.
+
+    The batch methods run up to max_parallel ipmiutil processes side by side.
+    """
+    settle_history = SettleHistory()
 
     def __init__(self):
         Bmc.__init__(self)
         self.utilities = Utilities()
         self.tool = 'ipmiutil'
         self.name_to_find = 'chassis_power'
-        self.mandatory_bmc_wait_seconds = 10
+        self.max_settle_seconds = 10
+        self.first_check_seconds = 0.25
+        self.max_poll_seconds = 2
+        self.max_parallel = 16
 
     def get_chassis_state(self, remote_access_object):
         """Get the current power state of the node chassis as a boolean."""
@@ -42,9 +95,6 @@ class BmcIpmiUtil(Bmc):
                 continue
         if value is None:
             raise RuntimeError('Failed to retrieve chassis power state!')
-        # For stability with different BMC implementations...no way to check
-        # stability dynamically in IPMI.
-        sleep(self.mandatory_bmc_wait_seconds)
         return value == 'on'
 
     def set_chassis_state(self, remote_access_object, new_state):
@@ -56,11 +106,59 @@ class BmcIpmiUtil(Bmc):
         result = self.utilities.execute_no_capture(command)
         if result != 0:
             raise RuntimeError('Failed to execute "%s"!' % self.tool)
-        # For stability with different BMC implementations...no way to check
-        # stability dynamically in IPMI.
-        sleep(self.mandatory_bmc_wait_seconds)
+        if new_state in ('on', 'off') and not self._confirm_chassis_state(remote_access_object, new_state == 'on'):
+            raise RuntimeError('Chassis did not reach state "%s"' % new_state)
         return True
 
+    def get_chassis_states(self, remote_access_objects):
+        """See @Bmc for function description. Only implementation details here."""
+        return self._in_parallel(self.get_chassis_state, [(remote_access_object,)
+                                                          for remote_access_object in remote_access_objects])
+
+    def set_chassis_states(self, remote_access_objects, new_state):
+        """See @Bmc for function description. Only implementation details here."""
+        return self._in_parallel(self.set_chassis_state, [(remote_access_object, new_state)
+                                                          for remote_access_object in remote_access_objects])
+
+    def _in_parallel(self, func, args_list):
+        """func(*args) for every args, the RuntimeError instead of the result when one is raised."""
+        def _call(args):
+            try:
+                return func(*args)
+            except RuntimeError as error:
+                return error
+        if not args_list:
+            return list()
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(args_list))) as executor:
+            return list(executor.map(_call, args_list))
+
+    def set_settle_limit(self, remote_access_object, max_seconds):
+        """See @Bmc for function description. Only implementation details here."""
+        self.settle_history.set_limit(remote_access_object.address, max_seconds)
+
+    def _confirm_chassis_state(self, remote_access_object, state):
+        """Poll until the chassis is in state, False if it isn't within the settle limit of the BMC."""
+        address = remote_access_object.address
+        limit = self.settle_history.limit(address, self.max_settle_seconds)
+        if limit <= 0:
+            return True
+        backoff = self.first_check_seconds
+        delay = self.settle_history.expected(address) or backoff
+        start = time()
+        elapsed = 0
+        while elapsed < limit:
+            sleep(min(delay, limit - elapsed))
+            try:
+                if self.get_chassis_state(remote_access_object) == state:
+                    self.settle_history.record(address, time() - start)
+                    return True
+            except RuntimeError:
+                pass
+            delay = backoff
+            backoff = min(backoff * 2, self.max_poll_seconds)
+            elapsed = time() - start
+        return False
+
     def _build_power_command(self, address, user, password, cmd):
         """Build the beginning of an ipmiutil command"""
         cmd_map = {'off': '-d',        # Hard power off the node
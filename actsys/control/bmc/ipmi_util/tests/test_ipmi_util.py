@@ -8,7 +8,7 @@ Test the IPMI plugin for BMC access/control.
 import time
 import unittest
 from mock import patch
-from ..ipmi_util import BmcIpmiUtil
+from ..ipmi_util import BmcIpmiUtil, SettleHistory
 from ....plugin.manager import PluginManager
 from ....utilities.utilities import Utilities, SubprocessOutput
 from ....utilities.remote_access_data import RemoteAccessData
@@ -35,7 +35,8 @@ class TestBmcIpmi(unittest.TestCase):
         self.manager = PluginManager()
         self.manager.register_plugin_class(BmcIpmiUtil)
         self.bmc = self.manager.create_instance('bmc', 'ipmi_util')
-        self.bmc.mandatory_bmc_wait_seconds = 0
+        self.bmc.max_settle_seconds = 0
+        self.bmc.settle_history = SettleHistory()
         self.bmc_credentials = RemoteAccessData('127.0.0.2', 0, 'admin',
                                                 'PASSWORD')
 
@@ -87,5 +88,64 @@ class TestBmcIpmi(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             self.bmc.set_chassis_state(self.bmc_credentials, 'off')
 
+    @patch.object(Utilities, "execute_subprocess")
+    @patch.object(Utilities, "execute_no_capture")
+    def test_confirm_chassis_state(self, mock_enc, mock_esub):
+        mock_enc.return_value = 0
+        self.bmc.max_settle_seconds = 5
+        self.bmc.first_check_seconds = 0.01
+        mock_esub.side_effect = [SubprocessOutput(0, b'chassis_power = off', ''), SubprocessOutput(1, None, None),
+                                 SubprocessOutput(0, b'chassis_power = on', '')]
+        self.assertTrue(self.bmc.set_chassis_state(self.bmc_credentials, 'on'))
+        self.assertEqual(3, mock_esub.call_count)
+        expected = self.bmc.settle_history.expected(self.bmc_credentials.address)
+        self.assertGreater(expected, 0.02)
+        self.assertLess(expected, 1)
+        self.assertIsNone(self.bmc.settle_history.expected('127.0.0.3'))
+
+        mock_esub.reset_mock()
+        mock_esub.side_effect = None
+        mock_esub.return_value = SubprocessOutput(0, b'chassis_power = on', '')
+        self.bmc.set_chassis_state(self.bmc_credentials, 'cycle')
+        self.assertEqual(0, mock_esub.call_count)
+
+        self.bmc.set_settle_limit(self.bmc_credentials, 0.1)
+        start = time.time()
+        with self.assertRaises(RuntimeError):
+            self.bmc.set_chassis_state(self.bmc_credentials, 'off')
+        self.assertLess(time.time() - start, 1)
+        self.assertGreater(mock_esub.call_count, 0)
+        self.assertIsInstance(self.bmc.set_chassis_states([self.bmc_credentials], 'off')[0], RuntimeError)
+        self.bmc.set_settle_limit(self.bmc_credentials, 0)
+        self.assertTrue(self.bmc.set_chassis_state(self.bmc_credentials, 'off'))
+        self.bmc.set_settle_limit(self.bmc_credentials, None)
+        self.assertEqual(5, self.bmc.settle_history.limit(self.bmc_credentials.address, 5))
+
+    @patch.object(Utilities, "execute_subprocess")
+    @patch.object(Utilities, "execute_no_capture")
+    def test_batch(self, mock_enc, mock_esub):
+        def _status(command):
+            if command[3] == '127.0.0.4':
+                return SubprocessOutput(1, None, None)
+            return SubprocessOutput(0, b'chassis_power = on', '')
+        mock_esub.side_effect = _status
+        mock_enc.return_value = 0
+        others = [RemoteAccessData('127.0.0.{}'.format(index), 0, 'admin', 'PASSWORD') for index in range(3, 6)]
+        states = self.bmc.get_chassis_states([self.bmc_credentials] + others)
+        self.assertEqual([True, True], states[:2])
+        self.assertIsInstance(states[2], RuntimeError)
+        self.assertTrue(states[3])
+        self.assertEqual([True] * 4, self.bmc.set_chassis_states([self.bmc_credentials] + others, 'cycle'))
+        self.assertEqual(4, mock_enc.call_count)
+        self.assertEqual([], self.bmc.get_chassis_states([]))
+
+    def test_settle_history(self):
+        history = SettleHistory()
+        for seconds in range(20):
+            history.record('bmc1', seconds)
+        history.record('bmc2', 0.5)
+        self.assertEqual(16, history.expected('bmc1'))
+        self.assertEqual(0.5, history.expected('bmc2'))
+
 if __name__ == '__main__':
     unittest.main()
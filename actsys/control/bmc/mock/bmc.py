@@ -8,13 +8,23 @@ Plugin to talk to mock BMC functionality.
 import os.path
 import json
 import tempfile
+import threading
 from ...plugin import DeclarePlugin
 from ..bmc import Bmc
 
 
 @DeclarePlugin('mock', 1000)
 class BmcMock(Bmc):
-    """Implement Bmc contract using IPMI."""
+    """Implement Bmc contract using IPMI.
+
+    All instances share the state file, it is read and changed under _file_lock and every read or change starts from
+    what is in the file.
+    """
+    _file_lock = threading.Lock()
+    STATES = {'off': 'off', 'on': 'on', 'cycle': 'on', 'bios': 'on',
+              'efi': 'on', 'hdd': 'on', 'pxe': 'on', 'cdrom': 'on',
+              'removable': 'on'}
+
     def __init__(self):
         Bmc.__init__(self)
         self.state_change_delay = 5  # seconds
@@ -30,25 +40,51 @@ class BmcMock(Bmc):
 
     def get_chassis_state(self, remote_access_object):
         """Get the current power state of the node chassis as a boolean."""
-        if remote_access_object.address in self.__current_states:
-            return self.__current_states[remote_access_object.address] == 'on'
-        else:
-            self.__current_states[remote_access_object.address] = 'off'
-            self._save_bmc_file()
-            return False
+        return self._read_states([remote_access_object])[0]
 
     def set_chassis_state(self, remote_access_object, new_state):
         """Set the chassis to a new state."""
-        states = {'off': 'off', 'on': 'on', 'cycle': 'on', 'bios': 'on',
-                  'efi': 'on', 'hdd': 'on', 'pxe': 'on', 'cdrom': 'on',
-                  'removable': 'on'}
-        if new_state not in states:
+        if new_state not in self.STATES:
             raise RuntimeError('An illegal BMC state was attempted: %s' %
                                new_state)
-        self.__current_states[remote_access_object.address] = states[new_state]
-        self._save_bmc_file()
+        self._update_states([remote_access_object], self.STATES[new_state])
         return not self.set_failure
 
+    def get_chassis_states(self, remote_access_objects):
+        """See @Bmc for function description. Only implementation details here."""
+        return self._read_states(remote_access_objects)
+
+    def set_chassis_states(self, remote_access_objects, new_state):
+        """See @Bmc for function description. Only implementation details here."""
+        if new_state not in self.STATES:
+            raise RuntimeError('An illegal BMC state was attempted: %s' %
+                               new_state)
+        self._update_states(remote_access_objects, self.STATES[new_state])
+        return [not self.set_failure] * len(remote_access_objects)
+
+    def _read_states(self, remote_access_objects):
+        """The states of the BMCs in the state file as booleans, BMCs without one are added to it as off."""
+        with self._file_lock:
+            if os.path.exists(self.__persistent_file):
+                self._load_bmc_file()
+            missing = [remote_access_object for remote_access_object in remote_access_objects
+                       if remote_access_object.address not in self.__current_states]
+            for remote_access_object in missing:
+                self.__current_states[remote_access_object.address] = 'off'
+            if missing:
+                self._save_bmc_file()
+            return [self.__current_states[remote_access_object.address] == 'on'
+                    for remote_access_object in remote_access_objects]
+
+    def _update_states(self, remote_access_objects, state):
+        """Set the state of the BMCs in the state file."""
+        with self._file_lock:
+            if os.path.exists(self.__persistent_file):
+                self._load_bmc_file()
+            for remote_access_object in remote_access_objects:
+                self.__current_states[remote_access_object.address] = state
+            self._save_bmc_file()
+
     def _load_bmc_file(self):
         """Loads the bmc file from disk."""
         file_obj = open(self.__persistent_file)
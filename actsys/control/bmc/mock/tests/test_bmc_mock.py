@@ -7,6 +7,7 @@ Test the Mock plugin for BMC access/control.
 """
 import os
 import unittest
+import threading
 import tempfile
 from ..bmc import BmcMock
 from ....plugin.manager import PluginManager
@@ -41,6 +42,40 @@ class TestBmcMock(unittest.TestCase):
         bmc = BmcMock()
         self.assertTrue(bmc.get_chassis_state(self.remote))
 
+    def test_batch(self):
+        if os.path.exists(self.bmc_file):
+            os.unlink(self.bmc_file)
+        other = RemoteAccessData('127.0.0.3', 0, 'admin', 'root')
+        bmc = BmcMock()
+        self.assertEqual([False, False], bmc.get_chassis_states([self.remote, other]))
+        self.assertEqual([True], bmc.set_chassis_states([other], 'pxe'))
+        with self.assertRaises(RuntimeError):
+            bmc.set_chassis_states([other], 'crazy')
+        self.assertEqual([False, True], BmcMock().get_chassis_states([self.remote, other]))
+
+    def test_shared_file(self):
+        if os.path.exists(self.bmc_file):
+            os.unlink(self.bmc_file)
+        remotes = [RemoteAccessData('127.0.1.{}'.format(index), 0, 'admin', 'root') for index in range(20)]
+        bmcs = [BmcMock() for _ in remotes]
+        threads = [threading.Thread(target=bmc.set_chassis_state, args=(remote, 'on'))
+                   for bmc, remote in zip(bmcs, remotes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True] * len(remotes), BmcMock().get_chassis_states(remotes))
+
+    def test_reads_other_instances(self):
+        if os.path.exists(self.bmc_file):
+            os.unlink(self.bmc_file)
+        first = BmcMock()
+        second = BmcMock()
+        self.assertFalse(second.get_chassis_state(self.remote))
+        first.set_chassis_state(self.remote, 'on')
+        self.assertTrue(second.get_chassis_state(self.remote))
+        self.assertEqual([True], second.get_chassis_states([self.remote]))
+
     def test_persist_state_1(self):
         if os.path.exists(self.bios_file):
             os.unlink(self.bios_file)
@@ -23,6 +23,26 @@ class TestInterface(unittest.TestCase):
         self.interface.get_version(None, None)
         self.interface.bios_update(None, None, 'test.bin')
 
+    def test_batch(self):
+        class _Bmc(Bmc):
+            def get_chassis_state(self, remote_access_object):
+                if remote_access_object.address is None:
+                    raise RuntimeError("no address")
+                return True
+
+            def set_chassis_state(self, remote_access_object, new_state):
+                return self.get_chassis_state(remote_access_object)
+
+        bmc = _Bmc()
+        missing = RemoteAccessData(None, 0, 'admin', 'PASSWORD')
+        states = bmc.get_chassis_states([self.remote, missing])
+        self.assertTrue(states[0])
+        self.assertIsInstance(states[1], RuntimeError)
+        results = bmc.set_chassis_states([missing, self.remote], 'on')
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertTrue(results[1])
+        self.assertEqual([], bmc.get_chassis_states([]))
+
     def test_oob_sensor(self):
         self.interface.get_sensor_value_over_time('none', 'none', 'none', None, None)
         self.interface.get_sensor_value('name', None, None)
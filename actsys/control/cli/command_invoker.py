@@ -20,6 +20,7 @@ class CommandInvoker(object):
     CTRL_CONFIG_LOCATION = "/usr/share/ctrl_db"
     POSTGRES_ENV_VAR = "CTRL_POSTGRES_CONNECTION_STRING"
     FILE_LOCATION_ENV_VAR = "CTRL_CONFIG_FILE"
+    CACHE_ENV_VAR = "CTRL_DATASTORE_CACHE"
     POSTGRES_CONNECTION_STRING = None
 
     def __init__(self, screen_log_level=logging.WARNING):
@@ -32,7 +33,10 @@ class CommandInvoker(object):
         self.failed_device_name = list()
 
         self.datastore_location = self.get_config_file_location()
-        self.datastore = DataStoreBuilder.get_datastore_from_string(self.datastore_location, screen_log_level)
+        # Commands look the same devices up many times, with CTRL_DATASTORE_CACHE=1 those lookups are answered from
+        # a cache.
+        self.datastore = DataStoreBuilder.get_datastore_from_string(self.datastore_location, screen_log_level,
+                                                                    cache=self.use_datastore_cache())
 
         self.logger = self.datastore.get_logger()
 
@@ -53,6 +57,11 @@ class CommandInvoker(object):
                              os.environ.get(cls.FILE_LOCATION_ENV_VAR, None) or \
                              cls.CTRL_CONFIG_LOCATION
 
+    @classmethod
+    def use_datastore_cache(cls):
+        """If the datastore should be wrapped in a CachingDataStore"""
+        return os.environ.get(cls.CACHE_ENV_VAR, "").lower() in ("1", "true", "yes")
+
     def _device_name_check(self, device_name):
         """Check the device name & create a list"""
         return self.datastore.expand_device_list(device_name)
@@ -169,6 +178,7 @@ class CommandInvoker(object):
             return result
         if not device_list:
             return CommandResult(1, "No valid devices to run this command on.")
+        self.datastore.prefetch_devices(device_list, include_related=("bmc", "pdu_list"))
         valid_node_list = list()
         invalid_node_list = list()
         for device_name in device_list:
@@ -40,10 +40,11 @@ class CommonPowerCommand(Command):
         options = {}
         node = None
         power_plugin_name = None
+        devices = self.configuration.get_devices(list(self.device_name), include_related=("bmc",))
         for device in self.device_name:
-            node = self.configuration.get_device(device)
+            node = devices[device]
             device_list.append(node)
-            bmc_list.append(self.configuration.get_device(node.get("bmc")))
+            bmc_list.append(devices.get(node.get("bmc")))
         if node:
             power_plugin_name = node.get("device_power_control", 'node_power')
         options['device_list'] = device_list
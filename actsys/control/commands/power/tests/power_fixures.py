@@ -46,6 +46,15 @@ class MockConfiguration(object):
         """Dummy getter"""
         return self.data[device_name]
 
+    def get_devices(self, device_list, include_related=()):
+        """Dummy getter"""
+        devices = dict((device_name, self.data[device_name]) for device_name in device_list)
+        for device in list(devices.values()):
+            for key in include_related:
+                if device.get(key) in self.data:
+                    devices[device.get(key)] = self.data[device.get(key)]
+        return devices
+
     def get_device_data(self, device_name, param):
         """Dummy getter"""
         if device_name not in self.data:
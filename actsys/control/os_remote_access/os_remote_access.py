@@ -22,6 +22,10 @@ class OsRemoteAccess(object):
         """Test is the OS is currently responding to requests."""
         pass
 
+    def reachability_port(self, remote_access_data):
+        """The TCP port that accepts connections while the OS can be reached, or None when there is no such port."""
+        return None
+
     def execute_multiple_nodes(self, cmd, remote_access_list, capture=False, other=None):
         """Execute the remote command on multiple nodes"""
         pass
@@ -35,6 +35,10 @@ class RemoteSshPlugin(OsRemoteAccess):
         return_value = self._execute_ssh(['echo', '-n', '""'], remote_access_data).return_code == 0
         return return_value
 
+    def reachability_port(self, remote_access_data):
+        """The sshd port."""
+        return remote_access_data.port or 22
+
     def execute_multiple_nodes(self, cmd, remote_access_list, capture=False, other=None):
         """Execute the remote command on multiple nodes"""
         result = {}
@@ -8,12 +8,27 @@ Implements a power_control plugin for controlling nodes.
 
 import time
 import os
+import threading
 from control.utilities.remote_access_data import RemoteAccessData
 from control.utilities.utilities import Utilities
+from control.utilities.device_task_runner import DeviceTaskRunner
+from control.utilities.reachability_monitor import ReachabilityMonitor
+from control.utilities.chassis_state_cache import ChassisStateCache
 from ...plugin import DeclarePlugin
+from ...plugin.manager import PluginManagerException
 from ..power_control import PowerControl
 
 
+def _node_attribute(name):
+    """The options of the node a thread works on, every worker thread has its own."""
+    def _get(self):
+        return getattr(self._node_state, name, None)
+
+    def _set(self, value):
+        setattr(self._node_state, name, value)
+    return property(_get, _set)
+
+
 @DeclarePlugin('node_power', 100)
 class NodePower(PowerControl):
     """This class controls node power using a PDU, BMC, and the node OS.
@@ -50,12 +65,42 @@ class NodePower(PowerControl):
                 "port": 21,
                 "user": username,
                 "password": password
-                }]
+                }],
+            'max_workers': 32,
+            'max_nodes_per_bmc': 4,
+            'max_nodes_per_pdu': 8,
+            'chassis_state_ttl_seconds': 5,
+            'chassis_state_cache_file': None
         }
 
+    Nodes are powered in parallel, up to max_workers at a time but never more than max_nodes_per_bmc nodes of the same
+    BMC or max_nodes_per_pdu nodes of the same PDU at once. These three options are optional. What the worker threads
+    share is thread-safe: the node options are thread-local, the BMC and OS plugins are per thread and the switch
+    plugins of the pdu_list are used by one thread at a time.
+
+    Each get or set makes one BMC and one OS access plugin instance per access_type and worker thread, shared by the
+    nodes of that thread, and first reads the chassis states of all nodes with one get_chassis_states() call per BMC
+    access_type.
+
+    Chassis states read from a BMC are reused for chassis_state_ttl_seconds by everything this object does, and by
+    other processes using the same chassis_state_cache_file. Both options are optional, see ChassisStateCache.
     """
+    DEFAULT_MAX_WORKERS = 32
+    DEFAULT_MAX_NODES_PER_BMC = 4
+    DEFAULT_MAX_NODES_PER_PDU = 8
+
+    os_access = _node_attribute('os_access')
+    os_credentials = _node_attribute('os_credentials')
+    policy = _node_attribute('policy')
+    bmc_credentials = _node_attribute('bmc_credentials')
+    bmc_access = _node_attribute('bmc_access')
+    switches = _node_attribute('switches')
+    device_name = _node_attribute('device_name')
+    device_type = _node_attribute('device_type')
+
     def __init__(self, **kwargs):
         """Will throw is bad or missing data is passed in options."""
+        self._node_state = threading.local()
         PowerControl.__init__(self, kwargs)
         self.__args = kwargs
         if self.__args is None or self.__args == dict():
@@ -75,6 +120,12 @@ class NodePower(PowerControl):
         self.device_name = None
         self.device_type = None
         self.utils = Utilities()
+        self.chassis_state_cache = ChassisStateCache(kwargs.get('chassis_state_ttl_seconds'),
+                                                     kwargs.get('chassis_state_cache_file'))
+        self._plugins = dict()
+        self._remote_access = dict()
+        self._pool_lock = threading.Lock()
+        self._switch_lock = threading.Lock()
 
     def get_current_device_power_state(self):
         """
@@ -84,26 +135,39 @@ class NodePower(PowerControl):
         Will raise RuntimeError if wrong device type or the hard switches are
         off.
         """
-        device_list = self.__args['device_list']
-        bmc_list = self.__args['bmc_list']
-        de_duplicated_bmc_list = self.utils.remove_duplicates_from_bmc_data(bmc_list)
-        self.utils.map_devices_to_bmc(device_list, de_duplicated_bmc_list,
-                                      self._get_power_devices_connected_bmc)
+        self._plugins = dict()
+        self._prefetch_chassis_states()
+        self.result_dict = self._run_for_nodes(self._get_power_node)
         return self.result_dict
 
-    def _get_power_devices_connected_bmc(self, device_list, bmc):
-        for node in device_list:
-            hostname = node['hostname']
+    def _prefetch_chassis_states(self):
+        """Read the chassis states of all BMCs into the chassis_state_cache, a batch per BMC plugin."""
+        batches = dict()
+        for bmc in self.utils.remove_duplicates_from_bmc_data(self.__args['bmc_list']):
+            credentials = self._remote_access_data(bmc)
+            if self.chassis_state_cache.get(credentials.address) is None:
+                batches.setdefault(bmc.get("access_type"), list()).append(credentials)
+        for access_type, credentials_list in batches.items():
             try:
-                options = self._options_from_node(node, bmc)
-                self._parse_options(options)
-                self.result_dict[hostname] = self._get_power_state_from_bmc()
-            except RuntimeError as run_err:
-                self.result_dict[hostname] = str(run_err)
+                states = self._plugin('bmc', access_type).get_chassis_states(credentials_list)
+            except (KeyError, RuntimeError, PluginManagerException):
+                # Every node reports its own failure when it is read on its own.
+                continue
+            for credentials, state in zip(credentials_list, states):
+                if isinstance(state, bool):
+                    self.chassis_state_cache.put(credentials.address, state)
+
+    def _get_power_node(self, node, bmc):
+        try:
+            options = self._options_from_node(node, bmc)
+            self._parse_options(options)
+            return self._get_power_state_from_bmc()
+        except RuntimeError as run_err:
+            return str(run_err)
 
     def _get_power_state_from_bmc(self):
         self._if_switches_off_exception()
-        if self.bmc_access.get_chassis_state(self.bmc_credentials):
+        if self._get_chassis_state():
             result = 'On'
             if self.os_access.test_connection(self.os_credentials):
                 result += ':bmc_on'
@@ -117,22 +181,47 @@ class NodePower(PowerControl):
         """
         self.target_state = target_state
         self.force_on_failure = force_on_failure
-        device_list = self.__args['device_list']
-        bmc_list = self.__args['bmc_list']
-        de_duplicated_bmc_list = self.utils.remove_duplicates_from_bmc_data(bmc_list)
-        self.utils.map_devices_to_bmc(device_list, de_duplicated_bmc_list,
-                                      self._set_power_devices_connected_bmc)
+        self._plugins = dict()
+        self._prefetch_chassis_states()
+        self.result_dict = self._run_for_nodes(self._set_power_node)
         return self.result_dict
 
-    def _set_power_devices_connected_bmc(self, device_list, bmc):
-        for node in device_list:
-            hostname = node['hostname']
-            try:
-                options = self._options_from_node(node, bmc)
-                self._parse_options(options)
-                self.result_dict[hostname] = self._set_power_state_from_bmc()
-            except RuntimeError as run_err:
-                self.result_dict[hostname] = str(run_err)
+    def _set_power_node(self, node, bmc):
+        try:
+            options = self._options_from_node(node, bmc)
+            self._parse_options(options)
+            return self._set_power_state_from_bmc()
+        except RuntimeError as run_err:
+            return str(run_err)
+
+    def _run_for_nodes(self, func):
+        """
+        Call func(node, bmc) for every node that has a BMC in the bmc_list, on a DeviceTaskRunner.
+        :return: dict of the node hostname to what func returned
+        """
+        runner = DeviceTaskRunner(self.__args.get('max_workers', self.DEFAULT_MAX_WORKERS), {
+            'bmc': self.__args.get('max_nodes_per_bmc', self.DEFAULT_MAX_NODES_PER_BMC),
+            'pdu': self.__args.get('max_nodes_per_pdu', self.DEFAULT_MAX_NODES_PER_PDU),
+        })
+        tasks = list()
+        bmc_list = self.utils.remove_duplicates_from_bmc_data(self.__args['bmc_list'])
+        self.utils.map_devices_to_bmc(self.__args['device_list'], bmc_list,
+                                      lambda nodes, bmc: tasks.extend(
+                                          (node['hostname'], self._node_controllers(node, bmc), func, (node, bmc))
+                                          for node in nodes))
+        return runner.run(tasks)
+
+    @staticmethod
+    def _node_controllers(node, bmc):
+        """The BMC and PDUs the node is powered with, see DeviceTaskRunner."""
+        controllers = [('bmc', bmc.get('hostname'))]
+        pdu_list = node.get('pdu_list') or list()
+        for pdu in pdu_list if isinstance(pdu_list, list) else [pdu_list]:
+            if isinstance(pdu, (tuple, list)) and isinstance(pdu[0], RemoteAccessData):
+                controllers.append(('pdu', pdu[0].get_authority()))
+            else:
+                controllers.append(('pdu', str(pdu)))
+        return controllers
 
     def _set_power_state_from_bmc(self):
         self._if_switches_off_exception()
@@ -142,7 +231,7 @@ class NodePower(PowerControl):
             cmd_pair = self.target_state.split(':')
             if len(cmd_pair) == 1:
                 cmd = 'on'
-                if self.bmc_access.get_chassis_state(self.bmc_credentials):
+                if self._get_chassis_state():
                     cmd = 'cycle'
                 return self._target_on_to_state(cmd, self.force_on_failure)
             else:
@@ -188,7 +277,9 @@ class NodePower(PowerControl):
         """Throw exception if the hard switches are off."""
         result = True
         for switch in self.switches:
-            result = result and switch[1].get_switch_state(switch[0], switch[2])
+            # The switch plugins come with the options, so all worker threads share them.
+            with self._switch_lock:
+                result = result and switch[1].get_switch_state(switch[0], switch[2])
         if not result:
             raise RuntimeError('The prerequisites of the hard switch(es) being '
                                'on was not met!')
@@ -203,38 +294,60 @@ class NodePower(PowerControl):
                 self._report_error("Failed to shutdown node's OS")
                 if not force:
                     return False
-        result = self.bmc_access.set_chassis_state(self.bmc_credentials, 'off')
+        result = self._set_chassis_state('off')
         if result:
             name = 'BMCChassisOffWait'
             return self._wait_for_chassis_state(False, self.policy[name])
         else:
             return False
 
+    def _get_chassis_state(self):
+        """The chassis state, from the chassis_state_cache if it was read lately."""
+        address = self.bmc_credentials.address
+        state = self.chassis_state_cache.get(address)
+        if state is None:
+            state = self.bmc_access.get_chassis_state(self.bmc_credentials)
+            self.chassis_state_cache.put(address, state)
+        return state
+
+    def _set_chassis_state(self, state):
+        """Change the chassis state, the cached one is gone until it is read again."""
+        self.chassis_state_cache.invalidate(self.bmc_credentials.address)
+        try:
+            return self.bmc_access.set_chassis_state(self.bmc_credentials, state)
+        finally:
+            # Somebody may have read the old state while it changed.
+            self.chassis_state_cache.invalidate(self.bmc_credentials.address)
+
     def _wait_for_chassis_state(self, state, timeout):
         """Wait for the chassis to be in the specified state."""
-        start = time.time()
-        elapsed = 0
-        chassis_state = self.bmc_access.get_chassis_state(self.bmc_credentials)
-        while chassis_state is not state and elapsed < timeout:
-            chassis_state = self.bmc_access.get_chassis_state(
-                self.bmc_credentials)
-            time.sleep(1)
-            now = time.time()
-            elapsed = now - start
-        result = elapsed < timeout
+        bmc_access = self.bmc_access
+        bmc_credentials = self.bmc_credentials
+        result = ReachabilityMonitor.shared().wait_for_probe(
+            ('chassis', bmc_credentials.address, self.device_name),
+            lambda: bmc_access.get_chassis_state(bmc_credentials), state, timeout)
+        if result:
+            self.chassis_state_cache.put(bmc_credentials.address, state)
         return result
 
     def _wait_for_network_availability(self, target, timeout):
         """Wait for OS shutdown."""
+        os_access = self.os_access
+        os_credentials = self.os_credentials
+        monitor = ReachabilityMonitor.shared()
         start = time.time()
-        elapsed = 0
-        while self.os_access.test_connection(self.os_credentials) is not target and \
-                elapsed < timeout:
-            time.sleep(4)
-            now = time.time()
-            elapsed = now - start
-        result = elapsed < timeout
-        return result
+        reachability_port = getattr(os_access, 'reachability_port', None)
+        port = reachability_port(os_credentials) if reachability_port is not None else None
+        if port is not None:
+            # Cheap TCP connects until the port looks right, then the OS plugin has the final word.
+            if not monitor.wait_for_port(os_credentials.address, port, target, timeout):
+                return False
+        # Even with no time left the OS plugin gets one try, the port may have answered just before the timeout.
+        remaining = max(timeout - (time.time() - start), 0)
+        # Keyed by node, like the chassis watch: the probe uses the OS plugin of this thread, which no other thread
+        # may call.
+        return monitor.wait_for_probe(('os', os_credentials.address, os_credentials.port, self.device_name),
+                                      lambda: os_access.test_connection(os_credentials), target, remaining)
 
     def _graceful_os_halt(self):
         """Halt the OS to chassis on not OS."""
@@ -268,11 +381,10 @@ class NodePower(PowerControl):
 
     def _do_bmc_power_on(self, state):
         """Bring up new state from chassis off."""
-        result = self.bmc_access.set_chassis_state(self.bmc_credentials, 'on')
+        result = self._set_chassis_state('on')
         if result:
             if state != 'on':
-                result = self.bmc_access.set_chassis_state(self.bmc_credentials,
-                                                           state)
+                result = self._set_chassis_state(state)
             else:
                 timeout = self.policy['OSBootTimeoutSeconds']
                 result = \
@@ -281,7 +393,7 @@ class NodePower(PowerControl):
 
     def _do_simple_bmc_reboot(self, state):
         """From a non-OS chassis on state reboot to new state."""
-        result = self.bmc_access.set_chassis_state(self.bmc_credentials, state)
+        result = self._set_chassis_state(state)
         if result and state in ['on', 'cycle']:
             timeout = self.policy['OSBootTimeoutSeconds']
             result = \
@@ -296,16 +408,14 @@ class NodePower(PowerControl):
         try:
             options['device_name'] = node.get("device_id")
             options['device_type'] = node.get("device_type")
-            mgr = self.__args['plugin_manager']
-
-            bmc_plugin = mgr.create_instance('bmc', bmc.get("access_type"))
-            bmc_credentials = RemoteAccessData(bmc.get("ip_address"), bmc.get("port"),
-                                               bmc.get("user"), bmc.get("password"))
+            bmc_plugin = self._plugin('bmc', bmc.get("access_type"))
+            bmc_credentials = self._remote_access_data(bmc)
+            if bmc.get("bmc_settle_max_seconds") is not None:
+                bmc_plugin.set_settle_limit(bmc_credentials, bmc.get("bmc_settle_max_seconds"))
             options['bmc'] = (bmc_credentials, bmc_plugin)
 
-            os_plugin = mgr.create_instance('os_remote_access', node.get("access_type"))
-            os_access = RemoteAccessData(node.get("ip_address"), node.get("port"),
-                                         node.get("user"), node.get("password"))
+            os_plugin = self._plugin('os_remote_access', node.get("access_type"))
+            os_access = self._remote_access_data(node)
             options['os'] = (os_access, os_plugin)
         except KeyError as key_error:
             raise RuntimeError("Unable to load access plugin, {}".format(str(key_error)))
@@ -322,3 +432,22 @@ class NodePower(PowerControl):
         if node.get("pdu_list", None) is not None:
             options['switches'] = node.get("pdu_list")
         return options
+
+    def _plugin(self, framework, access_type):
+        """
+        The plugin instance for access_type, made on first use and shared by all nodes of the calling thread. Plugins
+        aren't thread-safe, so every worker thread has its own.
+        """
+        with self._pool_lock:
+            key = (framework, access_type, threading.get_ident())
+            if key not in self._plugins:
+                self._plugins[key] = self.__args['plugin_manager'].create_instance(framework, access_type)
+            return self._plugins[key]
+
+    def _remote_access_data(self, device):
+        """The RemoteAccessData for the address and credentials of the device, shared by nodes with the same ones."""
+        key = (device.get("ip_address"), device.get("port"), device.get("user"), device.get("password"))
+        with self._pool_lock:
+            if key not in self._remote_access:
+                self._remote_access[key] = RemoteAccessData(*key)
+            return self._remote_access[key]
@@ -9,10 +9,13 @@ import unittest
 import time
 import os
 import json
+import threading
+from mock import patch
 from ....os_remote_access.mock.os_remote_access import OsRemoteAccessMock
 from ....utilities.utilities import Utilities, SubprocessOutput
 from ....plugin.manager import PluginManager
 from ....utilities.remote_access_data import RemoteAccessData
+from ....utilities.reachability_monitor import ReachabilityMonitor
 from ....bmc.mock.bmc import BmcMock
 from ..node_power import NodePower
 
@@ -232,6 +235,96 @@ class TestNodePower(unittest.TestCase):
         result = self.controller.get_current_device_power_state()
         self.assertEqual('Off', result['test_node'])
 
+    def test_nodes_of_all_bmcs(self):
+        self.__options['bmc_list'].append(dict(self.__options['bmc_list'][0], hostname='test_bmc_1'))
+        self.__options['max_nodes_per_bmc'] = 1
+        self.controller = self.manager.create_instance('power_control', 'node_power', **self.__options)
+        result = self.controller.get_current_device_power_state()
+        self.assertEqual(['test_node', 'test_node_1'], sorted(result.keys()))
+        self.assertEqual([('bmc', 'test_bmc'), ('pdu', '127.0.0.3:22'), ('pdu', '127.0.0.3:22')],
+                         NodePower._node_controllers(self.__options['device_list'][0],
+                                                     self.__options['bmc_list'][0]))
+
+    def test_chassis_state_cache(self):
+        calls = list()
+        get_chassis_states = BmcMock.get_chassis_states
+
+        def _count(bmc, remote_access_objects):
+            calls.append([remote_access_object.address for remote_access_object in remote_access_objects])
+            return get_chassis_states(bmc, remote_access_objects)
+        BmcMock.get_chassis_states = _count
+        try:
+            self.assertEqual('Off', self.controller.get_current_device_power_state()['test_node'])
+            self.assertEqual('Off', self.controller.get_current_device_power_state()['test_node'])
+            self.assertEqual(1, len(calls))
+            self.controller.set_device_power_state('On:bios')
+            self.assertEqual(1, len(calls))
+            self.assertTrue(self.controller.get_current_device_power_state()['test_node'].startswith('On'))
+            self.assertEqual(2, len(calls))
+            self.assertEqual([['127.0.0.2'], ['127.0.0.2']], calls)
+        finally:
+            BmcMock.get_chassis_states = get_chassis_states
+
+    def test_plugin_pool(self):
+        self.__options['bmc_list'].append(dict(self.__options['bmc_list'][0], hostname='test_bmc_1'))
+        self.__options['max_workers'] = 1
+        self.controller = self.manager.create_instance('power_control', 'node_power', **self.__options)
+        create_instance = self.manager.create_instance
+        created = list()
+
+        def _count(framework_name, plugin_name, **kwargs):
+            created.append((framework_name, plugin_name))
+            return create_instance(framework_name, plugin_name, **kwargs)
+        self.manager.create_instance = _count
+        self.controller.get_current_device_power_state()
+        # One BMC plugin to read all chassis states, then one of each for the worker thread.
+        self.assertEqual([('bmc', 'mock'), ('bmc', 'mock'), ('os_remote_access', 'mock')], sorted(created))
+        self.assertIs(self.controller._remote_access_data(self.__options['device_list'][0]),
+                      self.controller._remote_access_data(self.__options['device_list'][1]))
+
+    def test_shared_bmc(self):
+        self.__options['device_list'][1]['bmc'] = 'test_bmc'
+        self.__options['chassis_state_ttl_seconds'] = 0
+        self.controller = self.manager.create_instance('power_control', 'node_power', **self.__options)
+        both_read = threading.Barrier(2, timeout=5)
+        one_set = threading.Barrier(2, timeout=5)
+        plugins = list()
+
+        def _task(node, bmc):
+            plugin = self.controller._plugin('bmc', 'mock')
+            plugins.append(plugin)
+            credentials = self.controller._remote_access_data(bmc)
+            plugin.get_chassis_state(credentials)
+            both_read.wait()
+            if node['hostname'] == 'test_node':
+                plugin.set_chassis_state(credentials, 'on')
+            one_set.wait()
+            return plugin.get_chassis_state(credentials)
+        result = self.controller._run_for_nodes(_task)
+        self.assertEqual({'test_node': True, 'test_node_1': True}, result)
+        self.assertIsNot(plugins[0], plugins[1])
+
+    def test_shared_switch(self):
+        real_sleep = self._real_sleep
+        running = list()
+        most_running = list()
+
+        class _SlowSwitch(MockSwitch):
+            def get_switch_state(self, access, outlet):
+                running.append(outlet)
+                most_running.append(len(running))
+                real_sleep(0.05)
+                running.pop()
+                return True
+        switch = _SlowSwitch()
+        for device in self.__options['device_list']:
+            device['pdu_list'] = [(self.switch_access1, switch, '3')]
+        self.__options['bmc_list'].append(dict(self.__options['bmc_list'][0], hostname='test_bmc_1'))
+        self.controller = self.manager.create_instance('power_control', 'node_power', **self.__options)
+        self.controller.get_current_device_power_state()
+        self.assertEqual(2, len(most_running))
+        self.assertEqual(1, max(most_running))
+
     def test_set_device_power_state(self):
         result = self.controller.set_device_power_state('On:bios')
         self.assertTrue(result)
@@ -297,6 +390,42 @@ class TestNodePower(unittest.TestCase):
         result = power.wait_for_chassis_state(True, 3)
         self.assertTrue(result)
 
+    def test_os_probe_after_port(self):
+        power = MockNodePower(**self.__options)
+        power.os_access = MockOsAccess()
+        power.os_access.reachability_port = lambda credentials: 22
+
+        def slow_port(address, port, reachable=True, timeout=None):
+            self._real_sleep(timeout + 0.05)
+            return True
+        with patch.object(ReachabilityMonitor, 'wait_for_port', side_effect=slow_port):
+            self.assertTrue(power._wait_for_network_availability(True, 0.1))
+
+    def test_os_probe_per_node(self):
+        power = MockNodePower(**self.__options)
+        real_sleep = self._real_sleep
+        probed = list()
+        results = list()
+
+        class _SlowOsAccess(MockOsAccess):
+            def test_connection(self, remote_access_data):
+                probed.append(self)
+                real_sleep(0.1)
+                return True
+
+        def _wait(device_name):
+            power.device_name = device_name
+            power.os_access = _SlowOsAccess()
+            power.os_credentials = self.os_access
+            results.append(power._wait_for_network_availability(True, 5))
+        threads = [threading.Thread(target=_wait, args=(name,)) for name in ['test_node', 'test_node_1']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True, True], results)
+        self.assertEqual(2, len(set(probed)))
+
     def test_target_on_to_state(self):
         mock_os = MockOsAccess()
         self.__options['os'] = (self.os_access, mock_os)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Remember the chassis state of BMCs for a few seconds, so one command doesn't ask the same BMC over and over.
+"""
+import os
+import json
+import time
+import threading
+from datastore.file_lock import FileLock
+
+
+class ChassisStateCache(object):
+    """
+    Chassis states by BMC address, each valid for ttl_seconds after it was read. Whoever changes the chassis state must
+    invalidate() the address.
+
+    Without a path the states only live in this object, i.e. for one command. With a path they are kept in that JSON
+    file (locked with a FileLock), so ctrl processes that run one after another or side by side share them.
+    """
+    DEFAULT_TTL_SECONDS = 5
+
+    def __init__(self, ttl_seconds=None, path=None):
+        """
+        :param ttl_seconds: How long a state is valid, DEFAULT_TTL_SECONDS if None.
+        :param path: The file to share the states in, None to keep them in memory.
+        """
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else self.DEFAULT_TTL_SECONDS
+        self.path = path
+        self._states = dict()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path + ".lock") if path is not None else None
+
+    def get(self, address):
+        """
+        :param address: The BMC address
+        :return: The chassis state, None if it isn't known or too old.
+        """
+        with self._lock:
+            if self._file_lock is not None:
+                with self._file_lock.shared():
+                    self._states = self._load()
+            entry = self._states.get(address)
+        if entry is None or time.time() - entry[1] >= self.ttl_seconds:
+            return None
+        return entry[0]
+
+    def put(self, address, state):
+        """
+        Remember the chassis state the BMC just reported.
+        :param address: The BMC address
+        :param state:
+        :return:
+        """
+        self._update(address, [state, time.time()])
+
+    def invalidate(self, address):
+        """
+        Forget the chassis state of the BMC, because it is being changed.
+        :param address: The BMC address
+        :return:
+        """
+        self._update(address, None)
+
+    def _update(self, address, entry):
+        with self._lock:
+            if self._file_lock is None:
+                self._change(self._states, address, entry)
+                return
+            with self._file_lock.exclusive():
+                self._states = self._load()
+                self._change(self._states, address, entry)
+                self._save(self._states)
+
+    def _change(self, states, address, entry):
+        now = time.time()
+        for key in [key for key, value in states.items() if now - value[1] >= self.ttl_seconds]:
+            del states[key]
+        if entry is None:
+            states.pop(address, None)
+        else:
+            states[address] = entry
+
+    def _load(self):
+        try:
+            with open(self.path) as cache_file:
+                states = json.load(cache_file)
+        except (IOError, ValueError):
+            return dict()
+        return states if isinstance(states, dict) else dict()
+
+    def _save(self, states):
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(temp_path, "w") as cache_file:
+                json.dump(states, cache_file)
+            os.rename(temp_path, self.path)
+        except (IOError, OSError):
+            # Not shared then, this process still has the states in memory.
+            pass
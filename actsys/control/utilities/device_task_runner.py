@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Run the same work for many devices at once, without overloading the controllers (BMCs, PDUs) that devices share.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DeviceTaskRunner(object):
+    """
+    Runs one task per device on a bounded pool of threads. Every task names the controllers it uses (like
+    ('bmc', 'bmc1') or ('pdu', '10.0.0.3')), and at most the limit of that kind of controller run at the same time for
+    one controller. Tasks for devices that share nothing run side by side.
+
+    A task is only given to a worker thread once all its controllers have room, so no worker sits waiting for a busy
+    controller while tasks for idle controllers wait. Tasks start in the order given, except that tasks for busy
+    controllers are passed over until they have room.
+
+    The limits only bound how many tasks use a controller at once, they don't make anything thread-safe: the callables
+    run on several threads at the same time and must be thread-safe, including the objects they share (like one plugin
+    instance for all devices).
+    """
+    DEFAULT_MAX_WORKERS = 32
+
+    def __init__(self, max_workers=None, controller_limits=None):
+        """
+        :param max_workers: The most tasks that run at the same time.
+        :param controller_limits: dict of controller kind to the most tasks that use one such controller at the same
+                                  time, i.e. {'bmc': 4, 'pdu': 8}. Kinds that aren't in it aren't limited.
+        """
+        self.max_workers = max_workers or self.DEFAULT_MAX_WORKERS
+        self.controller_limits = controller_limits or dict()
+        self._using = dict()
+        self._condition = threading.Condition()
+
+    def _limited_controllers(self, controllers):
+        return [controller for controller in set(controllers) if controller[0] in self.controller_limits]
+
+    def _has_room(self, controllers):
+        return all(self._using.get(controller, 0) < self.controller_limits[controller[0]]
+                   for controller in controllers)
+
+    def _use(self, controllers, count):
+        for controller in controllers:
+            self._using[controller] = self._using.get(controller, 0) + count
+            if not self._using[controller]:
+                del self._using[controller]
+
+    def run(self, tasks):
+        """
+        Run the tasks and wait for all of them.
+        :param tasks: list of (key, controllers, func, args): func(*args) is called once controllers, a list of
+                      (kind, name) tuples, allow it.
+        :return: dict of key to what func returned, in the order of tasks.
+        :raise: The first exception a task raised, after all tasks ended.
+        """
+        if not tasks:
+            return dict()
+        workers = min(self.max_workers, len(tasks))
+        pending = [(index, self._limited_controllers(controllers), func, args)
+                   for index, (_, controllers, func, args) in enumerate(tasks)]
+        futures = [None] * len(tasks)
+        started = [0]
+
+        def _call(controllers, func, args):
+            try:
+                return func(*args)
+            finally:
+                with self._condition:
+                    started[0] -= 1
+                    self._use(controllers, -1)
+                    self._condition.notify_all()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            with self._condition:
+                while pending:
+                    ready = None
+                    if started[0] < workers:
+                        ready = next((position for position, task in enumerate(pending) if self._has_room(task[1])),
+                                     None)
+                    if ready is None:
+                        self._condition.wait()
+                        continue
+                    index, controllers, func, args = pending.pop(ready)
+                    self._use(controllers, 1)
+                    started[0] += 1
+                    futures[index] = executor.submit(_call, controllers, func, args)
+        return dict((task[0], future.result()) for task, future in zip(tasks, futures))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Wait for many devices to reach a state (OS reachable, chassis on, ...) from one asyncio event loop, instead of one
+sleeping loop per device.
+"""
+import random
+import asyncio
+import threading
+from datastore.datastore import get_logger
+
+
+class _Watch(object):
+    """Probes one key until it reaches its target, for all threads waiting on it."""
+    def __init__(self):
+        self.reached = asyncio.Event()
+        self.probed = asyncio.Event()
+        self.waiters = 0
+        self.task = None
+
+
+class ReachabilityMonitor(object):
+    """
+    Runs an asyncio event loop on a background thread that probes devices with exponential backoff and jitter.
+    Callers on any thread block in wait_for_port() or wait_for_probe() until the device reached the target state or
+    the timeout passed. Callers waiting for the same device and state share one probe loop, and listeners added with
+    add_listener() hear about every device that reached a state.
+
+    Port probes are non-blocking TCP connects, so thousands of them cost no threads or processes. Other probes (like
+    asking a BMC for its chassis state) are blocking calls, they run on the loop's thread pool.
+    """
+    INITIAL_DELAY_SECONDS = 0.05
+    MAX_DELAY_SECONDS = 8.0
+    CONNECT_TIMEOUT_SECONDS = 2.0
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self):
+        self.logger = get_logger()
+        self._loop = asyncio.new_event_loop()
+        self._watches = dict()
+        self._listeners = list()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="reachability-monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def shared(cls):
+        """
+        :return: The ReachabilityMonitor of this process, created on first use.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = ReachabilityMonitor()
+            return cls._shared
+
+    def close(self):
+        """
+        Stop the event loop. Threads still waiting get a RuntimeError.
+        :return:
+        """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def add_listener(self, callback):
+        """
+        :param callback: Called with (key, state) on the monitor thread whenever a device reached a state someone waited
+                         for, see wait_for_port() and wait_for_probe() for the keys. Keep it short.
+        :return:
+        """
+        self._listeners.append(callback)
+
+    def wait_for_port(self, address, port, reachable=True, timeout=None):
+        """
+        Wait until a TCP port accepts (reachable=True) or refuses (reachable=False) connections.
+        :param address:
+        :param port:
+        :param reachable:
+        :param timeout: seconds, None waits forever. The port is always tried at least once, even with a timeout of 0.
+        :return: True if the port got to that state in time, False if not.
+        """
+        async def _probe():
+            return await self._port_open(address, port)
+        return self._wait(('port', address, port), _probe, reachable, timeout)
+
+    def wait_for_probe(self, key, probe, target, timeout=None):
+        """
+        Wait until probe() returns target.
+        :param key: Names the device and what is probed, like ('chassis', '10.0.0.1'). Callers that use the same key
+                    and target share the probe loop, which keeps calling the probe of the first of them. Probes that
+                    must only be called by their own caller (i.e. use a plugin of the caller's thread) need keys of
+                    their own.
+        :param probe: A blocking function without arguments, exceptions count as not reaching target.
+        :param target:
+        :param timeout: seconds, None waits forever. probe() is always called at least once, even with a timeout of 0.
+        :return: True if probe() returned target in time, False if not.
+        """
+        async def _probe():
+            return await self._loop.run_in_executor(None, probe)
+        return self._wait(key, _probe, target, timeout)
+
+    def _wait(self, key, probe, target, timeout):
+        future = asyncio.run_coroutine_threadsafe(self._wait_async((key, target), probe, timeout), self._loop)
+        return future.result()
+
+    async def _wait_async(self, watch_key, probe, timeout):
+        watch = self._watches.get(watch_key)
+        if watch is None:
+            watch = _Watch()
+            self._watches[watch_key] = watch
+            watch.task = self._loop.create_task(self._probe_until(watch_key, watch, probe))
+        watch.waiters += 1
+        try:
+            await asyncio.wait_for(watch.reached.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            # Every waiter gets the result of at least one probe, even when that takes longer than the timeout.
+            await watch.probed.wait()
+            return watch.reached.is_set()
+        finally:
+            watch.waiters -= 1
+            if watch.waiters == 0 and not watch.reached.is_set():
+                watch.task.cancel()
+                if self._watches.get(watch_key) is watch:
+                    del self._watches[watch_key]
+
+    async def _probe_until(self, watch_key, watch, probe):
+        key, target = watch_key
+        delay = self.INITIAL_DELAY_SECONDS
+        while True:
+            try:
+                state = await probe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                self.logger.debug("Probe of {} failed: {}".format(key, error))
+                state = None
+            if state == target:
+                break
+            watch.probed.set()
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, self.MAX_DELAY_SECONDS)
+        if self._watches.get(watch_key) is watch:
+            del self._watches[watch_key]
+        watch.reached.set()
+        watch.probed.set()
+        for listener in list(self._listeners):
+            try:
+                listener(key, target)
+            except Exception as error:
+                self.logger.warning("Reachability listener failed for {}: {}".format(key, error))
+
+    async def _port_open(self, address, port):
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(address, port),
+                                               self.CONNECT_TIMEOUT_SECONDS)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the ChassisStateCache
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from mock import patch
+from ..chassis_state_cache import ChassisStateCache
+
+
+class TestChassisStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "chassis_states.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @patch("control.utilities.chassis_state_cache.time.time")
+    def test_ttl(self, mock_time):
+        mock_time.return_value = 100
+        cache = ChassisStateCache(ttl_seconds=5)
+        self.assertIsNone(cache.get("10.0.0.1"))
+        cache.put("10.0.0.1", True)
+        cache.put("10.0.0.2", False)
+        mock_time.return_value = 104
+        self.assertTrue(cache.get("10.0.0.1"))
+        self.assertFalse(cache.get("10.0.0.2"))
+        cache.invalidate("10.0.0.2")
+        self.assertIsNone(cache.get("10.0.0.2"))
+        mock_time.return_value = 105
+        self.assertIsNone(cache.get("10.0.0.1"))
+        cache.put("10.0.0.3", True)
+        self.assertEqual(["10.0.0.3"], list(cache._states.keys()))
+        self.assertEqual(ChassisStateCache.DEFAULT_TTL_SECONDS, ChassisStateCache().ttl_seconds)
+
+    def test_file(self):
+        first = ChassisStateCache(path=self.path)
+        second = ChassisStateCache(path=self.path)
+        self.assertIsNone(second.get("10.0.0.1"))
+        first.put("10.0.0.1", True)
+        self.assertTrue(second.get("10.0.0.1"))
+        second.invalidate("10.0.0.1")
+        self.assertIsNone(first.get("10.0.0.1"))
+        with open(self.path, "w") as cache_file:
+            cache_file.write("not json")
+        self.assertIsNone(first.get("10.0.0.1"))
+        first.put("10.0.0.1", False)
+        self.assertFalse(second.get("10.0.0.1"))
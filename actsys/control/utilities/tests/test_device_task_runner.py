@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the DeviceTaskRunner
+"""
+import time
+import threading
+import unittest
+from ..device_task_runner import DeviceTaskRunner
+
+
+class TestDeviceTaskRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = dict()
+        self.most_running = dict()
+
+    def task(self, controller, result):
+        with self.lock:
+            self.running[controller] = self.running.get(controller, 0) + 1
+            self.most_running[controller] = max(self.most_running.get(controller, 0), self.running[controller])
+        time.sleep(0.02)
+        with self.lock:
+            self.running[controller] -= 1
+        return result
+
+    def test_run(self):
+        runner = DeviceTaskRunner(max_workers=8, controller_limits={'bmc': 1, 'pdu': 3})
+        tasks = list()
+        for index in range(4):
+            tasks.append(('c{}'.format(index), [], self.task, ('free', index)))
+        for index in range(4, 16):
+            controllers = [('bmc', 'bmc{}'.format(index % 2)), ('pdu', 'pdu1'), ('other', 'x')]
+            tasks.append(('c{}'.format(index), controllers, self.task, ('bmc{}'.format(index % 2), index)))
+        results = runner.run(tasks)
+        self.assertEqual(['c{}'.format(index) for index in range(16)], list(results.keys()))
+        self.assertEqual(list(range(16)), list(results.values()))
+        self.assertEqual(1, self.most_running['bmc0'])
+        self.assertEqual(1, self.most_running['bmc1'])
+        self.assertLessEqual(self.most_running['free'], 4)
+        self.assertGreater(self.most_running['free'], 1)
+
+    def test_busy_controllers_passed_over(self):
+        runner = DeviceTaskRunner(max_workers=8, controller_limits={'pdu': 2})
+        # Grouped by PDU, like nodes listed rack by rack.
+        tasks = [('c{}'.format(index), [('pdu', 'pdu{}'.format(index // 10))], self.task, ('all', index))
+                 for index in range(40)]
+        start = time.time()
+        results = runner.run(tasks)
+        self.assertEqual(list(range(40)), list(results.values()))
+        self.assertEqual(8, self.most_running['all'])
+        # 5 rounds of 8 tasks, not about twice that when workers wait for the PDU of the rack they are on.
+        self.assertLess(time.time() - start, 8 * 0.02)
+
+    def test_errors(self):
+        def fail():
+            raise RuntimeError("failed")
+
+        runner = DeviceTaskRunner()
+        self.assertEqual({}, runner.run([]))
+        with self.assertRaises(RuntimeError):
+            runner.run([('c1', [], fail, ()), ('c2', [], self.task, ('free', 2))])
+        self.assertEqual(1, self.most_running['free'])
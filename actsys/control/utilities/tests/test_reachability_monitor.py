@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the ReachabilityMonitor
+"""
+import time
+import socket
+import threading
+import unittest
+from ..reachability_monitor import ReachabilityMonitor
+
+
+class TestReachabilityMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.monitor = ReachabilityMonitor()
+        self.monitor.MAX_DELAY_SECONDS = 0.1
+        self.calls = 0
+
+    def tearDown(self):
+        self.monitor.close()
+
+    def probe(self, states):
+        def _probe():
+            self.calls += 1
+            return states.pop(0) if states else True
+        return _probe
+
+    def test_wait_for_probe(self):
+        self.assertTrue(self.monitor.wait_for_probe(('chassis', 'bmc1'), self.probe([False, None, True]), True, 5))
+        self.assertEqual(3, self.calls)
+        self.assertFalse(self.monitor.wait_for_probe(('chassis', 'bmc1'), lambda: False, True, 0.2))
+        self.assertEqual({}, self.monitor._watches)
+
+    def test_no_time_left(self):
+        def slow():
+            time.sleep(0.1)
+            return True
+        self.assertTrue(self.monitor.wait_for_probe(('os', 'node1'), slow, True, 0))
+        self.assertFalse(self.monitor.wait_for_probe(('os', 'node1'), lambda: False, True, 0))
+
+    def test_probe_errors(self):
+        def fail():
+            raise RuntimeError("not yet")
+        self.assertFalse(self.monitor.wait_for_probe(('os', 'node1'), fail, True, 0.2))
+
+    def test_shared_watch(self):
+        reached = list()
+        self.monitor.add_listener(lambda key, state: reached.append((key, state)))
+        results = list()
+        started = threading.Event()
+
+        def _probe():
+            self.calls += 1
+            started.set()
+            return self.calls > 3
+
+        def _wait():
+            results.append(self.monitor.wait_for_probe(('chassis', 'bmc1'), _probe, True, 5))
+        threads = [threading.Thread(target=_wait) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True] * 5, results)
+        self.assertLess(self.calls, 5 * 4)
+        self.assertEqual([(('chassis', 'bmc1'), True)], reached)
+
+    def test_wait_for_port(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        self.assertTrue(self.monitor.wait_for_port('127.0.0.1', port, True, 5))
+        server.close()
+        self.assertTrue(self.monitor.wait_for_port('127.0.0.1', port, False, 5))
+        self.assertFalse(self.monitor.wait_for_port('127.0.0.1', port, True, 0.2))
+
+    def test_shared(self):
+        self.assertIs(ReachabilityMonitor.shared(), ReachabilityMonitor.shared())
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Time the most used DataStore calls on a synthetic cluster (see synthetic_cluster.py) for a FileStore, a PostgresStore
+and a MultiStore of both. Prints one JSON result per store, cluster size and operation, so results of two releases
+can be compared line by line.
+
+    python3 benchmarks/datastore_scale.py --nodes 1000,10000 --output results.ndjson
+    python3 benchmarks/datastore_scale.py --stores file,postgres,multi --postgres "host=... dbname=bench ..."
+
+The PostgreSQL database is overwritten (import_from_file), never point --postgres at a database in use.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from datastore.filestore import FileStore  # pylint: disable=wrong-import-position
+from datastore.multistore import MultiStore  # pylint: disable=wrong-import-position
+from synthetic_cluster import generate_cluster, generate_logs, format_file_logs, LOG_START, LOG_DAYS  # pylint: disable=wrong-import-position
+
+STORES = ["file", "postgres", "multi"]
+OPERATIONS = ["get_device", "get_devices", "list_devices_by_type", "list_devices_by_property", "set_device_batch",
+              "expand_device_list_range", "expand_device_list_groups", "list_logs_between_timeslice",
+              "export_to_file", "import_from_file", "export_to_stream", "import_from_stream"]
+# Exports and imports rewrite the whole store, they are repeated at most this often.
+EXPORT_IMPORT_REPEAT = 3
+
+
+def revision():
+    """
+    The git revision of the tree being measured, None outside a git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(seconds):
+    """
+    :param seconds: list of the durations of each call
+    :return: dict of timing results in milliseconds
+    """
+    ordered = sorted(seconds)
+    return {
+        "calls": len(ordered),
+        "total_seconds": round(sum(ordered), 6),
+        "mean_ms": round(sum(ordered) * 1000 / len(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def measure(function, calls):
+    """
+    Call function once for every argument list in calls.
+    :return: see summarize()
+    """
+    seconds = list()
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def load_store(kind, config, logs, directory, postgres_uri):
+    """
+    Create a store of this kind holding the synthetic cluster and its logs.
+    :return: DataStore
+    """
+    stores = list()
+    if kind in ("file", "multi"):
+        location = os.path.join(directory, "datastore_db")
+        with open(location, "w") as config_file:
+            json.dump(config, config_file)
+        with open(config["configuration_variables"]["log_file_path"], "w") as log_file:
+            log_file.write(format_file_logs(logs))
+        stores.append(FileStore(location, logging.CRITICAL))
+    if kind in ("postgres", "multi"):
+        from datastore.postgresstore import PostgresStore
+        location = os.path.join(directory, "import.json")
+        with open(location, "w") as config_file:
+            json.dump(config, config_file)
+        postgres_store = PostgresStore(postgres_uri, logging.CRITICAL)
+        postgres_store.import_from_file(location)
+        for index in range(0, len(logs), 1000):
+            postgres_store.add_logs(logs[index:index + 1000])
+        stores.append(postgres_store)
+    if len(stores) > 1:
+        return MultiStore(stores)
+    return stores[0]
+
+
+def operation_calls(operation, config, nodes, repeat, batch_size, directory, generator):
+    """
+    The function name and the argument lists to call it with for an operation.
+    :return: (DataStore function name, list of argument lists)
+    """
+    devices = config["device"]
+    if operation == "get_device":
+        names = list()
+        for device in generator.sample(devices, min(repeat, len(devices))):
+            names.append(generator.choice([device["device_id"], device["hostname"], device["ip_address"]]))
+        return "get_device", [[name] for name in names]
+    if operation == "get_devices":
+        calls = list()
+        for _ in range(repeat):
+            first = generator.randint(1, max(1, nodes - 99))
+            calls.append([["c{}".format(index) for index in range(first, min(first + 100, nodes + 1))],
+                          ("bmc", "pdu_list")])
+        return "get_devices", calls
+    if operation == "list_devices_by_type":
+        return "list_devices", [[{"device_type": "node"}]] * repeat
+    if operation == "list_devices_by_property":
+        racks = sorted(set(device["rack"] for device in devices if "rack" in device))
+        return "list_devices", [[{"rack": generator.choice(racks)}] for _ in range(repeat)]
+    if operation == "set_device_batch":
+        calls = list()
+        for call in range(repeat):
+            batch = [dict(device) for device in generator.sample(devices, min(batch_size, len(devices)))]
+            for device in batch:
+                device["state"] = "benchmark{}".format(call)
+            calls.append([batch])
+        return "set_device", calls
+    if operation == "expand_device_list_range":
+        return "expand_device_list", [["c[1-{}]".format(nodes)]] * repeat
+    if operation == "expand_device_list_groups":
+        return "expand_device_list", [["@compute"]] * repeat
+    if operation == "list_logs_between_timeslice":
+        calls = list()
+        for _ in range(repeat):
+            begin = LOG_START + datetime.timedelta(hours=generator.randint(0, LOG_DAYS * 24 - 1))
+            calls.append([begin, begin + datetime.timedelta(hours=1), None, 100])
+        return "list_logs_between_timeslice", calls
+    export_file = os.path.join(directory, "export.json")
+    stream_file = os.path.join(directory, "export.ndjson")
+    count = min(repeat, EXPORT_IMPORT_REPEAT)
+    if operation == "export_to_file":
+        return "export_to_file", [[export_file]] * count
+    if operation == "import_from_file":
+        return "import_from_file", [[export_file]] * count
+    if operation == "export_to_stream":
+        return "export_to_stream", [[stream_file]] * count
+    if operation == "import_from_stream":
+        return "import_from_stream", [[stream_file]] * count
+    raise ValueError("Unknown operation {}".format(operation))
+
+
+def run(kind, nodes, operations, repeat, batch_size, logs, seed, postgres_uri):
+    """
+    Run the operations on one store with a cluster of this many nodes.
+    :return: list of result dicts
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        config = generate_cluster(nodes, os.path.join(directory, "datastore.log"))
+        log_entries = generate_logs(logs, nodes, seed)
+        start = time.perf_counter()
+        store = load_store(kind, config, log_entries, directory, postgres_uri)
+        results = [dict(operation="load", **summarize([time.perf_counter() - start]))]
+        generator = random.Random(seed)
+        # Export before the imports that read the export, whatever order they were asked in.
+        for operation in sorted(operations, key=OPERATIONS.index):
+            function_name, calls = operation_calls(operation, config, nodes, repeat, batch_size, directory,
+                                                   generator)
+            results.append(dict(operation=operation, **measure(getattr(store, function_name), calls)))
+        for result in results:
+            result.update({"store": kind, "nodes": nodes, "devices": len(config["device"]), "logs": logs})
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    """
+    Parse the arguments and run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", default="1000", help="Comma separated cluster sizes, i.e. 1000,10000,100000")
+    parser.add_argument("--stores", default="file", help="Comma separated, some of {}".format(",".join(STORES)))
+    parser.add_argument("--postgres", help="PostgreSQL connection string, needed for the postgres and multi stores")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="Comma separated, some of the default")
+    parser.add_argument("--repeat", type=int, default=20, help="Calls per operation")
+    parser.add_argument("--batch-size", type=int, default=100, help="Devices per set_device call")
+    parser.add_argument("--logs", type=int, default=10000, help="Log records in the store")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Append the results to this file instead of printing them")
+    args = parser.parse_args()
+
+    stores = args.stores.split(",")
+    operations = args.operations.split(",")
+    unknown = (set(stores) - set(STORES)) | (set(operations) - set(OPERATIONS))
+    if unknown:
+        parser.error("Unknown stores or operations: {}".format(", ".join(sorted(unknown))))
+    if args.postgres is None and set(stores) & {"postgres", "multi"}:
+        parser.error("--postgres is needed for the postgres and multi stores")
+
+    run_info = {"benchmark": "datastore_scale", "revision": revision(), "python": platform.python_version(),
+                "timestamp": datetime.datetime.utcnow().isoformat() + "Z", "repeat": args.repeat,
+                "batch_size": args.batch_size, "seed": args.seed}
+    output = open(args.output, "a") if args.output else sys.stdout
+    try:
+        for nodes in [int(size) for size in args.nodes.split(",")]:
+            for kind in stores:
+                for result in run(kind, nodes, operations, args.repeat, args.batch_size, args.logs, args.seed,
+                                  args.postgres):
+                    result.update(run_info)
+                    output.write(json.dumps(result, sort_keys=True) + "\n")
+                    output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
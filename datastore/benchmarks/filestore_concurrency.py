@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Benchmark many processes writing to the same FileStore at once. Each writer sets its own devices and configuration
+values; at the end every write must be found in the file. Prints a JSON result.
+
+    python3 benchmarks/filestore_concurrency.py --writers 32 --writes 50
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from datastore.filestore import FileStore  # pylint: disable=wrong-import-position
+
+
+def writer(location, writer_id, writes, start_event):
+    """
+    Worker process: open the FileStore and do all the writes.
+    """
+    file_store = FileStore(location, logging.CRITICAL)
+    start_event.wait()
+    for index in range(writes):
+        file_store.set_device({"device_type": "node", "hostname": "w{}-{}".format(writer_id, index)})
+        file_store.set_configuration("writer{}".format(writer_id), index)
+
+
+def run(writers, writes, devices, journal_max_records):
+    """
+    Run one benchmark.
+    :return: A dict of results
+    """
+    directory = tempfile.mkdtemp()
+    location = os.path.join(directory, "datastore_db")
+    config = {"configuration_variables": {"log_file_path": os.path.join(directory, "datastore.log")},
+              "device": [{"device_id": index + 1, "device_type": "node", "hostname": "c{}".format(index + 1)}
+                         for index in range(devices)]}
+    if journal_max_records:
+        config["configuration_variables"][FileStore.JOURNAL_MAX_RECORDS_KEY] = journal_max_records
+    with open(location, "w") as config_file:
+        json.dump(config, config_file)
+
+    start_event = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=writer, args=(location, writer_id, writes, start_event))
+                 for writer_id in range(writers)]
+    for process in processes:
+        process.start()
+    start = time.time()
+    start_event.set()
+    for process in processes:
+        process.join()
+    elapsed = time.time() - start
+
+    file_store = FileStore(location, logging.CRITICAL)
+    found_devices = len(file_store.list_devices()) - devices
+    lost_config = [writer_id for writer_id in range(writers)
+                   if file_store.get_configuration_value("writer{}".format(writer_id)) != writes - 1]
+    return {
+        "writers": writers,
+        "writes_per_writer": writes,
+        "initial_devices": devices,
+        "journal_max_records": journal_max_records,
+        "seconds": round(elapsed, 3),
+        "writes_per_second": round(writers * writes * 2 / elapsed, 1),
+        "lost_devices": writers * writes - found_devices,
+        "lost_configuration": len(lost_config),
+    }
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument("--devices", type=int, default=1000, help="Devices in the file before the writers start")
+    parser.add_argument("--journal-max-records", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(run(args.writers, args.writes, args.devices, args.journal_max_records), sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
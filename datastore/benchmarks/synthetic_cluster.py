@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Synthetic clusters for the benchmarks: nodes with a BMC each, a PDU per rack, profiles, nested groups
+(compute -> rows -> racks) and logs. The same arguments always give the same cluster.
+"""
+import random
+import logging
+import datetime
+
+NODES_PER_RACK = 40
+RACKS_PER_ROW = 10
+LOG_START = datetime.datetime(2017, 9, 1, tzinfo=datetime.timezone.utc)
+LOG_DAYS = 30
+
+
+def _ip_address(prefix, index):
+    return "10.{}.{}.{}".format(prefix + (index >> 16), (index >> 8) & 255, index & 255)
+
+
+def _mac_address(prefix, index):
+    return "{:02x}:00:00:{:02x}:{:02x}:{:02x}".format(prefix, (index >> 16) & 255, (index >> 8) & 255, index & 255)
+
+
+def generate_cluster(nodes, log_file_path):
+    """
+    A configuration in the format of DataStore.export_to_file() for a cluster of this many nodes.
+    :param nodes: Number of compute nodes, named c1..cN. Each has a BMC (bmc1..bmcN), every rack of NODES_PER_RACK
+                  nodes has a PDU (pdu1..).
+    :param log_file_path: The log_file_path configuration variable, used by a FileStore.
+    :return: dict
+    """
+    racks = (nodes + NODES_PER_RACK - 1) // NODES_PER_RACK
+    rows = (racks + RACKS_PER_ROW - 1) // RACKS_PER_ROW
+    devices = list()
+    for index in range(1, nodes + 1):
+        rack = (index - 1) // NODES_PER_RACK + 1
+        devices.append({
+            "device_type": "node",
+            "hostname": "c{}".format(index),
+            "ip_address": _ip_address(0, index),
+            "mac_address": _mac_address(0, index),
+            "profile_name": "compute_node",
+            "bmc": "bmc{}".format(index),
+            "pdu_list": "pdu{}".format(rack),
+            "rack": "r{}".format(rack),
+            "state": "ready",
+        })
+        devices.append({
+            "device_type": "bmc",
+            "hostname": "bmc{}".format(index),
+            "ip_address": _ip_address(128, index),
+            "mac_address": _mac_address(1, index),
+            "profile_name": "bmc_default",
+        })
+    for rack in range(1, racks + 1):
+        devices.append({
+            "device_type": "pdu",
+            "hostname": "pdu{}".format(rack),
+            "ip_address": _ip_address(192, rack),
+            "mac_address": _mac_address(2, rack),
+            "profile_name": "pdu_default",
+        })
+    for device_id, device in enumerate(devices, 1):
+        device["device_id"] = device_id
+
+    groups = dict()
+    for rack in range(1, racks + 1):
+        first = (rack - 1) * NODES_PER_RACK + 1
+        groups["rack{}".format(rack)] = "c[{}-{}]".format(first, min(rack * NODES_PER_RACK, nodes))
+    for row in range(1, rows + 1):
+        row_racks = range((row - 1) * RACKS_PER_ROW + 1, min(row * RACKS_PER_ROW, racks) + 1)
+        groups["row{}".format(row)] = ",".join("@rack{}".format(rack) for rack in row_racks)
+    groups["compute"] = ",".join("@row{}".format(row) for row in range(1, rows + 1))
+    groups["bmcs"] = "bmc[1-{}]".format(nodes)
+
+    return {
+        "configuration_variables": {"log_file_path": log_file_path},
+        "device": devices,
+        "profile": [
+            {"profile_name": "compute_node", "access_type": "mock", "user": "user", "password": "password",
+             "port": 22, "role": ["compute"], "os_boot_timeout_seconds": 300},
+            {"profile_name": "bmc_default", "access_type": "mock", "user": "user", "password": "password",
+             "port": 623, "channel": 2, "priv_level": "ADMINISTRATOR"},
+            {"profile_name": "pdu_default", "access_type": "mock", "user": "user", "password": "password",
+             "port": 22, "outlets_count": NODES_PER_RACK},
+        ],
+        "groups": groups,
+    }
+
+
+def generate_logs(count, nodes, seed=0):
+    """
+    Logs spread evenly over LOG_DAYS days from LOG_START, oldest first.
+    :param count:
+    :param nodes:
+    :param seed:
+    :return: list of (process, timestamp, level, device_name, msg) tuples, like PostgresStore.add_logs() takes.
+    """
+    generator = random.Random(seed)
+    step = datetime.timedelta(days=LOG_DAYS) / max(count, 1)
+    levels = [logging.INFO] * 8 + [logging.WARNING, logging.ERROR]
+    logs = list()
+    for index in range(count):
+        logs.append(("benchmark", LOG_START + step * index, generator.choice(levels),
+                     "c{}".format(generator.randint(1, nodes)), "synthetic log message {}".format(index)))
+    return logs
+
+
+def format_file_logs(logs):
+    """
+    The logs as lines of a FileStore log file, see FileStore.LOG_FORMAT.
+    :param logs: see generate_logs()
+    :return: str
+    """
+    lines = list()
+    for process, timestamp, level, device_name, msg in logs:
+        lines.append("{},{:03d} / {} / DataStore / {} / {} / {};;\n".format(
+            timestamp.strftime("%Y-%m-%d %H:%M:%S"), timestamp.microsecond // 1000, logging.getLevelName(level),
+            process, device_name, msg))
+    return "".join(lines)
@@ -7,4 +7,6 @@ The DataStore Module
 """
 from .datastore import DataStore, DataStoreException, DataStoreLogger, get_logger, add_stream_logger
 from .datastore_builder import DataStoreBuilder
+from .caching_store import CachingDataStore
+from .device_record import DeviceRecord
 from .datastore_cli import DataStoreCLI
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+A read-through cache in front of another DataStore, so repeated lookups of the same devices, profiles, groups and
+configuration values don't go back to the database every time.
+"""
+import copy
+import time
+import threading
+from collections import OrderedDict
+from .datastore import DataStore
+from .device_record import DeviceRecord
+
+
+class _TtlLruCache(object):
+    """
+    A dict with a maximum number of entries (the least recently used entry is dropped first) and a maximum age for
+    entries. Counts hits and misses. Not thread safe, CachingDataStore locks around it.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        :param key:
+        :return: (True, value) for a hit, (False, None) for a miss
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return False, None
+
+    def contains(self, key):
+        """
+        :param key:
+        :return: True if key has an entry that isn't too old, without counting a hit or miss.
+        """
+        entry = self._entries.get(key)
+        return entry is not None and time.time() - entry[0] < self.ttl_seconds
+
+    def put(self, key, value):
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """
+        :return: dict with hits, misses and entries
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class CachingDataStore(DataStore):
+    """
+    Wraps a DataStore and remembers what get_device, get_profile, get_configuration_value, list_groups and
+    get_group_devices returned, until the entry is ttl_seconds old, is one of the max_entries least recently used
+    entries of a full cache, or something is written through this CachingDataStore:
+        set_device, delete_device: forget all devices.
+        set_profile, delete_profile: forget all profiles and devices (devices include their profile values).
+        set_configuration, delete_configuration: forget that configuration value.
+        add_to_group, remove_from_group: forget all groups.
+        import_from_file, import_from_stream: forget everything.
+    Changes made by other processes (or directly on the wrapped store) are seen after ttl_seconds, or right away when
+    the wrapped store has a _get_cache_key() (i.e. a FileStore) or publishes its changes (a PostgresStore, after
+    follow_changes()).
+
+    Cached values are copied in and out, so callers can change what they get back. Devices are cached as
+    DeviceRecords, which take much less memory than the dicts they are made from. Devices are cached under the names
+    they were asked for and under their device_id, hostname and ip_address, as they are: the device_id 1 and the
+    hostname "1" are different names.
+    """
+    DEFAULT_TTL_SECONDS = 10
+    DEFAULT_MAX_ENTRIES = 10000
+    DEVICE = "device"
+    PROFILE = "profile"
+    GROUP = "group"
+    CONFIGURATION = "configuration"
+    # list_groups() is cached under this key of the group cache, no group can be named "@".
+    _ALL_GROUPS = "@"
+
+    def __init__(self, datastore, ttl_seconds=None, max_entries=None):
+        super(CachingDataStore, self).__init__()
+        self.datastore = datastore
+        ttl_seconds = ttl_seconds if ttl_seconds is not None else self.DEFAULT_TTL_SECONDS
+        max_entries = max_entries if max_entries is not None else self.DEFAULT_MAX_ENTRIES
+        self._caches = dict((entity, _TtlLruCache(max_entries, ttl_seconds))
+                            for entity in [self.DEVICE, self.PROFILE, self.GROUP, self.CONFIGURATION])
+        self._lock = threading.RLock()
+        # Bumped whenever something is forgotten, so a read that started before a write doesn't cache what it read.
+        self._generation = 0
+        self._store_key = None
+
+    def get_cache_stats(self):
+        """
+        How well the caches work.
+        :return: dict of device, profile, group and configuration to a dict with hits, misses and entries
+        """
+        with self._lock:
+            return dict((entity, cache.stats()) for entity, cache in self._caches.items())
+
+    def clear_cache(self, entities=None):
+        """
+        Forget cached values.
+        :param entities: list of CachingDataStore.DEVICE, PROFILE, GROUP or CONFIGURATION, all of them by default.
+        :return:
+        """
+        entities = entities or list(self._caches.keys())
+        with self._lock:
+            for entity in entities:
+                self._caches[entity].clear()
+            self._generation += 1
+        if self.GROUP in entities:
+            self.group_cache.invalidate()
+        if self.PROFILE in entities:
+            self.profile_cache.invalidate()
+
+    def follow_changes(self):
+        """
+        Forget what other processes change as soon as the wrapped store says so (see DataStore.subscribe()), instead
+        of after ttl_seconds.
+        :return: The ChangeFeed, close() it to stop following.
+        """
+        return self.datastore.subscribe(self._apply_change)
+
+    def _apply_change(self, change):
+        entity = change.get("entity")
+        if entity == self.CONFIGURATION:
+            self._forget_configuration(change.get("key"))
+        elif entity == self.PROFILE:
+            self.clear_cache([self.PROFILE, self.DEVICE])
+        elif entity in (self.DEVICE, self.GROUP):
+            self.clear_cache([entity])
+        else:
+            self.clear_cache()
+
+    def _check_store_key(self):
+        """Forget everything when the wrapped store says it changed."""
+        key = self.datastore._get_cache_key()
+        if key is not None and key != self._store_key:
+            self.clear_cache()
+            self._store_key = key
+
+    def _cached_call(self, entity, key, function_name, args):
+        """
+        Return the cached value for key, or call function_name on the wrapped store and cache what it returns.
+        """
+        self._check_store_key()
+        with self._lock:
+            found, value = self._caches[entity].get(key)
+            generation = self._generation
+        if found:
+            return copy.deepcopy(value)
+        value = getattr(self.datastore, function_name)(*args)
+        with self._lock:
+            if generation == self._generation:
+                self._caches[entity].put(key, copy.deepcopy(value))
+        return value
+
+    def _cache_devices(self, devices, generation):
+        """Cache complete devices under their device_id, hostname and ip_address."""
+        with self._lock:
+            if generation != self._generation:
+                return
+            cache = self._caches[self.DEVICE]
+            for device in devices:
+                stored = device if isinstance(device, DeviceRecord) else DeviceRecord(device)
+                for name in [device.get("device_id"), device.get("hostname"), device.get("ip_address")]:
+                    if name is not None:
+                        cache.put(name, stored)
+
+    def _get_cache_key(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        return self.datastore._get_cache_key()
+
+    def get_device(self, device_name):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).get_device(device_name)
+        self._check_store_key()
+        with self._lock:
+            found, device = self._caches[self.DEVICE].get(device_name)
+            generation = self._generation
+        if found:
+            return None if device is None else device.to_dict()
+        device = self.datastore.get_device(device_name)
+        record = None if device is None else DeviceRecord(device)
+        with self._lock:
+            if generation == self._generation:
+                self._caches[self.DEVICE].put(device_name, record)
+        if record is not None:
+            self._cache_devices([record], generation)
+        return device
+
+    def get_devices(self, device_list, include_related=()):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        Devices that aren't cached yet are read with prefetch_devices(), the rest come from the cache.
+        """
+        if not isinstance(device_list, list):
+            device_list = self.expand_device_list(device_list)
+        self.prefetch_devices(device_list, include_related)
+        return super(CachingDataStore, self).get_devices(device_list, include_related)
+
+    def prefetch_devices(self, device_list, include_related=()):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        Devices that aren't cached yet are all read with one get_devices() call, and the related devices of devices
+        that were cached already with at most one more.
+        """
+        if not isinstance(device_list, list):
+            device_list = self.expand_device_list(device_list)
+        names = list(device_list)
+        self._check_store_key()
+        missing, generation = self._uncached_devices(names)
+        if missing:
+            self._cache_found_devices(self.datastore.get_devices(missing, include_related), generation)
+        if not include_related:
+            return
+        with self._lock:
+            cache = self._caches[self.DEVICE]
+            devices = [cache.get(name)[1] for name in names if cache.contains(name)]
+        related, generation = self._uncached_devices(self._related_device_names(devices, include_related))
+        if related:
+            self._cache_found_devices(self.datastore.get_devices(related), generation)
+
+    def _uncached_devices(self, names):
+        """:return: (the names that aren't cached, the current generation)"""
+        with self._lock:
+            cache = self._caches[self.DEVICE]
+            return [name for name in names if not cache.contains(name)], self._generation
+
+    def _cache_found_devices(self, found, generation):
+        """Cache the result of DataStore.get_devices(), including the names that weren't found."""
+        self._cache_devices([device for device in found.values() if device is not None], generation)
+        with self._lock:
+            if generation == self._generation:
+                cache = self._caches[self.DEVICE]
+                for name, device in found.items():
+                    if device is None:
+                        cache.put(name, None)
+
+    def subscribe(self, callback=None, entities=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        return self.datastore.subscribe(callback, entities)
+
+    def list_devices(self, filters=None, fields=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        Lists are not cached, but the devices in them are when all fields were asked for.
+        """
+        super(CachingDataStore, self).list_devices(filters, fields)
+        with self._lock:
+            generation = self._generation
+        devices = self.datastore.list_devices(filters, fields)
+        if fields is None:
+            self._cache_devices(devices, generation)
+        return devices
+
+    def set_device(self, device_info_list):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).set_device(device_info_list)
+        try:
+            return self.datastore.set_device(device_info_list)
+        finally:
+            self.clear_cache([self.DEVICE])
+
+    def delete_device(self, device_list):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).delete_device(device_list)
+        try:
+            return self.datastore.delete_device(device_list)
+        finally:
+            self.clear_cache([self.DEVICE])
+
+    def get_device_history(self, device_name=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).get_device_history(device_name)
+        return self.datastore.get_device_history(device_name)
+
+    def list_devices_as_of(self, timestamp, device_list=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        self.logger.debug("DataStore.list_devices_as_of called: {}".format(timestamp), device_name=device_list)
+        return self.datastore.list_devices_as_of(timestamp, device_list)
+
+    def get_profile(self, profile_name):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).get_profile(profile_name)
+        return self._cached_call(self.PROFILE, str(profile_name), "get_profile", [profile_name])
+
+    def list_profiles(self, filters=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).list_profiles(filters)
+        return self.datastore.list_profiles(filters)
+
+    def set_profile(self, profile_info):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).set_profile(profile_info)
+        try:
+            return self.datastore.set_profile(profile_info)
+        finally:
+            self.clear_cache([self.PROFILE, self.DEVICE])
+
+    def delete_profile(self, profile_name):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).delete_profile(profile_name)
+        try:
+            return self.datastore.delete_profile(profile_name)
+        finally:
+            self.clear_cache([self.PROFILE, self.DEVICE])
+
+    def list_logs(self, device_name=None, limit=100):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).list_logs(device_name, limit)
+        return self.datastore.list_logs(device_name, limit)
+
+    def list_logs_between_timeslice(self, begin, end, device_name=None, limit=100):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).list_logs_between_timeslice(begin, end, device_name, limit)
+        return self.datastore.list_logs_between_timeslice(begin, end, device_name, limit)
+
+    def add_log(self, level, msg, device_name=None, process=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).add_log(level, msg, device_name, process)
+        return self.datastore.add_log(level, msg, device_name, process)
+
+    def get_configuration_value(self, key):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).get_configuration_value(key)
+        return self._cached_call(self.CONFIGURATION, key, "get_configuration_value", [key])
+
+    def list_configuration(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).list_configuration()
+        return self.datastore.list_configuration()
+
+    def set_configuration(self, key, value):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).set_configuration(key, value)
+        try:
+            return self.datastore.set_configuration(key, value)
+        finally:
+            self._forget_configuration(key)
+
+    def delete_configuration(self, key):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).delete_configuration(key)
+        try:
+            return self.datastore.delete_configuration(key)
+        finally:
+            self._forget_configuration(key)
+
+    def _forget_configuration(self, key):
+        with self._lock:
+            self._caches[self.CONFIGURATION].pop(key)
+            self._generation += 1
+
+    def list_groups(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).list_groups()
+        return self._cached_call(self.GROUP, self._ALL_GROUPS, "list_groups", [])
+
+    def get_group_devices(self, group):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).get_group_devices(group)
+        return self._cached_call(self.GROUP, group, "get_group_devices", [group])
+
+    def add_to_group(self, device_list, group):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).add_to_group(device_list, group)
+        try:
+            return self.datastore.add_to_group(device_list, group)
+        finally:
+            self.clear_cache([self.GROUP])
+
+    def remove_from_group(self, device_list, group):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).remove_from_group(device_list, group)
+        try:
+            return self.datastore.remove_from_group(device_list, group)
+        finally:
+            self.clear_cache([self.GROUP])
+
+    def get_device_types(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        return self.datastore.get_device_types()
+
+    def export_to_file(self, file_location):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).export_to_file(file_location)
+        return self.datastore.export_to_file(file_location)
+
+    def import_from_file(self, file_location):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        super(CachingDataStore, self).import_from_file(file_location)
+        try:
+            return self.datastore.import_from_file(file_location)
+        finally:
+            self.clear_cache()
+
+    def export_to_stream(self, file_location):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        return self.datastore.export_to_stream(file_location)
+
+    def import_from_stream(self, file_location, batch_size=None, progress=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        try:
+            return self.datastore.import_from_stream(file_location, batch_size, progress)
+        finally:
+            self.clear_cache()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Device, profile, group and configuration changes published by the PostgresStore triggers.
+"""
+import json
+import select
+import threading
+import psycopg2
+from .datastore import DataStoreException
+
+
+class ChangeFeed(object):
+    """
+    Listens on the channel the PostgresStore triggers notify for every changed row, on its own connection.
+
+    A change is a dict like {"entity": "device", "operation": "update", "key": "12"}, where entity is one of
+    ENTITIES, operation is insert, update or delete and key is the device_id, profile_name, group_name or
+    configuration key. When the connection is lost changes may be missed, so after reconnecting a
+    {"entity": None, "operation": "reset", "key": None} change is given: everything should be read again.
+
+    Use it as a generator (for change in feed) or give start() a callback that is called on a background thread.
+    close() ends both.
+    """
+    CHANNEL = "datastore_changes"
+    ENTITIES = ["device", "profile", "group", "configuration"]
+    RESET = "reset"
+    POLL_SECONDS = 1.0
+    RECONNECT_SECONDS = 5.0
+
+    def __init__(self, connection_uri, entities=None, logger=None):
+        """
+        :param connection_uri: passed to psycopg2.connect()
+        :param entities: Only give changes of these entities (see ENTITIES), all of them by default. Resets are
+                         always given.
+        :param logger:
+        """
+        unknown = set(entities or []) - set(self.ENTITIES)
+        if unknown:
+            raise DataStoreException("Unknown entities {}, expected some of {}".format(sorted(unknown),
+                                                                                      self.ENTITIES))
+        self.connection_uri = connection_uri
+        self.entities = set(entities) if entities else None
+        self.logger = logger
+        self._connection = None
+        self._lost = False
+        self._closed = threading.Event()
+        self._thread = None
+
+    def listen(self):
+        """
+        Open the connection and start listening. Changes committed after this returns are not missed.
+        :return:
+        """
+        try:
+            connection = psycopg2.connect(self.connection_uri)
+            connection.set_session(autocommit=True)
+            cursor = connection.cursor()
+            cursor.execute("LISTEN {};".format(self.CHANNEL))
+            cursor.close()
+        except psycopg2.Error as error:
+            raise DataStoreException("Could not listen for changes: {}".format(error))
+        self._connection = connection
+
+    def poll(self, timeout=None):
+        """
+        Wait for changes.
+        :param timeout: Seconds to wait when there are no changes yet, None waits until there are.
+        :return: list of changes, empty when there were none within timeout
+        """
+        if self._closed.is_set():
+            return []
+        if self._connection is None:
+            if not self._reconnect(timeout):
+                return []
+            if self._lost:
+                self._lost = False
+                return [self._reset()]
+        try:
+            if not self._connection.notifies:
+                select.select([self._connection], [], [], timeout)
+            self._connection.poll()
+        except (psycopg2.Error, OSError, ValueError) as error:
+            self._log("warning", "Lost the connection for changes, will reconnect: {}".format(error))
+            self._disconnect()
+            self._lost = True
+            return []
+        changes = list()
+        while self._connection.notifies:
+            change = self._parse(self._connection.notifies.pop(0).payload)
+            if change is not None and (self.entities is None or change["entity"] in self.entities):
+                changes.append(change)
+        return changes
+
+    def __iter__(self):
+        while not self._closed.is_set():
+            for change in self.poll(self.POLL_SECONDS):
+                yield change
+
+    def start(self, callback):
+        """
+        Call callback(change) for every change on a background thread, until close() is called.
+        :param callback:
+        :return: self
+        """
+        if self._thread is not None:
+            raise DataStoreException("This ChangeFeed was started already")
+
+        def _run():
+            for change in self:
+                try:
+                    callback(change)
+                except Exception as error:
+                    self._log("error", "Change callback failed for {}: {}".format(change, error))
+
+        self._thread = threading.Thread(target=_run, name="datastore-change-feed")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop listening, and wait for the callback thread to end.
+        :return:
+        """
+        self._closed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._disconnect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _reconnect(self, timeout):
+        try:
+            self.listen()
+            return True
+        except DataStoreException as error:
+            self._log("warning", str(error))
+            self._lost = True
+            wait = self.RECONNECT_SECONDS if timeout is None else min(timeout, self.RECONNECT_SECONDS)
+            self._closed.wait(wait)
+            return False
+
+    def _disconnect(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+    def _parse(self, payload):
+        try:
+            change = json.loads(payload)
+        except ValueError:
+            self._log("warning", "Ignoring a change that isn't JSON: {}".format(payload))
+            return None
+        return {"entity": change.get("entity"), "operation": change.get("operation"), "key": change.get("key")}
+
+    def _reset(self):
+        return {"entity": None, "operation": self.RESET, "key": None}
+
+    def _log(self, level, msg):
+        if self.logger is not None:
+            getattr(self.logger, level)(msg)
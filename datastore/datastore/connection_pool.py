@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+A bounded, thread safe pool of postgres connections for PostgresStore.
+"""
+import time
+import threading
+import psycopg2
+from .datastore import DataStoreException
+
+
+class PooledConnection(object):
+    """
+    One connection of the pool, with its cursor and the statements prepared on it.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.prepared = set()
+        self.owner = None
+        self.released_at = time.time()
+
+    def close(self):
+        """
+        Close the cursor and the connection, ignoring connections that are already broken.
+        :return:
+        """
+        for item in [self.cursor, self.connection]:
+            if item is None:
+                continue
+            try:
+                item.close()
+            except psycopg2.Error:
+                pass
+
+
+class ConnectionPool(object):
+    """
+    Hands out at most max_size connections, one per thread. A thread keeps its connection until it calls release()
+    or ends, a connection held by a thread that ended is taken back the next time the pool runs out.
+
+    Connections that were idle for longer than health_check_seconds are checked with 'SELECT 1' before they are
+    handed out again, and replaced when that fails.
+    """
+    HEALTH_CHECK_SECONDS = 30
+
+    def __init__(self, connection_uri, max_size, timeout=None, health_check_seconds=None):
+        """
+        :param connection_uri: passed to psycopg2.connect()
+        :param max_size: The most connections that are open at one time.
+        :param timeout: Seconds to wait for a connection when all of them are in use, None waits forever.
+        :param health_check_seconds: Idle time after which a connection is checked before it is used.
+        """
+        if max_size < 1:
+            raise DataStoreException("A connection pool needs room for at least one connection")
+        self.connection_uri = connection_uri
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_seconds = health_check_seconds if health_check_seconds is not None \
+            else self.HEALTH_CHECK_SECONDS
+        self._idle = list()
+        self._in_use = list()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._stats = {
+            "acquired": 0,
+            "waited": 0,
+            "timed_out": 0,
+            "replaced": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def acquire(self):
+        """
+        Get a connection for the calling thread.
+        :return: PooledConnection
+        :raise DataStoreException: when no connection could be made or freed up in time.
+        """
+        start = time.time()
+        waited = False
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise DataStoreException("The connection pool for `{}` is closed".format(self.connection_uri))
+                pooled = self._take()
+                if pooled is not None:
+                    break
+                remaining = None
+                if self.timeout is not None:
+                    remaining = self.timeout - (time.time() - start)
+                    if remaining <= 0:
+                        self._stats["timed_out"] += 1
+                        self._count_wait(time.time() - start)
+                        raise DataStoreException("No postgres connection became available within {} seconds, all {} "
+                                                 "are in use".format(self.timeout, self.max_size))
+                waited = True
+                self._condition.wait(remaining)
+
+            pooled.owner = threading.current_thread()
+            self._in_use.append(pooled)
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waited"] += 1
+            self._count_wait(time.time() - start)
+
+        if time.time() - pooled.released_at > self.health_check_seconds and not self._is_healthy(pooled):
+            pooled = self._replace(pooled)
+        return pooled
+
+    def release(self, pooled, discard=False):
+        """
+        Give a connection back. Uncommitted changes on it are rolled back.
+        :param pooled: PooledConnection from acquire()
+        :param discard: Close the connection instead of reusing it, i.e. when it is known to be broken.
+        :return:
+        """
+        if not discard:
+            try:
+                pooled.connection.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._condition:
+            if pooled in self._in_use:
+                self._in_use.remove(pooled)
+            pooled.owner = None
+            pooled.released_at = time.time()
+            if discard or self._closed:
+                pooled.close()
+            else:
+                self._idle.append(pooled)
+            self._condition.notify()
+
+    def replace(self, pooled):
+        """
+        Close a broken connection and open a new one in its place, for the same thread.
+        :param pooled: PooledConnection from acquire()
+        :return: The new PooledConnection
+        """
+        return self._replace(pooled)
+
+    def close(self):
+        """
+        Close all connections, including the ones in use. The pool can't be used afterwards.
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            for pooled in self._idle + self._in_use:
+                pooled.close()
+            self._idle = list()
+            self._in_use = list()
+            self._condition.notify_all()
+
+    def stats(self):
+        """
+        :return: dict with the pool size and counters, including how long threads waited for a connection.
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats["max_size"] = self.max_size
+            stats["in_use"] = len(self._in_use)
+            stats["idle"] = len(self._idle)
+        return stats
+
+    def _count_wait(self, wait_seconds):
+        """Called with the condition held."""
+        self._stats["total_wait_seconds"] += wait_seconds
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], wait_seconds)
+
+    def _take(self):
+        """Called with the condition held. Returns a connection, or None when the caller has to wait."""
+        if self._idle:
+            return self._idle.pop()
+        if len(self._in_use) >= self.max_size:
+            self._reclaim_from_ended_threads()
+            if self._idle:
+                return self._idle.pop()
+        if len(self._in_use) < self.max_size:
+            return PooledConnection(self._connect())
+        return None
+
+    def _reclaim_from_ended_threads(self):
+        for pooled in list(self._in_use):
+            if pooled.owner is not None and not pooled.owner.is_alive():
+                self._in_use.remove(pooled)
+                pooled.owner = None
+                # The thread can't have committed what it left behind.
+                try:
+                    pooled.connection.rollback()
+                    self._idle.append(pooled)
+                except psycopg2.Error:
+                    pooled.close()
+
+    def _connect(self):
+        connection = psycopg2.connect(self.connection_uri)
+        if connection is None:
+            raise DataStoreException("Unable to connect to postgres with connection: `{}`".format(self.connection_uri))
+        return connection
+
+    def _replace(self, pooled):
+        new_pooled = PooledConnection(self._connect())
+        pooled.close()
+        with self._condition:
+            new_pooled.owner = pooled.owner
+            if pooled in self._in_use:
+                self._in_use.remove(pooled)
+            self._in_use.append(new_pooled)
+            self._stats["replaced"] += 1
+        return new_pooled
+
+    @staticmethod
+    def _is_healthy(pooled):
+        try:
+            pooled.cursor.execute("SELECT 1;")
+            pooled.cursor.fetchall()
+            pooled.connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
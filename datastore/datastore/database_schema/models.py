@@ -16,8 +16,8 @@ from alembic import command
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import Column, create_engine
-from sqlalchemy import DateTime
-from sqlalchemy import ForeignKey, Integer, String
+from sqlalchemy import Date, DateTime
+from sqlalchemy import BigInteger, ForeignKey, Integer, String
 from sqlalchemy import Text, BOOLEAN
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext import declarative, compiler
@@ -125,6 +125,18 @@ class Log(Base):
     message = Column(Text, nullable=False)
 
 
+class LogSummary(Base):
+    """log_summary table, per day counts of the logs in expired log partitions"""
+    __tablename__ = 'log_summary'
+    day = Column(Date, nullable=False, primary_key=True)
+    device_id = Column(Integer, primary_key=True)
+    process = Column(String(128), primary_key=True)
+    level = Column(Integer, nullable=False, primary_key=True)
+    entries = Column(BigInteger, nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+
+
 class Profile(Base):
     """profile table"""
     __tablename__ = 'profile'
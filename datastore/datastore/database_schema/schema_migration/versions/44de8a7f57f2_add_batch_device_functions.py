@@ -0,0 +1,110 @@
+"""Adding set based functions to upsert and delete many devices at once
+
+Revision ID: 44de8a7f57f2
+Revises: d43655797899
+Create Date: 2017-09-12 10:41:27.518204
+
+"""
+import textwrap
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '44de8a7f57f2'
+down_revision = 'd43655797899'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Upgrade to add upsert_devices and delete_devices.
+    :return:
+    """
+    # p_devices is a JSON array of objects with the keys device_id, device_type, hostname, ip_address, mac_address,
+    # profile_name and properties. One change_result row is returned per array element, in array order.
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.upsert_devices(p_devices jsonb)
+        RETURNS SETOF change_result AS
+        $BODY$
+        BEGIN
+            RETURN QUERY
+            WITH input AS (
+                SELECT item.position,
+                    COALESCE((item.device->>'device_id')::integer,
+                        nextval(pg_get_serial_sequence('public.device', 'device_id'))::integer) AS device_id,
+                    item.device
+                FROM jsonb_array_elements(p_devices) WITH ORDINALITY AS item(device, position)
+            ), latest AS (
+            -- A device that is listed more than once is written once, with the values listed last.
+                SELECT DISTINCT ON (input.device_id) input.device_id, input.device
+                FROM input
+                ORDER BY input.device_id, input.position DESC
+            ), upserted AS (
+                INSERT INTO public.device AS dev (device_id, device_type, properties, hostname, ip_address,
+                    mac_address, profile_name)
+                SELECT latest.device_id, latest.device->>'device_type', latest.device->'properties',
+                    latest.device->>'hostname', latest.device->>'ip_address', latest.device->>'mac_address',
+                    latest.device->>'profile_name'
+                FROM latest
+                ON CONFLICT ON CONSTRAINT device_pkey DO UPDATE
+                SET
+                    device_type = EXCLUDED.device_type,
+                    properties = EXCLUDED.properties,
+                    hostname = EXCLUDED.hostname,
+                    ip_address = EXCLUDED.ip_address,
+                    mac_address = EXCLUDED.mac_address,
+                    profile_name = EXCLUDED.profile_name
+                RETURNING dev.device_id
+            )
+            SELECT CASE WHEN upserted.device_id IS NULL THEN 0 ELSE 1 END, input.device_id
+            FROM input
+            LEFT JOIN upserted ON upserted.device_id = input.device_id
+            ORDER BY input.position;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    # All names are resolved to device ids before anything is deleted. A device that is named more than once is
+    # reported as deleted for the first name only, like it would be by calling delete_device once per name.
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.delete_devices(p_device_names character varying[])
+        RETURNS SETOF change_result AS
+        $BODY$
+        BEGIN
+            RETURN QUERY
+            WITH input AS (
+                SELECT item.position, public.get_device_id(item.device_name) AS device_id
+                FROM unnest(p_device_names) WITH ORDINALITY AS item(device_name, position)
+            ), deleted AS (
+                DELETE FROM public.device
+                WHERE device.device_id IN (SELECT input.device_id FROM input)
+                RETURNING device.device_id
+            ), numbered AS (
+                SELECT input.position, input.device_id,
+                    row_number() OVER (PARTITION BY input.device_id ORDER BY input.position) AS occurrence
+                FROM input
+            )
+            SELECT CASE WHEN deleted.device_id IS NULL OR numbered.occurrence > 1 THEN 0 ELSE 1 END,
+                numbered.device_id
+            FROM numbered
+            LEFT JOIN deleted ON deleted.device_id = numbered.device_id
+            ORDER BY numbered.position;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+
+def downgrade():
+    """
+    Downgrade to remove upsert_devices and delete_devices.
+    :return:
+    """
+    op.execute("DROP FUNCTION public.delete_devices(character varying[]);")
+    op.execute("DROP FUNCTION public.upsert_devices(jsonb);")
@@ -0,0 +1,40 @@
+"""Adding indexes for filtering devices
+
+Revision ID: 80de6bf3d0b1
+Revises: 44de8a7f57f2
+Create Date: 2017-09-19 14:06:52.331870
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '80de6bf3d0b1'
+down_revision = '44de8a7f57f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Upgrade to add the indexes used by list_devices filters (and by device name lookups).
+    :return:
+    """
+    op.create_index(op.f('ix_device_device_type'), 'device', ['device_type'])
+    op.create_index(op.f('ix_device_hostname'), 'device', ['hostname'])
+    op.create_index(op.f('ix_device_ip_address'), 'device', ['ip_address'])
+    op.create_index(op.f('ix_device_profile_name'), 'device', ['profile_name'])
+    # jsonb_ops (not jsonb_path_ops), so both @> and ? can use it
+    op.create_index(op.f('ix_device_properties'), 'device', ['properties'], postgresql_using='gin')
+
+
+def downgrade():
+    """
+    Downgrade to remove the device filter indexes.
+    :return:
+    """
+    op.drop_index(op.f('ix_device_properties'), table_name='device')
+    op.drop_index(op.f('ix_device_profile_name'), table_name='device')
+    op.drop_index(op.f('ix_device_ip_address'), table_name='device')
+    op.drop_index(op.f('ix_device_hostname'), table_name='device')
+    op.drop_index(op.f('ix_device_device_type'), table_name='device')
@@ -0,0 +1,311 @@
+"""Partitioning the log table by month, with a summary table for expired logs
+
+Revision ID: 94e51b42eece
+Revises: 80de6bf3d0b1
+Create Date: 2017-09-26 09:12:40.884615
+
+"""
+import textwrap
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '94e51b42eece'
+down_revision = '80de6bf3d0b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Upgrade to partition the log table.
+
+    This uses table inheritance (not declarative partitioning) so it works with Postgres 9.6. Every month (in UTC) is
+    a table log_pYYYYMM that inherits from log, with a CHECK constraint on timestamp so queries with a time range only
+    scan the months in that range. Rows inserted into log are moved to their month by a trigger, the month table is
+    created when it doesn't exist yet.
+    :return:
+    """
+    op.create_table('log_summary',
+                    sa.Column('day', sa.Date(), nullable=False),
+                    sa.Column('device_id', sa.Integer(), nullable=True),
+                    sa.Column('process', sa.String(length=128), nullable=True),
+                    sa.Column('level', sa.Integer(), nullable=False),
+                    sa.Column('entries', sa.BigInteger(), nullable=False),
+                    sa.Column('first_timestamp', sa.DateTime(timezone=True), nullable=False),
+                    sa.Column('last_timestamp', sa.DateTime(timezone=True), nullable=False)
+                    )
+    op.create_index(op.f('ix_log_summary_device_id_day'), 'log_summary', ['device_id', 'day'])
+
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.create_log_partition(p_timestamp timestamp with time zone)
+        RETURNS character varying AS
+        $BODY$
+        DECLARE
+        v_month timestamp without time zone;
+        v_partition character varying;
+        BEGIN
+            v_month := date_trunc('month', p_timestamp AT TIME ZONE 'UTC');
+            v_partition := 'log_p' || to_char(v_month, 'YYYYMM');
+            IF (to_regclass('public.' || v_partition) IS NULL) THEN
+                -- Concurrent inserts for a new month must not create the same table twice.
+                PERFORM pg_advisory_xact_lock(hashtext('public.log partitions'));
+                EXECUTE format('CREATE TABLE IF NOT EXISTS public.%I ('
+                    'CHECK ("timestamp" >= %L AND "timestamp" < %L)) INHERITS (public.log)',
+                    v_partition, v_month AT TIME ZONE 'UTC', (v_month + interval '1 month') AT TIME ZONE 'UTC');
+                EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON public.%I (device_id, "timestamp")',
+                    'ix_' || v_partition || '_device_id_timestamp', v_partition);
+                EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON public.%I (level, "timestamp")',
+                    'ix_' || v_partition || '_level_timestamp', v_partition);
+                EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON public.%I ("timestamp")',
+                    'ix_' || v_partition || '_timestamp', v_partition);
+            END IF;
+            RETURN v_partition;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.log_partition_insert()
+        RETURNS trigger AS
+        $BODY$
+        BEGIN
+            IF (NEW.timestamp IS NULL) THEN
+                NEW.timestamp := now();
+            END IF;
+            EXECUTE format('INSERT INTO public.%I SELECT ($1).*', public.create_log_partition(NEW.timestamp))
+                USING NEW;
+            RETURN NULL;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    op.execute(textwrap.dedent("""
+        CREATE TRIGGER log_partition_insert
+            BEFORE INSERT ON public.log
+            FOR EACH ROW EXECUTE PROCEDURE public.log_partition_insert();
+    """))
+
+    # Move the existing logs into their months.
+    op.execute(textwrap.dedent("""
+        WITH moved AS (
+            DELETE FROM ONLY public.log
+            RETURNING process, "timestamp", level, device_id, message
+        )
+        INSERT INTO public.log (process, "timestamp", level, device_id, message)
+        SELECT process, "timestamp", level, device_id, message FROM moved;
+    """))
+
+    # The trigger makes INSERT INTO public.log report 0 rows, so add_log inserts into the month table itself.
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.add_log(p_process character varying, p_timestamp timestamp with time zone,
+        p_level integer, p_device_name character varying, p_message text)
+        RETURNS integer AS
+        $BODY$
+        DECLARE num_rows integer;
+        DECLARE m_device_id integer;
+        BEGIN
+            m_device_id := null;
+            IF (p_device_name is not null) THEN
+                m_device_id := public.get_device_id(p_device_name);
+            END IF;
+            IF (p_timestamp IS NULL) THEN
+                p_timestamp := now();
+            END IF;
+
+            EXECUTE format('INSERT INTO public.%I (message, level, process, "timestamp", device_id) '
+                'VALUES ($1, $2, $3, $4, $5)', public.create_log_partition(p_timestamp))
+                USING p_message, p_level, p_process, p_timestamp, m_device_id;
+
+        GET DIAGNOSTICS num_rows = ROW_COUNT;
+        RETURN num_rows;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    # EXECUTE plans with the actual time range, so only the months in the range are scanned.
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.get_log_timeslice(
+        IN p_device_name character varying,
+        IN p_limit integer,
+        IN p_time_begin timestamp with time zone,
+        IN p_time_end timestamp with time zone)
+        RETURNS TABLE(process character varying, "timestamp" timestamp with time zone, level integer, device_id integer,
+        message text) AS
+        $BODY$
+        DECLARE
+        v_device_id integer;
+        BEGIN
+
+            IF (p_device_name is null) THEN
+                RETURN QUERY EXECUTE 'SELECT l.process, l.timestamp, l.level, l.device_id, l.message
+                FROM public.log AS l
+                WHERE l.timestamp BETWEEN $1 AND $2
+                ORDER BY l.timestamp DESC LIMIT $3' USING p_time_begin, p_time_end, p_limit;
+            ELSE
+                -- Get the device ID
+                v_device_id := public.get_device_id(p_device_name);
+                RETURN QUERY EXECUTE 'SELECT l.process, l.timestamp, l.level, l.device_id, l.message
+                FROM public.log AS l
+                WHERE l.device_id = $1 AND l.timestamp BETWEEN $2 AND $3
+                ORDER BY l.timestamp DESC LIMIT $4' USING v_device_id, p_time_begin, p_time_end, p_limit;
+            END IF;
+
+        END;
+
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.expire_log_partitions(p_older_than timestamp with time zone,
+            p_summarize boolean)
+        RETURNS integer AS
+        $BODY$
+        DECLARE
+        v_partition character varying;
+        v_end timestamp with time zone;
+        num_partitions integer;
+        BEGIN
+            num_partitions := 0;
+            FOR v_partition IN
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = 'public.log'::regclass AND child.relname ~ '^log_p[0-9]{6}$'
+                ORDER BY child.relname
+            LOOP
+                v_end := (to_timestamp(substr(v_partition, 6), 'YYYYMM')::timestamp without time zone
+                    + interval '1 month') AT TIME ZONE 'UTC';
+                -- Only whole months are expired.
+                IF (v_end <= p_older_than) THEN
+                    IF (p_summarize) THEN
+                        EXECUTE format('INSERT INTO public.log_summary (day, device_id, process, level, entries, '
+                            'first_timestamp, last_timestamp) '
+                            'SELECT ("timestamp" AT TIME ZONE ''UTC'')::date, device_id, process, level, count(*), '
+                            'min("timestamp"), max("timestamp") FROM public.%I GROUP BY 1, 2, 3, 4', v_partition);
+                    END IF;
+                    EXECUTE format('DROP TABLE public.%I', v_partition);
+                    num_partitions := num_partitions + 1;
+                END IF;
+            END LOOP;
+            RETURN num_partitions;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+
+def downgrade():
+    """
+    Downgrade to a single log table. Summarized logs are lost.
+    :return:
+    """
+    op.execute("DROP FUNCTION public.expire_log_partitions(timestamp with time zone, boolean);")
+    op.execute("DROP TRIGGER log_partition_insert ON public.log;")
+    op.execute("DROP FUNCTION public.log_partition_insert();")
+    op.execute(textwrap.dedent("""
+        WITH moved AS (
+            DELETE FROM public.log AS l
+            WHERE l.tableoid <> 'public.log'::regclass
+            RETURNING l.process, l.timestamp, l.level, l.device_id, l.message
+        )
+        INSERT INTO public.log (process, "timestamp", level, device_id, message)
+        SELECT process, "timestamp", level, device_id, message FROM moved;
+    """))
+    op.execute(textwrap.dedent("""
+        DO $$
+        DECLARE
+        v_partition character varying;
+        BEGIN
+            FOR v_partition IN
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = 'public.log'::regclass
+            LOOP
+                EXECUTE format('DROP TABLE public.%I', v_partition);
+            END LOOP;
+        END $$;
+    """))
+    op.execute("DROP FUNCTION public.create_log_partition(timestamp with time zone);")
+
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.add_log(p_process character varying, p_timestamp timestamp with time zone,
+        p_level integer, p_device_name character varying, p_message text)
+        RETURNS integer AS
+        $BODY$
+        DECLARE num_rows integer;
+        DECLARE m_device_id integer;
+        BEGIN
+            m_device_id := null;
+            IF (p_device_name is not null) THEN
+                m_device_id := public.get_device_id(p_device_name);
+            END IF;
+
+            EXECUTE 'INSERT INTO public.log (message, level' ||
+                CASE WHEN p_process IS NULL THEN '' ELSE ', process' END ||
+                CASE WHEN p_timestamp IS NULL THEN '' ELSE ', timestamp' END ||
+                CASE WHEN m_device_id IS NULL THEN '' ELSE ', device_id' END ||')
+            VALUES (' || quote_literal(p_message) ||', ' || p_level ||
+                CASE WHEN p_process IS NULL THEN '' ELSE ', ' || quote_literal(p_process) END ||
+                CASE WHEN p_timestamp IS NULL THEN '' ELSE ', ' || quote_literal(p_timestamp) END ||
+                CASE WHEN m_device_id IS NULL THEN '' ELSE ', ' || m_device_id END ||');';
+
+        GET DIAGNOSTICS num_rows = ROW_COUNT;
+        RETURN num_rows;
+        END;
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.get_log_timeslice(
+        IN p_device_name character varying,
+        IN p_limit integer,
+        IN p_time_begin timestamp with time zone,
+        IN p_time_end timestamp with time zone)
+        RETURNS TABLE(process character varying, "timestamp" timestamp with time zone, level integer, device_id integer, message text) AS
+        $BODY$
+        DECLARE
+        v_device_id integer;
+        BEGIN
+
+            IF (p_device_name is null) THEN
+                RETURN QUERY SELECT l.process, l.timestamp, l.level, l.device_id, l.message
+                FROM public.log AS l
+                WHERE l.timestamp BETWEEN p_time_begin AND p_time_end
+                ORDER BY l.timestamp DESC LIMIT p_limit;
+            ELSE
+                -- Get the device ID
+                v_device_id := public.get_device_id(p_device_name);
+                RETURN QUERY SELECT l.process, l.timestamp, l.level, l.device_id, l.message
+                FROM public.log AS l
+                WHERE l.device_id = v_device_id AND l.timestamp BETWEEN p_time_begin AND p_time_end
+                ORDER BY l.timestamp DESC LIMIT p_limit;
+            END IF;
+
+        END;
+
+
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+
+    op.drop_index(op.f('ix_log_summary_device_id_day'), table_name='log_summary')
+    op.drop_table('log_summary')
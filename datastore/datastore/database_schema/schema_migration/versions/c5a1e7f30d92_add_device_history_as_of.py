@@ -0,0 +1,70 @@
+"""Indexing device_history by time and adding point in time device queries
+
+Revision ID: c5a1e7f30d92
+Revises: 94e51b42eece
+Create Date: 2017-09-28 10:41:17.206318
+
+"""
+import textwrap
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a1e7f30d92'
+down_revision = '94e51b42eece'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Upgrade to index device_history on (device_id, sys_period) and add get_devices_as_of().
+
+    A GiST index is needed for the range containment (sys_period @> timestamp), btree_gist lets it include the
+    integer device_id so the versions of one device are found without reading the versions of all others.
+    :return:
+    """
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gist;")
+    op.create_index(op.f('ix_device_history_device_id_sys_period'), 'device_history', ['device_id', 'sys_period'],
+                    postgresql_using='gist')
+    op.create_index(op.f('ix_device_history_hostname'), 'device_history', ['hostname'])
+    op.create_index(op.f('ix_device_history_ip_address'), 'device_history', ['ip_address'])
+    op.create_index(op.f('ix_device_sys_period'), 'device', ['sys_period'], postgresql_using='gist')
+
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.get_devices_as_of(p_timestamp timestamp with time zone,
+                                                            p_device_names character varying[])
+        RETURNS SETOF type_device_details AS
+        $BODY$
+        BEGIN
+            -- The devices as they were stored at p_timestamp, names are matched against the values of that time.
+            RETURN QUERY SELECT versions.device_id, versions.device_type, versions.properties, versions.hostname,
+                versions.ip_address, versions.mac_address, versions.profile_name, cast(null AS JSONB),
+                versions.sys_period
+            FROM (
+                SELECT * FROM public.device WHERE sys_period @> p_timestamp
+                UNION ALL
+                SELECT * FROM public.device_history WHERE sys_period @> p_timestamp
+            ) AS versions
+            WHERE p_device_names IS NULL
+               OR cast(versions.device_id AS character varying) = ANY(p_device_names)
+               OR versions.hostname = ANY(p_device_names)
+               OR versions.ip_address = ANY(p_device_names)
+            ORDER BY versions.device_id;
+        END
+        $BODY$
+            LANGUAGE plpgsql STABLE
+            COST 100;
+    """))
+
+
+def downgrade():
+    """
+    Downgrade to remove get_devices_as_of() and the device_history indexes.
+    :return:
+    """
+    op.execute("DROP FUNCTION public.get_devices_as_of(timestamp with time zone, character varying[]);")
+    op.drop_index(op.f('ix_device_sys_period'), table_name='device')
+    op.drop_index(op.f('ix_device_history_ip_address'), table_name='device_history')
+    op.drop_index(op.f('ix_device_history_hostname'), table_name='device_history')
+    op.drop_index(op.f('ix_device_history_device_id_sys_period'), table_name='device_history')
@@ -0,0 +1,71 @@
+"""Adding a bulk device lookup that includes related devices
+
+Revision ID: d82f4b1c6a07
+Revises: c5a1e7f30d92
+Create Date: 2017-10-04 14:12:53.480116
+
+"""
+import textwrap
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd82f4b1c6a07'
+down_revision = 'c5a1e7f30d92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    """
+    Upgrade to add get_devices(), which returns the named devices and the devices named in their related keys (like
+    bmc or pdu_list) in one query.
+    :return:
+    """
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.get_devices(p_device_names character varying[],
+                                                      p_related_keys character varying[])
+        RETURNS SETOF type_device_details AS
+        $BODY$
+        BEGIN
+            RETURN QUERY WITH requested AS (
+                SELECT device.device_id, device.properties, profile.properties AS profile_properties
+                FROM public.device
+                LEFT JOIN public.profile ON device.profile_name = profile.profile_name
+                WHERE cast(device.device_id AS character varying) = ANY(p_device_names)
+                   OR device.hostname = ANY(p_device_names)
+                   OR device.ip_address = ANY(p_device_names)
+            ), related_values AS (
+                -- A related key may be set on the device or on its profile, the device wins.
+                SELECT COALESCE(requested.properties -> related_key,
+                                requested.profile_properties -> related_key) AS related_value
+                FROM requested, unnest(COALESCE(p_related_keys, '{}')) AS related_key
+            ), related_names AS (
+                SELECT jsonb_array_elements_text(related_value) AS related_name
+                FROM related_values WHERE jsonb_typeof(related_value) = 'array'
+                UNION
+                SELECT related_value #>> '{}'
+                FROM related_values WHERE jsonb_typeof(related_value) = 'string'
+            )
+            SELECT device.device_id, device.device_type, device.properties, device.hostname, device.ip_address,
+                device.mac_address, device.profile_name, profile.properties, device.sys_period
+            FROM public.device
+            LEFT JOIN public.profile ON device.profile_name = profile.profile_name
+            WHERE device.device_id IN (SELECT requested.device_id FROM requested)
+               OR cast(device.device_id AS character varying) IN (SELECT related_name FROM related_names)
+               OR device.hostname IN (SELECT related_name FROM related_names)
+               OR device.ip_address IN (SELECT related_name FROM related_names)
+            ORDER BY device.device_id;
+        END
+        $BODY$
+            LANGUAGE plpgsql STABLE
+            COST 100;
+    """))
+
+
+def downgrade():
+    """
+    Downgrade to remove get_devices().
+    :return:
+    """
+    op.execute("DROP FUNCTION public.get_devices(character varying[], character varying[]);")
@@ -0,0 +1,71 @@
+"""Publishing device, profile, group and configuration changes with pg_notify
+
+Revision ID: e1b7c3a95f24
+Revises: d82f4b1c6a07
+Create Date: 2017-10-06 11:27:05.913442
+
+"""
+import textwrap
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1b7c3a95f24'
+down_revision = 'd82f4b1c6a07'
+branch_labels = None
+depends_on = None
+
+# (table, entity, key column) for every table that publishes its changes.
+NOTIFYING_TABLES = [
+    ('device', 'device', 'device_id'),
+    ('profile', 'profile', 'profile_name'),
+    ('device_group', 'group', 'group_name'),
+    ('configuration', 'configuration', 'key'),
+]
+
+
+def upgrade():
+    """
+    Upgrade to notify the datastore_changes channel of every changed row.
+
+    The payload is only {"entity", "operation", "key"}, the rows themselves could be larger than a notification may
+    be. Notifications are sent when the transaction commits, so listeners never see changes that were rolled back.
+    :return:
+    """
+    op.execute(textwrap.dedent("""
+        CREATE OR REPLACE FUNCTION public.notify_datastore_change()
+        RETURNS trigger AS
+        $BODY$
+        DECLARE v_row jsonb;
+        BEGIN
+            -- TG_ARGV[0] is the entity, TG_ARGV[1] the column that names the changed row.
+            IF (TG_OP = 'DELETE') THEN
+                v_row := to_jsonb(OLD);
+            ELSE
+                v_row := to_jsonb(NEW);
+            END IF;
+            PERFORM pg_notify('datastore_changes', json_build_object('entity', TG_ARGV[0],
+                                                                     'operation', lower(TG_OP),
+                                                                     'key', v_row ->> TG_ARGV[1])::text);
+            RETURN NULL;
+        END
+        $BODY$
+            LANGUAGE plpgsql VOLATILE
+            COST 100;
+    """))
+    for table, entity, key_column in NOTIFYING_TABLES:
+        op.execute(textwrap.dedent("""
+            CREATE TRIGGER {0}_notify_change
+            AFTER INSERT OR UPDATE OR DELETE ON public.{0}
+            FOR EACH ROW EXECUTE PROCEDURE public.notify_datastore_change('{1}', '{2}');
+        """.format(table, entity, key_column)))
+
+
+def downgrade():
+    """
+    Downgrade to stop notifying changes.
+    :return:
+    """
+    for table, entity, key_column in NOTIFYING_TABLES:
+        op.execute("DROP TRIGGER {0}_notify_change ON public.{0};".format(table))
+    op.execute("DROP FUNCTION public.notify_datastore_change();")
@@ -8,20 +8,28 @@ Interface and Classes for using the DataStore
 import logging
 from logging import StreamHandler
 from abc import ABCMeta, abstractmethod
+from contextlib import contextmanager
 from ClusterShell.NodeSet import NodeSet, std_group_resolver, set_std_group_resolver, fold, NodeSetParseError
 from ClusterShell.NodeUtils import GroupSource, GroupResolver, GroupResolverConfig
+from .group_cache import GroupCache
+from .profile_cache import ProfileCache
+from .utilities import DataStoreUtilities
 
 
 class DataStoreGroupSource(GroupSource):
     def __init__(self, name, datastore, groups=None, allgroups=None):
         super(DataStoreGroupSource, self).__init__(name, groups, allgroups)
         self.datastore = datastore
+        self.has_reverse = True
 
     def resolv_map(self, group):
-        return self.datastore.get_group_devices(group)
+        return self.datastore.group_cache.get_group_nodes(group)
 
     def resolv_list(self):
-        return self.datastore.list_groups()
+        return self.datastore.group_cache.get_group_names()
+
+    def resolv_reverse(self, node):
+        return self.datastore.group_cache.get_device_groups(NodeSet(node))
 
 
 class DataStore(object, metaclass=ABCMeta):
@@ -41,9 +49,13 @@ class DataStore(object, metaclass=ABCMeta):
     LOG_LEVEL_DEBUG = logging.DEBUG
 
     DeviceListParseError = NodeSetParseError
+    # Devices read or set at a time by export_to_stream and import_from_stream
+    STREAM_BATCH_SIZE = 1000
 
     def __init__(self):
         self.logger = get_logger()
+        self.group_cache = GroupCache(self)
+        self.profile_cache = ProfileCache(self)
         self.datastore_group_resolver = self._setup_group_config()
 
     def _setup_group_config(self):
@@ -62,8 +74,102 @@ class DataStore(object, metaclass=ABCMeta):
         """
         self.logger.debug("DataStore.get_device called", device_name=device_name)
 
+    def get_devices(self, device_list, include_related=()):
+        """
+        Look many devices up at once, together with the devices they refer to.
+        :param device_list: A list of device names (see DataStore.get_device()@device_name), or a string like 'c[1-10]'
+        :param include_related: Keys of the devices that name other devices, like ("bmc", "pdu_list"). The value of such
+                                a key is a device name or a list of them (other list items are ignored).
+        :return: A dict of name to device (None when not found) for every name in device_list and every related
+                 device name, in that order.
+        """
+        self.logger.debug("DataStore.get_devices called, include_related={}".format(include_related),
+                          device_name=device_list)
+        if not isinstance(device_list, list):
+            device_list = self.expand_device_list(device_list)
+        devices = self._find_devices(device_list)
+        related = [name for name in self._related_device_names(devices.values(), include_related)
+                   if name not in devices]
+        if related:
+            devices.update(self._find_devices(related))
+        return devices
+
+    def _find_devices(self, device_names):
+        """
+        The devices for get_devices(), stores that can look many devices up at once override this.
+        :param device_names: list
+        :return: dict of name to device or None
+        """
+        return dict((device_name, self.get_device(device_name)) for device_name in device_names)
+
+    @staticmethod
+    def _related_device_names(devices, include_related):
+        """
+        :param devices: iterable of devices, may contain None
+        :param include_related: see get_devices()
+        :return: list of the device names in the include_related keys of the devices, without duplicates.
+        """
+        names = list()
+        seen = set()
+        for device in devices:
+            if device is None:
+                continue
+            for key in include_related or ():
+                value = device.get(key)
+                for name in value if isinstance(value, list) else [value]:
+                    if isinstance(name, str) and name not in seen:
+                        seen.add(name)
+                        names.append(name)
+        return names
+
+    @staticmethod
+    def _match_device_names(device_names, devices):
+        """
+        Pick the device for every name like get_device() would: by device_id, then hostname, then ip_address.
+        :param device_names: list
+        :param devices: list of devices that contains the devices with these names
+        :return: dict of name to device or None
+        """
+        by_key = dict()
+        for key in ["device_id", "hostname", "ip_address"]:
+            by_key[key] = dict()
+            for device in devices:
+                if device.get(key) is not None:
+                    by_key[key].setdefault(str(device.get(key)), device)
+        matched = dict()
+        for device_name in device_names:
+            device = None
+            for key in ["device_id", "hostname", "ip_address"]:
+                device = by_key[key].get(str(device_name))
+                if device is not None:
+                    break
+            matched[device_name] = device
+        return matched
+
+    def subscribe(self, callback=None, entities=None):
+        """
+        Follow the changes other processes make to devices, profiles, groups and configuration, so they don't have to
+        be read again and again to notice them. Only a PostgresStore publishes changes, see ChangeFeed for what a
+        change looks like.
+        :param callback: Called with every change on a background thread. Without a callback iterate over the
+                         returned ChangeFeed to get the changes.
+        :param entities: Only follow these, some of "device", "profile", "group" and "configuration".
+        :return: ChangeFeed, close() it when done.
+        """
+        raise DataStoreException("{} does not publish changes.".format(type(self).__name__))
+
+    def prefetch_devices(self, device_list, include_related=()):
+        """
+        Say that get_device() will be called for these devices soon. Stores that cache devices (see CachingDataStore)
+        read them all at once, other stores do nothing.
+        :param device_list: A list of device names (see DataStore.get_device()@device_name), or a string like 'c[1-10]'
+        :param include_related: see get_devices()
+        :return:
+        """
+        pass
+
     @abstractmethod
-    def list_devices(self, filters=None):
+    def list_devices(self, filters=None, fields=None):
         """
         Get the configuration information of the specified device.
 
@@ -75,9 +181,11 @@ class DataStore(object, metaclass=ABCMeta):
          as these three fields are unique you can ask for a node based on any of
          these fields. DataStore does not enforce uniqueness of names (but underlying implementation may).
          If conflicts ocour, the first found is returned.
+        :param filters: dict of key value pairs that a device must match, see DataStoreUtilities.filter_dict()
+        :param fields: list of keys to return for each device, all keys are returned when None.
         :return: A List of devices
         """
-        self.logger.debug("DataStore.list_devices called with filters {}".format(filters))
+        self.logger.debug("DataStore.list_devices called with filters {} and fields {}".format(filters, fields))
         return list()
 
     @abstractmethod
@@ -93,13 +201,15 @@ class DataStore(object, metaclass=ABCMeta):
         if not isinstance(device_info_list, list):
             device_info_list = [device_info_list]
 
+        profile_names = None
         for device_info in device_info_list:
             if device_info.get("device_type") is None:
                 raise DataStoreException("device_type is a required key/value in the device_info field")
 
             profile_name = device_info.get("profile_name")
             if profile_name is not None:
-                profile_names = self.get_profile_names()
+                if profile_names is None:
+                    profile_names = self.get_profile_names()
                 if profile_name not in profile_names:
                     raise DataStoreException("Cannot set device with profile '{}', because that profile "
                                              "does not exist.".format(profile_name))
@@ -122,6 +232,45 @@ class DataStore(object, metaclass=ABCMeta):
         """
         self.logger.debug("DataStore.get_device_history called", device_name=device_name)
 
+    def list_devices_as_of(self, timestamp, device_list=None):
+        """
+        The devices as they were stored at a point in time, without profile values (profiles have no history).
+        Devices that didn't exist yet or were already deleted at that time are left out. Stores that keep history
+        override this, the implementation here raises.
+        :param timestamp: datetime, naive datetimes are UTC
+        :param device_list: Optional device names or groups (see expand_device_list), matched against the device_id,
+                            hostname and ip_address the devices had at that time.
+        :return: A list of devices, ordered by device_id
+        :raise: DataStoreException when the store doesn't support point in time queries
+        """
+        raise DataStoreException("point in time queries not supported")
+
+    def diff_devices(self, begin, end, device_list=None):
+        """
+        Compare the devices at two points in time, see list_devices_as_of().
+        :param begin: datetime
+        :param end: datetime
+        :param device_list: Optional device names or groups, i.e. '@compute' for a whole group.
+        :return: A list of dicts, one for every device that is different, ordered by device_id:
+                 {"device_id": 1, "hostname": "c1", "before": {...}, "after": {...},
+                  "changed": {"ip_address": ["10.0.0.1", "10.0.0.2"]}}
+                 before is None for devices added after begin, after is None for devices deleted before end.
+        """
+        before = dict((device.get("device_id"), device) for device in self.list_devices_as_of(begin, device_list))
+        after = dict((device.get("device_id"), device) for device in self.list_devices_as_of(end, device_list))
+        diffs = list()
+        for device_id in sorted(set(before) | set(after)):
+            old = before.get(device_id) or dict()
+            new = after.get(device_id) or dict()
+            changed = dict()
+            for key in set(old) | set(new):
+                if key != "sys_period" and old.get(key) != new.get(key):
+                    changed[key] = [old.get(key), new.get(key)]
+            if changed:
+                diffs.append({"device_id": device_id, "hostname": new.get("hostname", old.get("hostname")),
+                              "before": before.get(device_id), "after": after.get(device_id), "changed": changed})
+        return diffs
+
     @abstractmethod
     def get_profile(self, profile_name):
         """
@@ -289,15 +438,15 @@ class DataStore(object, metaclass=ABCMeta):
         :param device_list:
         :return:
         """
-        groups = self.list_groups()
-        device_in_groups = list()
-        for group in list(groups.keys()):
-            ns = NodeSet(groups.get(group, []))
-            if device_list in ns:
-                device_in_groups.append(group)
+        return self.group_cache.get_device_groups(NodeSet(device_list, resolver=self.datastore_group_resolver))
 
-        # return [group for group in groups.keys() if device in groups.get(group, [])]
-        return device_in_groups
+    def _get_cache_key(self):
+        """
+        Identifies the current version of the data in the store, so group_cache and profile_cache notice changes made
+        by other processes. Stores that can't tell return None, the caches are then refreshed every few seconds.
+        :return: Something comparable, or None
+        """
+        return None
 
     @abstractmethod
     def add_to_group(self, device_list, group):
@@ -400,33 +549,38 @@ class DataStore(object, metaclass=ABCMeta):
         if not isinstance(device_list, list):
             device_list = [device_list]
 
+        # Attempt to get missing profile names from the DB. This is so that if we are deleting the profile_name, we
+        #  remove profile elements too.
+        stored_profile_names = self._get_stored_profile_names([device.get("hostname") for device in device_list
+                                                               if device.get("profile_name") is None])
+        profile_names = dict()
         for index, device in enumerate(device_list):
             # Get the passed in profile name
             profile_name = device.get("profile_name")
             if profile_name is None:
-                # Attempt to get it from the DB. This is so that if we are deleting the profile_name, we remove profile
-                #  elements too.
-                db_device = self.get_device(device.get("hostname"))
-                if db_device is not None:
-                    profile_name = db_device.get("profile_name")
+                profile_name = stored_profile_names.get(device.get("hostname"))
                 if profile_name is None:
                     # No profile specified here or in the DB, nothing to do.
                     continue
+            profile_names[index] = profile_name
 
-            profile = self.get_profile(profile_name)
-            if profile is None:
-                continue
-
-            for key in list(profile.keys()):
-                if key == "profile_name":
-                    continue
-                device_key_value = device.get(key, None)
-                profile_key_value = profile.get(key, None)
-                if device_key_value == profile_key_value:
-                    device_list[index].pop(key)
-
+        profiles = self.profile_cache.get_profiles(profile_names.values())
+        DataStoreUtilities.strip_profiles(device_list, profile_names, profiles)
         return device_list
 
+    def _get_stored_profile_names(self, device_names):
+        """
+        Find the profile of devices as they are stored now. Stores that can look up many devices at once override this.
+        :param device_names: list of device names
+        :return: dict of device name to profile_name, for the stored devices that have a profile
+        """
+        profile_names = dict()
+        for device_name in device_names:
+            db_device = self.get_device(device_name)
+            if db_device is not None and db_device.get("profile_name") is not None:
+                profile_names[device_name] = db_device.get("profile_name")
+        return profile_names
+
     # CANNED QUERIES
     def get_node(self, device_name=None):
         """
@@ -469,37 +623,28 @@ class DataStore(object, metaclass=ABCMeta):
 
     def get_devices_by_type(self, device_type, device_name=None):
         """
-        Filter the list of devices by type. The implementation here pulls all devices then filters, you can probably
-        do this faster in the database or something, so feel free to override this method!
+        Filter the list of devices by type. The implementation here passes the type as a list_devices filter, stores
+        that can filter faster than that are free to override this method!
         :param device_type:
         :param device_name: As explained in DataStore.list_devices()
         :return: A list (possibly empty) of devices filtered by device_type
         """
         if device_name is None:
-            devices = self.list_devices()
-        else:
-            devices = [self.get_device(device_name)]
-        filtered_devices = list()
-        for device in devices:
-            if device.get("device_type") == device_type:
-                filtered_devices.append(device)
+            return self.list_devices({"device_type": device_type})
 
-        return filtered_devices
+        device = self.get_device(device_name)
+        if device is not None and device.get("device_type") == device_type:
+            return [device]
+        return list()
 
     def get_profile_devices(self, profile_name):
         """
-        A list of devices that have a given profile. This is implemented in DataStore, but will probably be faster
-        in a database or something, so feel free to override it!
+        A list of devices that have a given profile. This is implemented in DataStore as a list_devices filter, but
+        feel free to override it!
         :param profile_name:
         :return:
         """
-        devices = self.list_devices()
-        filtered_devices = list()
-        for device in devices:
-            if device.get("profile_name") == profile_name:
-                filtered_devices.append(device)
-
-        return filtered_devices
+        return self.list_devices({"profile_name": profile_name})
 
     @abstractmethod
     def export_to_file(self, file_location):
@@ -528,6 +673,118 @@ class DataStore(object, metaclass=ABCMeta):
         """
         pass
 
+    def export_to_stream(self, file_location):
+        """
+        Export the same as export_to_file, but as one record per line (see RecordStream) that is written while the
+        store is read, so the export is never held in memory as a whole.
+        :param file_location: file location for the new file to go
+        :return: dict of record type to the number of records exported
+        """
+        from .record_stream import RecordStream
+        self.logger.debug("DataStore.export_to_stream called: {}".format(file_location))
+        groups = self.list_groups() or dict()
+        return RecordStream.write(file_location, [
+            (RecordStream.CONFIGURATION, self.list_configuration()),
+            (RecordStream.PROFILE, self.list_profiles()),
+            (RecordStream.GROUP, ({"group": group, "device_list": groups[group]} for group in groups)),
+            (RecordStream.DEVICE, self._iter_stored_devices(self.STREAM_BATCH_SIZE)),
+        ])
+
+    def import_from_stream(self, file_location, batch_size=None, progress=None):
+        """
+        Import a file written by export_to_stream, replacing everything in the store like import_from_file. The file
+        is read one record at a time and devices are set batch_size at a time.
+        :param file_location:
+        :param batch_size: Devices per set_device() call.
+        :param progress: Optional function(counts) called after every batch of devices, counts is a dict of record
+                         type to the number of records imported so far.
+        :return: dict of record type to the number of records imported
+        :raise: DataStoreException when the file can't be parsed, nothing is imported then if the store supports it.
+        """
+        from .record_stream import RecordStream
+        self.logger.debug("DataStore.import_from_stream called: {}".format(file_location))
+        if not RecordStream.is_stream(file_location):
+            raise DataStoreException("{} is not a {} version {} file".format(file_location, RecordStream.FORMAT,
+                                                                            RecordStream.VERSION))
+        batch_size = batch_size or self.STREAM_BATCH_SIZE
+        counts = dict((record_type, 0) for record_type in RecordStream.RECORD_TYPES)
+        devices = list()
+
+        def set_devices():
+            self.set_device(devices)
+            counts[RecordStream.DEVICE] += len(devices)
+            del devices[:]
+            if progress is not None:
+                progress(dict(counts))
+
+        with self._import_transaction():
+            self._clear_for_import()
+            for record_type, data in RecordStream.read(file_location):
+                if record_type == RecordStream.DEVICE:
+                    devices.append(data)
+                    if len(devices) >= batch_size:
+                        set_devices()
+                    continue
+                if record_type == RecordStream.CONFIGURATION:
+                    self.set_configuration(data["key"], data["value"])
+                elif record_type == RecordStream.PROFILE:
+                    self.set_profile(data)
+                elif record_type == RecordStream.GROUP:
+                    self._set_group(data["group"], data["device_list"])
+                counts[record_type] += 1
+            if devices:
+                set_devices()
+        self.group_cache.invalidate()
+        self.profile_cache.invalidate()
+        return counts
+
+    def _iter_stored_devices(self, batch_size):
+        """
+        The devices as they are stored (without profile values), for export_to_stream. Stores that can read the
+        devices batch_size at a time override this.
+        :return: iterable of device dicts
+        """
+        devices = self.list_devices()
+        for device in devices:
+            device.pop("sys_period", None)
+        # list_devices() merged the profile values in, take them out again.
+        profile_names = dict((index, device.get("profile_name")) for index, device in enumerate(devices)
+                             if device.get("profile_name") is not None)
+        profiles = self.profile_cache.get_profiles(set(profile_names.values()))
+        return DataStoreUtilities.strip_profiles(devices, profile_names, profiles)
+
+    @contextmanager
+    def _import_transaction(self):
+        """
+        Everything import_from_stream changes happens in this block. Stores that can undo a failed import override
+        this, by default a failed import leaves what was imported until then.
+        """
+        yield
+
+    def _clear_for_import(self):
+        """
+        Delete all devices, profiles, configuration and groups, before import_from_stream.
+        :return:
+        """
+        devices = self.list_devices(fields=["device_id"])
+        if devices:
+            self.delete_device([device["device_id"] for device in devices])
+        for profile in self.list_profiles():
+            self.delete_profile(profile["profile_name"])
+        for config in self.list_configuration():
+            self.delete_configuration(config["key"])
+        for group in list((self.list_groups() or dict()).keys()):
+            self.remove_from_group("*", group)
+
+    def _set_group(self, group, device_list):
+        """
+        Store device_list as the group, as is (nested @groups are not expanded). Used by import_from_stream.
+        :param group:
+        :param device_list: str
+        :return:
+        """
+        self.add_to_group(device_list, group)
+
 
 class DataStoreException(Exception):
     """
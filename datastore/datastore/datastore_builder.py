@@ -10,6 +10,7 @@ from .datastore import DataStore, DataStoreException, get_logger, add_stream_log
 from .filestore import FileStore
 from .postgresstore import PostgresStore
 from .multistore import MultiStore
+from .caching_store import CachingDataStore
 
 
 class DataStoreBuilder(object):
@@ -21,26 +22,32 @@ class DataStoreBuilder(object):
         self.dbs = list()
         self.print_to_screen = False
         self.screen_log_level = DataStore.LOG_LEVEL
+        self.read_policy = None
+        self.cache = False
+        self.cache_ttl_seconds = None
+        self.cache_max_entries = None
 
-    def add_file_db(self, location, log_level=None):
+    def add_file_db(self, location, log_level=None, lock_location=None):
         """
         Creates a filestore with the location you have specified. If no location is given, creates it
         in ~/datastore.json.
         :param location:
         :param log_level: The level in which you want logging done at.
+        :param lock_location: The lock file of the filestore, see FileStore.default_lock_location().
         :return:
         """
-        self.dbs.append(FileStore(location, log_level))
+        self.dbs.append(FileStore(location, log_level, lock_location))
         return self
 
-    def add_postgres_db(self, connection_uri, log_level=None):
+    def add_postgres_db(self, connection_uri, log_level=None, pool_size=None):
         """
 
         :param connection_uri:
         :param log_level: The level in which you want logging done at.
+        :param pool_size: The most connections to the database that are open at one time.
         :return:
         """
-        self.dbs.append(PostgresStore(connection_uri, log_level))
+        self.dbs.append(PostgresStore(connection_uri, log_level, pool_size))
         return self
 
     def set_print_to_screen(self, print_to_screen=True, log_level=None):
@@ -57,6 +64,30 @@ class DataStoreBuilder(object):
         self.screen_log_level = log_level
         return self
 
+    def set_read_policy(self, read_policy):
+        """
+        Set how reads are answered when more than one database was added, see MultiStore.
+        :param read_policy: One of MultiStore.READ_POLICIES
+        :return:
+        """
+        self.read_policy = read_policy
+        return self
+
+    def set_cache(self, cache=True, ttl_seconds=None, max_entries=None):
+        """
+        Put a CachingDataStore in front of the databases, so repeated reads of the same devices, profiles, groups and
+        configuration values don't go to the database every time.
+        :param cache: If this should happen or not.
+        :param ttl_seconds: How long a value is cached, see CachingDataStore.DEFAULT_TTL_SECONDS
+        :param max_entries: How many devices, profiles, groups and configuration values are cached (each),
+                            see CachingDataStore.DEFAULT_MAX_ENTRIES
+        :return:
+        """
+        self.cache = cache
+        self.cache_ttl_seconds = ttl_seconds
+        self.cache_max_entries = max_entries
+        return self
+
     def set_default_log_level(self, log_level):
         """
         Set the default log level for loggers/databases created. This will NOT affect already created databases!
@@ -75,20 +106,25 @@ class DataStoreBuilder(object):
             add_stream_logger(get_logger(), self.screen_log_level)
 
         if len(self.dbs) > 1:
-            return MultiStore(self.dbs)
+            datastore = MultiStore(self.dbs, self.read_policy)
         elif len(self.dbs) == 1:
-            return self.dbs[0]
+            datastore = self.dbs[0]
         else:
             raise DataStoreException("Cannot create a DataStore. No databases were selected (i.e file, postgresql).")
 
+        if self.cache:
+            return CachingDataStore(datastore, self.cache_ttl_seconds, self.cache_max_entries)
+        return datastore
+
     @staticmethod
-    def get_datastore_from_string(datastore_location, screen_log_level=None):
+    def get_datastore_from_string(datastore_location, screen_log_level=None, cache=False):
         """
         Creates an instance of the datastore that works with the string passed in. Sets up the printing to screen
         with the log level specificed (or a default one).
         :param datastore_location: Either a file location (like /etc/datastore_db) or
             a postgres uri (See https://www.postgresql.org/docs/current/static/libpq-connect.html#LIBPQ-CONNSTRING )
         :param screen_log_level:
+        :param cache: Put a CachingDataStore in front of the datastore, see set_cache().
         :return:
         :raise: DataStoreException, if the string doesn't connect to anything.
         """
@@ -99,6 +135,14 @@ class DataStoreBuilder(object):
             screen_log_level = DataStore.LOG_LEVEL
         add_stream_logger(get_logger(), screen_log_level)
 
+        datastore = DataStoreBuilder._datastore_from_string(datastore_location)
+        if cache:
+            return CachingDataStore(datastore)
+        return datastore
+
+    @staticmethod
+    def _datastore_from_string(datastore_location):
+        """The datastore for get_datastore_from_string()."""
         if datastore_location.startswith("postgres://"):
             return PostgresStore(datastore_location)
         elif os.path.isfile(datastore_location):
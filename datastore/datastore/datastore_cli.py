@@ -12,6 +12,7 @@ import re
 from dateutil.parser import parse as date_parse
 from . import DataStoreException, DataStore, DataStoreBuilder
 from .utilities import DeviceUtilities, FileNotFound, NonParsableFile
+from .record_stream import RecordStream
 
 
 class DataStoreCLI(object):
@@ -108,7 +109,14 @@ class DataStoreCLI(object):
                                                                     " configuration values. This command deletes"
                                                                     " existing data, so be sure to export your current"
                                                                     " configuration first if you want to save it.")
-        self.import_parser.add_argument('file_location', help="The file location to be used for the import.")
+        self.import_parser.add_argument('file_location', help="The file location to be used for the import. Files "
+                                                              "exported with '--format ndjson' are read one record"
+                                                              " at a time.")
+        self.import_parser.add_argument('--batch-size', type=int, default=None, dest="batch_size",
+                                        help="Devices imported at a time from an ndjson file, the default is "
+                                             "{}.".format(DataStore.STREAM_BATCH_SIZE))
+        self.import_parser.add_argument('--progress', action='store_true',
+                                        help="Print the number of imported records while importing an ndjson file.")
         self.import_parser.set_defaults(func=self.import_execute)
 
     def add_export_args(self):
@@ -123,6 +131,9 @@ class DataStoreCLI(object):
                                                                     " configuration values. It does not include device"
                                                                     " history or logs.")
         self.export_parser.add_argument('file_location', help="where to export this configuration too.")
+        self.export_parser.add_argument('--format', choices=['json', 'ndjson'], default='json',
+                                        help="json writes one JSON document. ndjson writes one record per line while"
+                                             " reading the datastore, for large datastores.")
         self.export_parser.set_defaults(func=self.export_execute)
 
     def add_group_args(self):
@@ -460,7 +471,17 @@ class DataStoreCLI(object):
         :param parsed_args:
         :return:
         """
-        self.datastore.import_from_file(parsed_args.file_location)
+        if not RecordStream.is_stream(parsed_args.file_location):
+            self.datastore.import_from_file(parsed_args.file_location)
+            return 0
+
+        def print_progress(counts):
+            print("Imported {} devices".format(counts.get(RecordStream.DEVICE)))
+
+        counts = self.datastore.import_from_stream(parsed_args.file_location, parsed_args.batch_size,
+                                                   print_progress if parsed_args.progress else None)
+        print("Imported {}".format(", ".join("{} {} records".format(counts[record_type], record_type)
+                                             for record_type in RecordStream.RECORD_TYPES)))
         return 0
 
     def export_execute(self, parsed_args):
@@ -469,7 +490,10 @@ class DataStoreCLI(object):
         :param parsed_args:
         :return:
         """
-        self.datastore.export_to_file(parsed_args.file_location)
+        if parsed_args.format == 'ndjson':
+            self.datastore.export_to_stream(parsed_args.file_location)
+        else:
+            self.datastore.export_to_file(parsed_args.file_location)
         return 0
 
     def group_add_execute(self, parsed_args):
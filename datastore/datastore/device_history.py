@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+An append-only log of every version of every device, that sits next to a FileStore's JSON file.
+"""
+import os
+import json
+import time
+import calendar
+import datetime
+from .utilities import FileNotFound
+
+
+class DeviceHistoryLog(object):
+    """
+    Every change to a device is appended to <file>.history as one JSON record per line:
+        {"ts": 1506588077.2, "device_id": 3, "device": {"device_id": 3, "hostname": "c3", ...}}
+    A record with "device": null is a deletion. Records are appended in time order, so reading up to a point in time
+    stops at the first record after it. The history starts with one record for every device that existed when it was
+    started, nothing is known about the time before that.
+    """
+    SUFFIX = ".history"
+
+    def __init__(self, location):
+        self.location = location + self.SUFFIX
+
+    def exists(self):
+        """
+        :return: True if there is a history file on disk
+        """
+        return os.path.isfile(self.location)
+
+    def append(self, changes, timestamp=None):
+        """
+        Durably add device versions to the end of the history, with one write and one fsync.
+        :param changes: list of (device_id, device), device is None for deleted devices
+        :param timestamp: seconds since the epoch, defaults to now
+        :return:
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        data = "".join(json.dumps({"ts": timestamp, "device_id": device_id, "device": device}, sort_keys=True,
+                                  default=str) + "\n" for device_id, device in changes)
+        try:
+            with open(self.location, "a") as history_file:
+                history_file.write(data)
+                history_file.flush()
+                os.fsync(history_file.fileno())
+        except IOError:
+            raise FileNotFound(self.location)
+
+    def read(self, until=None):
+        """
+        Read the history from the start. A partially written last record is ignored.
+        :param until: Optional seconds since the epoch, reading stops at the first record after it.
+        :return: generator of (timestamp, device_id, device)
+        """
+        if not self.exists():
+            return
+        with open(self.location) as history_file:
+            for line in history_file:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if until is not None and record["ts"] > until:
+                    break
+                yield record["ts"], record["device_id"], record["device"]
+
+    def as_of(self, timestamp):
+        """
+        :param timestamp: seconds since the epoch
+        :return: dict of device_id to the device as it was at that time, for the devices that existed then.
+        """
+        devices = dict()
+        for _, device_id, device in self.read(timestamp):
+            if device is None:
+                devices.pop(device_id, None)
+            else:
+                devices[device_id] = device
+        return devices
+
+    def versions(self):
+        """
+        Every version of every device, with the time it was current as sys_period (lower, upper), upper is None for
+        the current versions.
+        :return: list of devices ordered by the start of their sys_period
+        """
+        versions = list()
+        current = dict()
+        for timestamp, device_id, device in self.read():
+            previous = current.pop(device_id, None)
+            if previous is not None:
+                previous["sys_period"] = (previous["sys_period"][0], self.to_datetime(timestamp))
+            if device is not None:
+                device["sys_period"] = (self.to_datetime(timestamp), None)
+                current[device_id] = device
+                versions.append(device)
+        return versions
+
+    @staticmethod
+    def to_timestamp(date):
+        """
+        :param date: datetime, naive datetimes are UTC
+        :return: seconds since the epoch
+        """
+        return calendar.timegm(date.utctimetuple()) + date.microsecond / 1e6
+
+    @staticmethod
+    def to_datetime(timestamp):
+        """
+        :param timestamp: seconds since the epoch
+        :return: UTC datetime
+        """
+        return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+A compact, read only form of a device for holding many devices in memory.
+"""
+import sys
+import copy
+import json
+import functools
+from collections.abc import Mapping
+
+_MISSING = object()
+
+
+def _intern_pairs(pairs):
+    return dict((sys.intern(key), sys.intern(value) if isinstance(value, str) else value) for key, value in pairs)
+
+
+@functools.lru_cache(maxsize=1024)
+def _decode(text):
+    """The properties in text, shared by every record with the same text, so they must not be changed."""
+    return json.loads(text, object_pairs_hook=_intern_pairs)
+
+
+class DeviceRecord(Mapping):
+    """
+    A device with the fields every device has in slots and all other keys (the properties) kept as JSON text, which
+    is decoded when a property is read. The properties of the most recently read records are kept decoded in a cache of
+    bounded size, outside the records, so a record stays compact after it was read. Keys, the device_type and the
+    profile_name are interned, so thousands of devices share one copy of each.
+
+    It reads like the dict it was made from (get, [], in, keys, items, ==), but can't be changed. Use to_dict() for a
+    dict that can be changed or passed to json.dumps(); every call returns a new copy. Properties that can't be
+    written as JSON (like the sys_period of a PostgresStore device) are kept as a copy of the dict instead.
+    """
+    FIELDS = ("device_id", "device_type", "hostname", "ip_address", "mac_address", "profile_name")
+    __slots__ = FIELDS + ("_properties",)
+    _INTERNED_FIELDS = ("device_type", "profile_name")
+
+    def __init__(self, device):
+        """
+        :param device: dict (or DeviceRecord)
+        """
+        if isinstance(device, DeviceRecord):
+            for field in self.__slots__:
+                object.__setattr__(self, field, getattr(device, field))
+            return
+        properties = dict()
+        for key, value in device.items():
+            if key not in self.FIELDS:
+                properties[key] = value
+        for field in self.FIELDS:
+            value = device.get(field, _MISSING)
+            if field in self._INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            object.__setattr__(self, field, value)
+        if not properties:
+            encoded = None
+        else:
+            try:
+                encoded = json.dumps(properties, separators=(",", ":"))
+            except (TypeError, ValueError):
+                encoded = copy.deepcopy(properties)
+        object.__setattr__(self, "_properties", encoded)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("A DeviceRecord can't be changed, use to_dict() for a copy that can")
+
+    def properties(self):
+        """
+        :return: A new dict of the keys that aren't in FIELDS
+        """
+        return copy.deepcopy(self._decoded())
+
+    def _decoded(self):
+        """The properties dict itself, don't change it."""
+        if self._properties is None:
+            return dict()
+        if isinstance(self._properties, dict):
+            return self._properties
+        return _decode(self._properties)
+
+    def to_dict(self):
+        """
+        :return: A new dict with the same keys and values as the device this record was made from.
+        """
+        device = dict()
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not _MISSING:
+                device[field] = value
+        device.update(self.properties())
+        return device
+
+    def copy(self):
+        """Like dict.copy(), returns a dict."""
+        return self.to_dict()
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                return value
+            raise KeyError(key)
+        return copy.deepcopy(self._decoded()[key])
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key) is not _MISSING
+        return key in self._decoded()
+
+    def __iter__(self):
+        for field in self.FIELDS:
+            if getattr(self, field) is not _MISSING:
+                yield field
+        for key in self._decoded():
+            yield key
+
+    def __len__(self):
+        return sum(1 for field in self.FIELDS if getattr(self, field) is not _MISSING) + len(self._decoded())
+
+    def __repr__(self):
+        return "DeviceRecord({!r})".format(self.to_dict())
+
+    def __reduce__(self):
+        return DeviceRecord, (self.to_dict(),)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+A reader/writer lock shared between processes, for FileStore files.
+"""
+import os
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    # Not a POSIX platform, locking is a no-op.
+    fcntl = None
+
+
+class FileLock(object):
+    """
+    flock() based reader/writer lock on a separate lock file. The data file itself can't be locked because it is
+    replaced by a rename on every write. The lock is re-entrant within one process: asking for a shared lock while
+    holding the exclusive one is a no-op, and asking for the exclusive lock while holding a shared one upgrades it
+    until the inner block exits.
+    """
+    SHARED = "shared"
+    EXCLUSIVE = "exclusive"
+
+    def __init__(self, location):
+        self.location = location
+        self.mode = None
+        self._fd = None
+        self._opened = False
+
+    @contextmanager
+    def shared(self):
+        """
+        Hold a shared (reader) lock for the duration of the with block.
+        """
+        with self._locked(self.SHARED):
+            yield
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Hold an exclusive (writer) lock for the duration of the with block.
+        """
+        with self._locked(self.EXCLUSIVE):
+            yield
+
+    @contextmanager
+    def _locked(self, mode):
+        previous_mode = self.mode
+        if previous_mode is None or (mode == self.EXCLUSIVE and previous_mode == self.SHARED):
+            self._flock(mode)
+            self.mode = mode
+        try:
+            yield
+        finally:
+            if self.mode != previous_mode:
+                self._flock(previous_mode)
+                self.mode = previous_mode
+
+    def _flock(self, mode):
+        fd = self._get_fd()
+        if fd is None:
+            return
+        if mode == self.EXCLUSIVE:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        elif mode == self.SHARED:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _get_fd(self):
+        if not self._opened and fcntl is not None:
+            self._opened = True
+            try:
+                self._fd = os.open(self.location, os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError:
+                try:
+                    # flock() works on read only descriptors too, for users that may read but not write the DB.
+                    self._fd = os.open(self.location, os.O_RDONLY)
+                except OSError:
+                    self._fd = None
+        return self._fd
+
+    def __del__(self):
+        if self._fd is not None:
+            os.close(self._fd)
@@ -6,12 +6,205 @@
 import os
 import logging
 import copy
+import hashlib
+import tempfile
+import functools
+from contextlib import contextmanager
 from logging.handlers import RotatingFileHandler
 from dateutil.parser import parse as date_parse
 from pytz import UTC
 from ClusterShell.NodeSet import NodeSet, RESOLVER_NOGROUP
 from .datastore import DataStore, DataStoreException
-from .utilities import DataStoreUtilities, JsonParser
+from .utilities import DataStoreUtilities, JsonParser, FileNotFound
+from .write_ahead_log import WriteAheadLog
+from .file_lock import FileLock
+from .snapshot import DeviceSnapshot
+from .log_reader import LogReader
+from .device_history import DeviceHistoryLog
+
+
+class DeviceCatalog(object):
+    """
+    Hash indexes over the FileStore device list, so lookups don't have to walk every device. The catalog holds on to
+    the same list (and dicts) that live in the parsed file, it never copies them.
+    """
+    LOOKUP_KEYS = ("device_id", "hostname", "ip_address")
+    GROUPING_KEYS = ("device_type", "profile_name")
+
+    def __init__(self, devices=None):
+        self.devices = None
+        self.highest_device_id = 0
+        self._indexes = dict()
+        self._positions = dict()
+        self.rebuild(devices if devices is not None else list())
+
+    def rebuild(self, devices):
+        """
+        Throw away the indexes and build them again from the given list.
+        :param devices: The list of devices to index, it becomes the list this catalog manages.
+        :return:
+        """
+        self.devices = devices
+        self.highest_device_id = 0
+        self._indexes = dict((key, dict()) for key in self.LOOKUP_KEYS + self.GROUPING_KEYS)
+        self._positions = dict((id(device), position) for position, device in enumerate(devices))
+        # One pass per key, this runs on every load so it is kept tight.
+        for key, index in self._indexes.items():
+            for device in devices:
+                value = device.get(key)
+                if value is None:
+                    continue
+                try:
+                    bucket = index.get(value)
+                except TypeError:
+                    continue
+                if bucket is None:
+                    index[value] = [device]
+                else:
+                    bucket.append(device)
+        for device_id in self._indexes["device_id"]:
+            if isinstance(device_id, int) and device_id > self.highest_device_id:
+                self.highest_device_id = device_id
+
+    def find(self, device_name):
+        """
+        Locate a device by device_id, hostname or ip_address (In that priority order).
+        :param device_name:
+        :return: The index and device (index, device) or (None, None) if they are not found.
+        """
+        for key in self.LOOKUP_KEYS:
+            bucket = self._get_bucket(key, device_name)
+            if bucket:
+                return self._positions[id(bucket[0])], bucket[0]
+        return None, None
+
+    def find_by_id(self, device_id):
+        """
+        Locate a device by its device_id only.
+        :param device_id:
+        :return: The index and device (index, device) or (None, None) if it is not found.
+        """
+        bucket = self._get_bucket("device_id", device_id)
+        if bucket:
+            return self._positions[id(bucket[0])], bucket[0]
+        return None, None
+
+    def by_type(self, device_type):
+        """
+        :param device_type:
+        :return: A new list of the devices with the given device_type, in device list order.
+        """
+        return list(self._get_bucket("device_type", device_type))
+
+    def by_profile(self, profile_name):
+        """
+        :param profile_name:
+        :return: A new list of the devices with the given profile_name, in device list order.
+        """
+        return list(self._get_bucket("profile_name", profile_name))
+
+    def append(self, device):
+        """
+        Add a device to the end of the device list.
+        :param device:
+        :return:
+        """
+        self.devices.append(device)
+        self._add_to_indexes(device, len(self.devices) - 1)
+
+    def replace(self, position, device):
+        """
+        Swap the device at position for a new one, keeping it at the same place in the device list.
+        :param position:
+        :param device:
+        :return:
+        """
+        old_device = self.devices[position]
+        for key in self._indexes:
+            old_value = old_device.get(key)
+            if old_value == device.get(key):
+                bucket = self._get_bucket(key, old_value)
+                for bucket_index, indexed_device in enumerate(bucket):
+                    if indexed_device is old_device:
+                        bucket[bucket_index] = device
+                        break
+            else:
+                self._remove_from_bucket(key, old_value, old_device)
+                self._add_to_bucket(key, device.get(key), device)
+        self._positions.pop(id(old_device), None)
+        self._positions[id(device)] = position
+        self.devices[position] = device
+        self._track_device_id(device)
+
+    def remove(self, devices_to_remove):
+        """
+        Remove the given devices from the device list. The list is filtered in place and re-indexed once, no matter
+        how many devices are removed.
+        :param devices_to_remove: A list of devices as returned by find()
+        :return:
+        """
+        if not devices_to_remove:
+            return
+        removed_ids = set(id(device) for device in devices_to_remove)
+        self.devices[:] = [device for device in self.devices if id(device) not in removed_ids]
+        self.rebuild(self.devices)
+
+    def _get_bucket(self, key, value):
+        try:
+            return self._indexes[key].get(value, [])
+        except TypeError:
+            # Unhashable values (i.e. lists) are never indexed, so they are never found.
+            return []
+
+    def _add_to_bucket(self, key, value, device):
+        if value is None:
+            return
+        try:
+            self._indexes[key].setdefault(value, list()).append(device)
+        except TypeError:
+            pass
+
+    def _remove_from_bucket(self, key, value, device):
+        bucket = self._get_bucket(key, value)
+        for bucket_index, indexed_device in enumerate(bucket):
+            if indexed_device is device:
+                bucket.pop(bucket_index)
+                break
+        if not bucket and value is not None:
+            try:
+                self._indexes[key].pop(value, None)
+            except TypeError:
+                pass
+
+    def _add_to_indexes(self, device, position):
+        for key in self._indexes:
+            self._add_to_bucket(key, device.get(key), device)
+        self._positions[id(device)] = position
+        self._track_device_id(device)
+
+    def _track_device_id(self, device):
+        device_id = device.get("device_id")
+        if isinstance(device_id, int) and device_id > self.highest_device_id:
+            self.highest_device_id = device_id
+
+
+def _file_access(exclusive=False):
+    """
+    Decorator for FileStore methods that use parsed_file. The outermost call notices changes made to the file by other
+    processes and reloads it. Methods that change the file hold the exclusive lock for the whole
+    read-modify-write, so concurrent writers don't lose each others updates.
+    :param exclusive: True for methods that change the file.
+    :return:
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if exclusive:
+                with self.file_lock.exclusive():
+                    return self._call_with_fresh_file(method, args, kwargs)
+            return self._call_with_fresh_file(method, args, kwargs)
+        return wrapper
+    return decorator
 
 
 class FileStore(DataStore):
@@ -24,22 +217,164 @@ class FileStore(DataStore):
     CONFIG_KEY = "configuration_variables"
     PROFILE_KEY = "profile"
     GROUPS_KEY = "groups"
-
-    def __init__(self, location="/tmp/datastore_db", log_level=None):
+    # Configuration variable: when set to N > 0, changes are appended to a journal next to the file and only
+    # compacted into the file every N records. When unset, every change rewrites the whole file.
+    JOURNAL_MAX_RECORDS_KEY = "file_store_journal_max_records"
+    # Configuration variable: when true, a binary copy of the file is kept next to it so startup doesn't parse the
+    # JSON and single device lookups decode only that device.
+    SNAPSHOT_KEY = "file_store_snapshot"
+    # Configuration variable: how many rotated log files (<log_file_path>.1, .2, ...) are kept when
+    # log_file_max_bytes is set. list_logs reads them too.
+    LOG_BACKUP_COUNT_KEY = "log_file_backup_count"
+    # Configuration variable: when true, every version of every device is appended to a history file next to the
+    # file, for get_device_history and list_devices_as_of.
+    HISTORY_KEY = "file_store_history"
+
+    def __init__(self, location="/tmp/datastore_db", log_level=None, lock_location=None):
+        """
+        :param location: The JSON file
+        :param log_level:
+        :param lock_location: The file processes lock to share the store, see default_lock_location() when None.
+        """
         super(FileStore, self).__init__()
         self.location = location
         self.log_level = log_level if log_level is not None else DataStore.LOG_LEVEL
-        # TODO: lock the file: http://stackoverflow.com/a/186464/1767377
-        # If the file doesn't exist or is empty. Create it.
+        self.device_catalog = DeviceCatalog()
+        self.journal = WriteAheadLog(location)
+        self.file_lock = FileLock(lock_location if lock_location is not None else self.default_lock_location(location))
+        self.snapshot = DeviceSnapshot(location)
+        self.history = DeviceHistoryLog(location)
+        self._devices_loaded = True
+        self._file_signature = None
+        self._access_depth = 0
+        self._batch_depth = 0
+        self._pending_records = list()
+        self._pending_history = list()
+        self.log_reader = LogReader(DataStoreUtilities.LINE_DELIMITER, self._log_timestamp)
+
+        with self.file_lock.exclusive():
+            # If the file doesn't exist or is empty. Create it.
+            try:
+                if not os.path.isfile(location) or os.stat(location).st_size == 0:
+                    with open(location, "w") as f:
+                        f.write("{}")
+            except IOError:
+                raise DataStoreException("Could not write to location {}. Do you have write "
+                                         "permissions?".format(location))
+
+            self._load()
+            if self.journal.record_count and not self._journal_max_records():
+                # Journaling was turned off since these were written, fold them into the file.
+                self.save_file()
+            self._setup_file_logger(log_level)
+
+    @staticmethod
+    def default_lock_location(location):
+        """
+        The lock file of the store at location: <location>.lock, or a file in the temp directory named after the
+        location when the directory of the store can't be written (i.e. a read only config directory).
+        """
+        lock_location = location + ".lock"
+        if os.path.exists(lock_location) or os.access(os.path.dirname(os.path.abspath(location)), os.W_OK):
+            return lock_location
+        digest = hashlib.sha1(os.path.abspath(location).encode("utf-8")).hexdigest()
+        return os.path.join(tempfile.gettempdir(), "datastore-{}.lock".format(digest))
+
+    def _load(self):
+        """
+        Read the file and replay any journaled changes on top of it. Callers must hold the file lock.
+        :return:
+        """
+        self._file_signature = self._get_file_signature()
+        if self.snapshot.open():
+            # Devices stay in the snapshot until something needs all of them, see _load_devices()
+            self.parsed_file = self.snapshot.sections
+            self._devices_loaded = False
+            self.device_catalog.rebuild(list())
+        else:
+            self.parsed_file = JsonParser.read_file(self.location)
+            self._devices_loaded = True
+            self._refresh_device_catalog()
+            self._write_snapshot()
+        for record in self.journal.read():
+            self._apply_journal_record(record)
+
+    def _load_devices(self):
+        """
+        Decode all devices from the snapshot into parsed_file, if that hasn't happened yet. Anything that needs the
+        whole device list calls this first.
+        :return:
+        """
+        if self._devices_loaded:
+            return
+        if self.snapshot.has_devices():
+            self.parsed_file[self.DEVICE_KEY] = self.snapshot.devices()
+        self.snapshot.close()
+        self._devices_loaded = True
+        self._refresh_device_catalog()
+
+    def _snapshot_enabled(self):
+        value = self.parsed_file.get(self.CONFIG_KEY, {}).get(self.SNAPSHOT_KEY)
+        return value is True or str(value).lower() in ("true", "1", "yes")
+
+    def _history_enabled(self):
+        value = self.parsed_file.get(self.CONFIG_KEY, {}).get(self.HISTORY_KEY)
+        return value is True or str(value).lower() in ("true", "1", "yes")
+
+    def _write_snapshot(self):
+        """
+        Bring the snapshot in line with the JSON file, which must have just been read or written from parsed_file.
+        :return:
+        """
         try:
-            if not os.path.isfile(location) or os.stat(location).st_size == 0:
-                with open(location, "w") as f:
-                    f.write("{}")
-        except IOError:
-            raise DataStoreException("Could not write to location {}. Do you have write permissions?".format(location))
+            if self._snapshot_enabled():
+                self.snapshot.write(self.parsed_file, self.DEVICE_KEY)
+            else:
+                self.snapshot.remove()
+        except (IOError, OSError) as io_error:
+            # The snapshot is only an optimization, i.e. a user that may read but not write the file can't make one.
+            self.logger.debug("Could not update the FileStore snapshot: {}".format(io_error))
+
+    def _get_file_signature(self):
+        """
+        Identify the current version of the file and journal on disk. Every write either replaces the file (new inode)
+        or appends to the journal (new size), so a matching signature means there is nothing new to read.
+        :return:
+        """
+        signature = list()
+        for location in [self.location, self.journal.location]:
+            try:
+                stat = os.stat(location)
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _get_cache_key(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        return self._get_file_signature()
+
+    def _call_with_fresh_file(self, method, args, kwargs):
+        if self._access_depth == 0 and self._batch_depth == 0 and self._get_file_signature() != self._file_signature:
+            with self.file_lock.shared():
+                self._load()
+        self._access_depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._access_depth -= 1
 
-        self.parsed_file = JsonParser.read_file(location)
-        self._setup_file_logger(log_level)
+    def _refresh_device_catalog(self):
+        """
+        Re-index the devices in parsed_file. Needed whenever parsed_file or its device list is replaced.
+        :return:
+        """
+        devices = self.parsed_file.get(self.DEVICE_KEY)
+        if devices is None:
+            devices = list()
+        self.device_catalog.rebuild(devices)
 
     def _setup_file_logger(self, log_level):
         """
@@ -72,7 +407,8 @@ class FileStore(DataStore):
 
             log_rotating_file_handler = RotatingFileHandler(
                 log_file_path,
-                maxBytes=log_file_max_bytes
+                maxBytes=log_file_max_bytes,
+                backupCount=self._log_backup_count()
             )
             log_rotating_file_handler.setLevel(log_level)
             log_rotating_file_handler.setFormatter(formatter)
@@ -88,47 +424,211 @@ class FileStore(DataStore):
         if not isinstance(device_list, list):
             device_list = [device_list]
 
-        for index, device in enumerate(device_list):
-            profile_name = device.get("profile_name", None)
-            if profile_name is None:
-                # Nothing to add or change!
-                continue
-            profile = self.get_profile(profile_name)
+        profile_names = set(device.get("profile_name") for device in device_list) - {None}
+        profiles = self.profile_cache.get_profiles(profile_names)
+        for profile_name, profile in profiles.items():
             if profile is None:
                 # no valid profile, likely this is caused by an error in the config
-                self.logger.warning("Device {}, has an invalid profile {}. Skipping for now, but this is likely due to"
-                                    " an invalid configuration.".format(device.get("device_id"), profile_name))
-                continue
-            for key in profile:
-                if device.get(key, None) is None:
-                    device_list[index][key] = profile.get(key)
-        return device_list
+                self.logger.warning("Devices have the invalid profile {}. Skipping for now, but this is likely due to"
+                                    " an invalid configuration.".format(profile_name))
+        return DataStoreUtilities.merge_profiles(device_list, profiles)
 
     def save_file(self, location=None):
-        if location is None:
-            location = self.location
-        JsonParser.write_file(location, self.parsed_file)
+        """
+        Write the full file. When writing to this FileStore's own location the journal is compacted into it.
+        :param location: Where to write, defaults to the FileStore location.
+        :return:
+        """
+        self._load_devices()
+        if location is None or location == self.location:
+            with self.file_lock.exclusive():
+                JsonParser.write_file(self.location, self.parsed_file)
+                self._write_snapshot()
+                if self._journal_max_records():
+                    self.journal.reset()
+                else:
+                    self.journal.remove()
+                self._file_signature = self._get_file_signature()
+        else:
+            JsonParser.write_file(location, self.parsed_file)
+
+    @contextmanager
+    def batch(self):
+        """
+        Group many changes into one durable write. Changes made inside the block are visible right away, but are only
+        written to disk when the outermost batch block exits. If the block raises, nothing from it is written and the
+        in-memory copy is reloaded from disk. Other processes are kept from writing for the duration of the block.
+
+        with filestore.batch():
+            for device in devices:
+                filestore.set_device(device)
+        """
+        with self.file_lock.exclusive():
+            if self._batch_depth == 0 and self._get_file_signature() != self._file_signature:
+                self._load()
+            self._batch_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._pending_records = list()
+                    self._pending_history = list()
+                    self._load()
+                raise
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush()
+
+    def _journal_max_records(self):
+        max_records = self.parsed_file.get(self.CONFIG_KEY, {}).get(self.JOURNAL_MAX_RECORDS_KEY)
+        try:
+            return max(int(max_records), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def _journal_record(section, key, value=None, remove=False):
+        if remove:
+            return {"op": "remove", "section": section, "key": key}
+        return {"op": "put", "section": section, "key": key, "value": value}
+
+    def _commit(self, records, history=None):
+        """
+        Persist the changes described by records, or hold on to them until the end of the current batch.
+        :param records: list of records made with _journal_record()
+        :param history: list of (device_id, stored device or None when deleted) for the device history
+        :return:
+        """
+        self._pending_records.extend(records)
+        self._pending_history.extend(history or list())
+        if self._batch_depth == 0:
+            self._flush()
+
+    def _flush(self):
+        records = self._pending_records
+        history = self._pending_history
+        self._pending_records = list()
+        self._pending_history = list()
+        if not records:
+            return
+        max_records = self._journal_max_records()
+        if max_records and self.journal.record_count + len(records) < max_records:
+            with self.file_lock.exclusive():
+                self.journal.append(records)
+                self._file_signature = self._get_file_signature()
+        else:
+            self.save_file()
+        self._write_history(history)
+
+    def _write_history(self, history):
+        """
+        Append the device versions that were just written to the history, when it is enabled. The first write after
+        it was enabled starts the history with every device as it is now.
+        :param history: list of (device_id, stored device or None when deleted)
+        :return:
+        """
+        if not self._history_enabled():
+            return
+        if not self.history.exists():
+            self._load_devices()
+            history = [(device.get("device_id"), device) for device in self.parsed_file.get(self.DEVICE_KEY) or []]
+        try:
+            with self.file_lock.exclusive():
+                self.history.append(history)
+        except FileNotFound as io_error:
+            self.logger.warning("Could not write the FileStore device history: {}".format(io_error.value))
 
+    def _apply_journal_record(self, record):
+        """
+        Replay one journaled change on parsed_file.
+        :param record:
+        :return:
+        """
+        section = record.get("section")
+        key = record.get("key")
+        remove = record.get("op") == "remove"
+        if section == self.DEVICE_KEY:
+            self._load_devices()
+            if self.parsed_file.get(self.DEVICE_KEY) is None:
+                self.parsed_file[self.DEVICE_KEY] = list()
+                self._refresh_device_catalog()
+            index, device = self.device_catalog.find_by_id(key)
+            if remove:
+                if device is not None:
+                    self.device_catalog.remove([device])
+            elif device is None:
+                self.device_catalog.append(record.get("value"))
+            else:
+                self.device_catalog.replace(index, record.get("value"))
+        elif section == self.PROFILE_KEY:
+            profiles = self.parsed_file.setdefault(self.PROFILE_KEY, list())
+            profiles[:] = [profile for profile in profiles if profile.get("profile_name") != key]
+            if not remove:
+                profiles.append(record.get("value"))
+        elif section in (self.CONFIG_KEY, self.GROUPS_KEY):
+            values = self.parsed_file.setdefault(section, dict())
+            if remove:
+                values.pop(key, None)
+            else:
+                values[key] = record.get("value")
+
+    @_file_access()
     def get_device(self, device_name):
-        devices = self.parsed_file.get(self.DEVICE_KEY, [])
-        index, device = self._device_find(device_name, devices)
+        if self._devices_loaded:
+            index, device = self.device_catalog.find(device_name)
+        else:
+            device = self.snapshot.find(device_name)
         if device is not None:
             return copy.copy(self.add_profile_to_device(device)[0])
         else:
             return None
 
-    def list_devices(self, filters=None):
+    @_file_access()
+    def _find_devices(self, device_names):
         """
         See @DataStore for function description. Only implementation details here.
+
+        All devices are looked up under one file access, and their profiles are added at once.
+        """
+        found = list()
+        for device_name in device_names:
+            if self._devices_loaded:
+                index, device = self.device_catalog.find(device_name)
+            else:
+                device = self.snapshot.find(device_name)
+            if device is not None:
+                found.append((device_name, device))
+        merged = self.add_profile_to_device([device for device_name, device in found])
+        devices = dict((device_name, None) for device_name in device_names)
+        for (device_name, device), merged_device in zip(found, merged):
+            devices[device_name] = copy.copy(merged_device)
+        return devices
+
+    @_file_access()
+    def list_devices(self, filters=None, fields=None):
         """
-        super(FileStore, self).list_devices(filters)
-        devices = self.parsed_file.get(self.DEVICE_KEY, [])
-        return DataStoreUtilities.filter_dict(self.add_profile_to_device(devices), filters)
+        See @DataStore for function description. Only implementation details here.
+
+        A device_type or profile_name filter narrows the devices down with the DeviceCatalog before profiles are added.
+        """
+        super(FileStore, self).list_devices(filters, fields)
+        self._load_devices()
+        filters = filters or dict()
+        if filters.get("device_type") is not None:
+            devices = self.device_catalog.by_type(filters["device_type"])
+        elif filters.get("profile_name") is not None:
+            devices = self.device_catalog.by_profile(filters["profile_name"])
+        else:
+            devices = self.parsed_file.get(self.DEVICE_KEY, [])
+        devices = DataStoreUtilities.filter_dict(self.add_profile_to_device(devices), filters)
+        return DataStoreUtilities.project_dict(devices, fields)
 
     @staticmethod
     def _device_find(device_name, devices):
         """
-        Given a device name and a list of devices, locates the device in that list.
+        Given a device name and a list of devices, locates the device in that list. This walks the whole list, the
+        FileStore itself uses its DeviceCatalog instead.
         :param device_name:
         :param devices:
         :return: The index and device (index, device) or (None, None) if they are not found.
@@ -148,77 +648,114 @@ class FileStore(DataStore):
 
         return None, None
 
+    @_file_access(exclusive=True)
     def set_device(self, device_info_list):
         """
         See @DataStore for function description. Only implementation details here.
         """
         super(FileStore, self).set_device(device_info_list)
+        self._load_devices()
 
         if not isinstance(device_info_list, list):
             device_info_list = [device_info_list]
 
         set_ids = list()
-        # Update
-        devices = self.parsed_file.get(self.DEVICE_KEY, None)
-        if devices is None:
+        records = list()
+        history = list()
+        if self.parsed_file.get(self.DEVICE_KEY) is None:
             # No devices, but we are about to add one, so create them!
             self.parsed_file[self.DEVICE_KEY] = list()
-            devices = self.parsed_file.get(self.DEVICE_KEY)
+            self._refresh_device_catalog()
 
-        highest_node_id = 0
         for device_info in device_info_list:
-            device_to_update_id = device_info.get("device_id")
-            updated = False
-            for index, device in enumerate(devices):
-                device_id = device.get('device_id')
-                if device_id > highest_node_id:
-                    highest_node_id = device_id
-                if device_id == device_to_update_id:
-                    # Update the device with what was passed in
-                    devices[index] = self._remove_profile_from_device(device_info)[0]
-                    set_ids.append(device_info.get("device_id"))
-                    updated = True
-                    break
-
-            if not updated:
+            index, device = self.device_catalog.find_by_id(device_info.get("device_id"))
+            if device is not None:
+                # Update the device with what was passed in
+                stored_device = self._remove_profile_from_device(device_info)[0]
+                self.device_catalog.replace(index, stored_device)
+            else:
                 # Set device id to the next aval one
                 if device_info.get("device_id") is None:
-                    highest_node_id = highest_node_id + 1
-                    device_info["device_id"] = highest_node_id
+                    device_info["device_id"] = self.device_catalog.highest_device_id + 1
 
                 # Insert device
-                devices.append(self._remove_profile_from_device(device_info)[0])
-                set_ids.append(device_info.get("device_id"))
+                stored_device = self._remove_profile_from_device(device_info)[0]
+                self.device_catalog.append(stored_device)
+            set_ids.append(device_info.get("device_id"))
+            records.append(self._journal_record(self.DEVICE_KEY, device_info.get("device_id"), device_info))
+            history.append((device_info.get("device_id"), copy.copy(stored_device)))
 
-        self.save_file()
+        self._commit(records, history)
         return set_ids
 
+    @_file_access(exclusive=True)
     def delete_device(self, device_list):
         """
         See @DataStore for function description. Only implementation details here.
         """
         super(FileStore, self).delete_device(device_list)
-        devices = self.parsed_file.get(self.DEVICE_KEY, [])
+        self._load_devices()
 
         if not isinstance(device_list, list):
             device_list = [device_list]
 
         deleted_device_ids = list()
+        removed_devices = list()
+        removed_ids = set()
         for device_name in device_list:
-            index, device = self._device_find(device_name, devices)
-            if index is not None:
-                removed_device = devices.pop(index)
-                self.save_file()
-                deleted_device_ids.append(removed_device.get("device_id"))
+            index, device = self.device_catalog.find(device_name)
+            if index is not None and id(device) not in removed_ids:
+                removed_ids.add(id(device))
+                removed_devices.append(device)
+                deleted_device_ids.append(device.get("device_id"))
+
+        if removed_devices:
+            self.device_catalog.remove(removed_devices)
+            self._commit([self._journal_record(self.DEVICE_KEY, device_id, remove=True)
+                          for device_id in deleted_device_ids],
+                         [(device_id, None) for device_id in deleted_device_ids])
 
         return deleted_device_ids
 
+    @_file_access()
     def get_device_history(self, device_name=None):
         """
         See @DataStore for function description. Only implementation details here.
+
+        Like the PostgresStore, only the versions that were replaced or deleted are returned for a device_name, all
+        versions without a device_name. sys_period is (start, end) of the version, end is None for current versions.
+        """
+        super(FileStore, self).get_device_history(device_name)
+        self._check_history_enabled()
+        devices = self.history.versions()
+        if device_name is None:
+            return devices
+        return [device for device in devices if device["sys_period"][1] is not None and
+                str(device_name) in (str(device.get("device_id")), device.get("hostname"), device.get("ip_address"))]
+
+    @_file_access()
+    def list_devices_as_of(self, timestamp, device_list=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        The history file is read from the start up to timestamp.
         """
-        raise DataStoreException("Not implemented for FileStore.")
+        self.logger.debug("DataStore.list_devices_as_of called: {}".format(timestamp), device_name=device_list)
+        self._check_history_enabled()
+        devices = self.history.as_of(DeviceHistoryLog.to_timestamp(timestamp))
+        devices = [devices[device_id] for device_id in sorted(devices)]
+        if device_list is None:
+            return devices
+        device_names = set(self.expand_device_list(device_list))
+        return [device for device in devices if str(device.get("device_id")) in device_names or
+                device.get("hostname") in device_names or device.get("ip_address") in device_names]
+
+    def _check_history_enabled(self):
+        if not self._history_enabled():
+            raise DataStoreException("The FileStore keeps no device history, set the configuration variable {} to "
+                                     "true to keep it.".format(self.HISTORY_KEY))
 
+    @_file_access()
     def get_profile(self, profile_name):
         """
         See @DataStore for function description. Only implementation details here.
@@ -230,6 +767,7 @@ class FileStore(DataStore):
 
         return None
 
+    @_file_access()
     def list_profiles(self, filters=None):
         """
         See @DataStore for function description. Only implementation details here.
@@ -238,6 +776,7 @@ class FileStore(DataStore):
         profiles = self.parsed_file.get(self.PROFILE_KEY, [])
         return DataStoreUtilities.filter_dict(profiles, filters)
 
+    @_file_access(exclusive=True)
     def set_profile(self, profile_info):
         """
         See @DataStore for function description. Only implementation details here.
@@ -252,19 +791,23 @@ class FileStore(DataStore):
             self.parsed_file[self.PROFILE_KEY] = list()
             profiles = self.parsed_file.get(self.PROFILE_KEY)
 
+        record = self._journal_record(self.PROFILE_KEY, profile_name, profile_info)
         for index, profile in enumerate(profiles):
             if profile_name == profile.get("profile_name"):
                 profiles[index] = profile_info
-                self.save_file()
+                self._commit([record])
+                self.profile_cache.invalidate()
                 self.logger.info("DataStore.delete_profile result: Success, updated")
                 return profile_name
 
         # Insert
         profiles.append(profile_info)
-        self.save_file()
+        self._commit([record])
+        self.profile_cache.invalidate()
         self.logger.info("DataStore.delete_profile result: Success, inserted")
         return profile_name
 
+    @_file_access(exclusive=True)
     def delete_profile(self, profile_name):
         """
         See @DataStore for function description. Only implementation details here.
@@ -275,7 +818,8 @@ class FileStore(DataStore):
         for index, profile in enumerate(profiles):
             if profile.get("profile_name") == profile_name:
                 profiles.pop(index)
-                self.save_file()
+                self._commit([self._journal_record(self.PROFILE_KEY, profile_name, remove=True)])
+                self.profile_cache.invalidate()
                 self.logger.info("DataStore.delete_profile result: Success")
                 return profile_name
 
@@ -286,8 +830,7 @@ class FileStore(DataStore):
         See @DataStore for function description. Only implementation details here.
         """
         super(FileStore, self).list_logs(device_name, limit)
-        log_file = self.get_configuration_value("log_file_path")
-        lines = DataStoreUtilities.tail_file(log_file, limit, self.log_formatter)
+        lines = self.log_reader.tail(self._get_log_files(), limit, self.log_formatter)
         self.logger.info("DataStore.list_logs result: Returned {} lines".format(len(lines)))
         return lines
 
@@ -327,11 +870,29 @@ class FileStore(DataStore):
             date = line.get("timestamp")
             return begin < date.replace(tzinfo=UTC) < end
 
-        log_file = self.get_configuration_value("log_file_path")
-        lines = DataStoreUtilities.tail_file(log_file, limit, self.log_formatter, time_filter)
+        lines = self.log_reader.tail_between(self._get_log_files(), begin, end, limit, self.log_formatter, time_filter)
         self.logger.info("DataStore.list_logs result: Returned {} lines".format(len(lines)))
         return lines
 
+    def _get_log_files(self):
+        """
+        The log file and its rotated files, newest to oldest.
+        :return: list of file names
+        """
+        return LogReader.rotated_files(self.get_configuration_value("log_file_path"), self._log_backup_count())
+
+    def _log_backup_count(self):
+        backup_count = self.parsed_file.get(self.CONFIG_KEY, {}).get(self.LOG_BACKUP_COUNT_KEY)
+        try:
+            return max(int(backup_count), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def _log_timestamp(line):
+        """The UTC timestamp of a log line, the way list_logs_between_timeslice compares it."""
+        return FileStore.log_formatter(line).get("timestamp").replace(tzinfo=UTC)
+
     def add_log(self, level, msg, device_name=None, process=None):
         """
         See @DataStore for function description. Only implementation details here.
@@ -349,6 +910,7 @@ class FileStore(DataStore):
         msg = "{} / {} / ".format(process, device_id) + msg.replace(os.linesep, ' ').replace('\n', ' ')
         self.logger.log(level, msg)
 
+    @_file_access()
     def get_configuration_value(self, key):
         """
         See @DataStore for function description. Only implementation details here.
@@ -359,6 +921,7 @@ class FileStore(DataStore):
         self.logger.info("DataStore.get_configuration_value result: {}".format(result))
         return result
 
+    @_file_access()
     def list_configuration(self):
         """
         See @DataStore for function description. Only implementation details here.
@@ -370,6 +933,7 @@ class FileStore(DataStore):
             result.append({"key": key, "value": config.get(key)})
         return result
 
+    @_file_access(exclusive=True)
     def set_configuration(self, key, value):
         """
         See @DataStore for function description. Only implementation details here.
@@ -381,9 +945,10 @@ class FileStore(DataStore):
 
         self.parsed_file[self.CONFIG_KEY][key] = value
         self.logger.info("DataStore.set_configuration result: Success")
-        self.save_file()
+        self._commit([self._journal_record(self.CONFIG_KEY, key, value)])
         return key
 
+    @_file_access(exclusive=True)
     def delete_configuration(self, key):
         """
         See @DataStore for function description. Only implementation details here.
@@ -393,13 +958,14 @@ class FileStore(DataStore):
             return None
         popped_value = self.parsed_file[self.CONFIG_KEY].pop(key, None)
         self.logger.info("DataStore.delete_configuration result: Success")
-        self.save_file()
+        self._commit([self._journal_record(self.CONFIG_KEY, key, remove=True)])
         if popped_value is None:
             # Nothing was deleted...
             return None
         else:
             return key
 
+    @_file_access()
     def list_groups(self):
         """
         See @DataStore for function description. Only implementation details here.
@@ -408,6 +974,7 @@ class FileStore(DataStore):
         groups = self.parsed_file.get(self.GROUPS_KEY, {})
         return copy.copy(groups)
 
+    @_file_access()
     def get_group_devices(self, group):
         """
         See @DataStore for function description. Only implementation details here.
@@ -418,6 +985,7 @@ class FileStore(DataStore):
 
         return copy.copy(str(groups.get(group, "")))
 
+    @_file_access(exclusive=True)
     def add_to_group(self, device_list, group):
         """
         See @DataStore for function description. Only implementation details here.
@@ -432,10 +1000,12 @@ class FileStore(DataStore):
         updated_device_set.add(','.join(device_list))
         self.parsed_file[self.GROUPS_KEY][group] = str(updated_device_set)
 
-        self.save_file()
+        self._commit([self._journal_record(self.GROUPS_KEY, group, str(updated_device_set))])
+        self.group_cache.invalidate()
 
         return updated_device_set
 
+    @_file_access(exclusive=True)
     def remove_from_group(self, device_list, group):
         """
         See @DataStore for function description. Only implementation details here.
@@ -452,13 +1022,36 @@ class FileStore(DataStore):
             # Delete the group if its empty or user provided device_list is '*'
             self.parsed_file[self.GROUPS_KEY].pop(group, None)
             updated_device_set = NodeSet()
+            record = self._journal_record(self.GROUPS_KEY, group, remove=True)
         else:
             # Modify the group, because its not empty yet.
             self.parsed_file[self.GROUPS_KEY][group] = str(updated_device_set)
+            record = self._journal_record(self.GROUPS_KEY, group, str(updated_device_set))
 
-        self.save_file()
+        self._commit([record])
+        self.group_cache.invalidate()
         return updated_device_set
 
+    # CANNED QUERIES
+    @_file_access()
+    def get_devices_by_type(self, device_type, device_name=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        if device_name is not None:
+            return super(FileStore, self).get_devices_by_type(device_type, device_name)
+        self._load_devices()
+        return self.add_profile_to_device(self.device_catalog.by_type(device_type))
+
+    @_file_access()
+    def get_profile_devices(self, profile_name):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        self._load_devices()
+        return self.add_profile_to_device(self.device_catalog.by_profile(profile_name))
+
+    @_file_access()
     def export_to_file(self, file_location):
         """
         See @DataStore for function description. Only implementation details here.
@@ -467,12 +1060,51 @@ class FileStore(DataStore):
         """
         self.save_file(file_location)
 
+    @_file_access()
+    def _iter_stored_devices(self, batch_size):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        self._load_devices()
+        return [copy.copy(device) for device in self.parsed_file.get(self.DEVICE_KEY, [])]
+
+    @contextmanager
+    def _import_transaction(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        The import is written to the file once, at the end. A failed import leaves the file as it was.
+        """
+        with self.batch():
+            yield
+
+    @_file_access(exclusive=True)
+    def _set_group(self, group, device_list):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        self.parsed_file.setdefault(self.GROUPS_KEY, {})[group] = device_list
+        self._commit([self._journal_record(self.GROUPS_KEY, group, device_list)])
+        self.group_cache.invalidate()
+
+    @_file_access(exclusive=True)
     def import_from_file(self, file_location):
         """
         See @DataStore for function description. Only implementation details here.
 
         Importing is very simple for the file store, simply copy to target file top the fileDB location and overwrite it
         """
+        self._load_devices()
+        old_device_ids = [device.get("device_id") for device in self.parsed_file.get(self.DEVICE_KEY) or []]
         self.parsed_file = JsonParser.read_file(file_location)
+        self.snapshot.close()
+        self._devices_loaded = True
+        self._refresh_device_catalog()
+        self._pending_records = list()
+        self._pending_history = list()
         self._setup_file_logger(self.log_level)
         self.save_file()
+        devices = self.parsed_file.get(self.DEVICE_KEY) or []
+        new_device_ids = set(device.get("device_id") for device in devices)
+        self._write_history([(device_id, None) for device_id in old_device_ids if device_id not in new_device_ids] +
+                            [(device.get("device_id"), device) for device in devices])
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Parsed and resolved device groups, so group expansion doesn't go back to the store for every @group.
+"""
+import time
+import threading
+from ClusterShell.NodeSet import NodeSet
+from ClusterShell.NodeUtils import GroupSource, GroupResolver
+
+
+class _StoredGroupSource(GroupSource):
+    """
+    Resolves the groups in a list_groups() result while the cache is built. Nested groups are resolved once and
+    reused, a group that (indirectly) contains itself resolves to nothing inside of itself.
+    """
+
+    def __init__(self, groups):
+        super(_StoredGroupSource, self).__init__("DataStoreCache", groups)
+        self.resolved = dict()
+        self._resolving = set()
+
+    def resolv_map(self, group):
+        return str(self.resolve(group))
+
+    def resolve(self, group):
+        node_set = self.resolved.get(group)
+        if node_set is not None:
+            return node_set
+        if group in self._resolving:
+            return NodeSet()
+        self._resolving.add(group)
+        try:
+            node_set = NodeSet(self.groups.get(group) or "", resolver=GroupResolver(default_source=self))
+        finally:
+            self._resolving.discard(group)
+        self.resolved[group] = node_set
+        return node_set
+
+
+class GroupCache(object):
+    """
+    Holds every group of a store as a NodeSet, with nested groups already resolved, and the groups of every device.
+    Everything is read with a single list_groups() call and kept until the store changes a group (see invalidate())
+    or the store reports a different _get_cache_key(). Stores that can't tell when another process changed a
+    group (the key is None) reload after MAX_AGE_SECONDS.
+    """
+    MAX_AGE_SECONDS = 10
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+        self.version = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._key = None
+        self._loaded_at = 0
+        self._names = list()
+        self._folded = dict()
+        self._device_groups = dict()
+
+    def invalidate(self):
+        """
+        Forget the groups, they are read again the next time they are needed.
+        :return:
+        """
+        with self._lock:
+            self._loaded = False
+            self.version += 1
+
+    def get_group_names(self):
+        """
+        :return: list of all group names
+        """
+        with self._lock:
+            self._refresh()
+            return list(self._names)
+
+    def get_group_nodes(self, group):
+        """
+        :param group: group name, without the @
+        :return: The devices in the group (including those of nested groups) as a folded string, "" for unknown groups.
+        """
+        with self._lock:
+            self._refresh()
+            return self._folded.get(group, "")
+
+    def get_device_groups(self, node_set):
+        """
+        :param node_set: NodeSet of devices
+        :return: The names of the groups that contain all of the devices, in list_groups() order.
+        """
+        with self._lock:
+            self._refresh()
+            common = None
+            for node in node_set:
+                groups = self._device_groups.get(node, ())
+                common = set(groups) if common is None else common.intersection(groups)
+                if not common:
+                    return list()
+            if common is None:
+                return list(self._names)
+            return [name for name in self._names if name in common]
+
+    def _refresh(self):
+        key = self.datastore._get_cache_key()
+        if self._loaded and key == self._key:
+            if key is not None or time.time() - self._loaded_at < self.MAX_AGE_SECONDS:
+                return
+        self._load(key)
+
+    def _load(self, key):
+        groups = self.datastore.list_groups() or dict()
+        source = _StoredGroupSource(groups)
+        self._names = list(groups.keys())
+        self._folded = dict()
+        self._device_groups = dict()
+        for name in self._names:
+            node_set = source.resolve(name)
+            self._folded[name] = str(node_set)
+            for node in node_set:
+                self._device_groups.setdefault(node, list()).append(name)
+        self._key = key
+        self._loaded_at = time.time()
+        self._loaded = True
+        self.version += 1
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Reads delimited log records from the end of a file, so the newest records don't cost a read of the whole file.
+"""
+import os
+from bisect import bisect_left, bisect_right
+
+
+class LogTimeIndex(object):
+    """
+    A sparse timestamp index of one log file: the byte offset and timestamp of the first record after every
+    checkpoint_bytes. It is built by seeking to each checkpoint and parsing a single record there, so building it
+    doesn't read the file, and records appended later only add checkpoints at the end.
+
+    The index is only used when the checkpoints ascend, a file small enough for a single checkpoint or with
+    timestamps out of order is read whole.
+    """
+
+    def __init__(self, filename, delimiter, timestamp_parser, checkpoint_bytes):
+        """
+        :param filename:
+        :param delimiter: bytes that end every record
+        :param timestamp_parser: function(record) -> comparable timestamp, may raise for records it can't parse.
+        :param checkpoint_bytes: distance between checkpoints
+        """
+        self.filename = filename
+        self.delimiter = delimiter
+        self.timestamp_parser = timestamp_parser
+        self.checkpoint_bytes = checkpoint_bytes
+        self.offsets = list()
+        self.timestamps = list()
+        self.size = 0
+        self.ascending = True
+        self._next_checkpoint = 0
+
+    @property
+    def usable(self):
+        """True if there are enough checkpoints, in order, to narrow down reads."""
+        return self.ascending and len(self.offsets) > 1
+
+    @property
+    def first_timestamp(self):
+        """The timestamp of the first record, None if the file has no complete record yet."""
+        if self.offsets and self.offsets[0] == 0:
+            return self.timestamps[0]
+        return None
+
+    def update(self):
+        """
+        Add the checkpoints for data appended since the last update.
+        :return:
+        """
+        with open(self.filename, "rb") as opened_file:
+            opened_file.seek(0, os.SEEK_END)
+            self.size = opened_file.tell()
+            while self._next_checkpoint < self.size:
+                checkpoint = self._read_checkpoint(opened_file, self._next_checkpoint)
+                if checkpoint is None:
+                    # The record there isn't complete yet, try again on the next update.
+                    break
+                offset, timestamp = checkpoint
+                if timestamp is not None and (not self.offsets or offset > self.offsets[-1]):
+                    if self.timestamps and timestamp < self.timestamps[-1]:
+                        self.ascending = False
+                    self.offsets.append(offset)
+                    self.timestamps.append(timestamp)
+                self._next_checkpoint += self.checkpoint_bytes
+
+    def byte_range(self, begin, end):
+        """
+        The part of the file that can hold records with begin < timestamp < end. One extra checkpoint is included on
+        both sides, for records that were written slightly out of order.
+        :return: (start, stop) offsets, stop is None for the end of the file.
+        """
+        first = bisect_right(self.timestamps, begin) - 2
+        start = self.offsets[first] if first >= 0 else 0
+        last = bisect_left(self.timestamps, end) + 1
+        stop = self.offsets[last] if last < len(self.offsets) else None
+        return start, stop
+
+    def _read_checkpoint(self, opened_file, position):
+        """
+        Find the first record that starts at or after position.
+        :return: (offset, timestamp) with timestamp None when the record can't be parsed, or None when there is no
+                 complete record after position.
+        """
+        if position == 0:
+            offset = 0
+        else:
+            # A delimiter ending right at position counts, so start looking a little before it.
+            offset = self._find_delimiter_end(opened_file, max(0, position - len(self.delimiter)))
+            if offset is None:
+                return None
+        record_end = self._find_delimiter_end(opened_file, offset)
+        if record_end is None:
+            return None
+        opened_file.seek(offset)
+        record = opened_file.read(record_end - len(self.delimiter) - offset)
+        try:
+            timestamp = self.timestamp_parser(record.decode("utf-8", "replace"))
+        except (RuntimeError, ValueError, OverflowError):
+            timestamp = None
+        return offset, timestamp
+
+    def _find_delimiter_end(self, opened_file, position, chunk_size=4096):
+        """The offset right after the first delimiter at or after position, None if there is none."""
+        opened_file.seek(position)
+        data = b""
+        while True:
+            chunk = opened_file.read(chunk_size)
+            if not chunk:
+                return None
+            data += chunk
+            found = data.find(self.delimiter)
+            if found != -1:
+                return position + found + len(self.delimiter)
+            # Keep enough of the tail for a delimiter split over two chunks.
+            keep = len(self.delimiter) - 1
+            if len(data) > keep:
+                position += len(data) - keep
+                data = data[len(data) - keep:]
+
+
+class LogReader(object):
+    """
+    Reads the records of log files last to first, BLOCK_SIZE bytes at a time from the end of the file, and stops as
+    soon as enough records were found. Time sliced reads use a LogTimeIndex per file to only read the part of the file
+    in the time slice. Indexes are kept by inode, so they stay valid when a RotatingFileHandler renames the file.
+    """
+    BLOCK_SIZE = 64 * 1024
+    CHECKPOINT_BYTES = 1024 * 1024
+    ENCODING = "utf-8"
+
+    def __init__(self, delimiter, timestamp_parser=None, block_size=None, checkpoint_bytes=None):
+        """
+        :param delimiter: str that ends every record
+        :param timestamp_parser: function(record) -> timestamp, needed for tail_between()
+        :param block_size:
+        :param checkpoint_bytes:
+        """
+        self.delimiter = delimiter.encode(self.ENCODING)
+        self.timestamp_parser = timestamp_parser
+        self.block_size = block_size or self.BLOCK_SIZE
+        self.checkpoint_bytes = checkpoint_bytes or self.CHECKPOINT_BYTES
+        self._indexes = dict()
+
+    def reverse_records(self, filename, start=0, stop=None):
+        """
+        Yield the non empty records of filename, last to first.
+        :param filename:
+        :param start: offset of the first record to read, must be the start of a record.
+        :param stop: offset right after the last record to read, None for the end of the file.
+        :return: generator of str
+        """
+        with open(filename, "rb") as opened_file:
+            if stop is None:
+                opened_file.seek(0, os.SEEK_END)
+                stop = opened_file.tell()
+            position = stop
+            remainder = b""
+            while position > start:
+                size = min(self.block_size, position - start)
+                position -= size
+                opened_file.seek(position)
+                records = (opened_file.read(size) + remainder).split(self.delimiter)
+                # The first piece can be the end of a record that starts in the block before this one.
+                remainder = records.pop(0)
+                for record in reversed(records):
+                    if record:
+                        yield record.decode(self.ENCODING, "replace")
+            if remainder:
+                yield remainder.decode(self.ENCODING, "replace")
+
+    def tail(self, filenames, limit, formatter=None, log_filter=None):
+        """
+        The last limit records that pass log_filter, oldest first.
+        :param filenames: The log file followed by its rotated files, newest to oldest.
+        :param limit:
+        :param formatter: Applied to every record that is read, before log_filter.
+        :param log_filter: Records for which it returns False are skipped.
+        :return: list
+        """
+        return self._tail([(filename, 0, None) for filename in filenames], limit, formatter, log_filter)
+
+    def tail_between(self, filenames, begin, end, limit, formatter=None, log_filter=None):
+        """
+        Like tail(), but only reads the parts of the files that can hold records with begin < timestamp < end.
+        log_filter still has to check the timestamps, the parts that are read hold records outside of the slice too.
+        :return: list
+        """
+        ranges = list()
+        for filename in filenames:
+            index = self.get_index(filename)
+            if not index.usable:
+                ranges.append((filename, 0, None))
+                continue
+            first_timestamp = index.first_timestamp
+            if first_timestamp is not None and first_timestamp >= end:
+                # Everything in this file is newer, the slice is in an older file.
+                continue
+            start, stop = index.byte_range(begin, end)
+            ranges.append((filename, start, stop))
+            if first_timestamp is not None and first_timestamp <= begin:
+                # Older files can't have anything in the slice.
+                break
+        return self._tail(ranges, limit, formatter, log_filter)
+
+    def get_index(self, filename):
+        """
+        The up to date LogTimeIndex of filename.
+        :return: LogTimeIndex
+        """
+        stat = os.stat(filename)
+        key = (stat.st_dev, stat.st_ino)
+        index = self._indexes.get(key)
+        if index is None or stat.st_size < index.size:
+            # New file, or one that was truncated.
+            index = LogTimeIndex(filename, self.delimiter, self.timestamp_parser, self.checkpoint_bytes)
+            self._indexes[key] = index
+        index.filename = filename
+        index.update()
+        return index
+
+    def _tail(self, ranges, limit, formatter, log_filter):
+        limit = int(limit)
+        lines = list()
+        for filename, start, stop in ranges:
+            if len(lines) >= limit:
+                break
+            for line in self.reverse_records(filename, start, stop):
+                if formatter is not None:
+                    line = formatter(line)
+                if log_filter is None or log_filter(line):
+                    lines.append(line)
+                    if len(lines) >= limit:
+                        break
+        lines.reverse()
+        return lines
+
+    @staticmethod
+    def rotated_files(filename, backup_count):
+        """
+        The files a RotatingFileHandler writes to, newest to oldest, that exist.
+        :param filename:
+        :param backup_count:
+        :return: list of file names
+        """
+        filenames = [filename]
+        for number in range(1, int(backup_count or 0) + 1):
+            rotated = "{}.{}".format(filename, number)
+            if os.path.isfile(rotated):
+                filenames.append(rotated)
+        return filenames
@@ -6,6 +6,12 @@
 For when multiple database are used to store information. Generally this works well for storage but getting from
 both databases is generally discouraged.
 """
+import copy
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from .datastore import DataStore, DataStoreException
 
 
@@ -13,55 +19,183 @@ class MultiStore(DataStore):
     """
     MultiStore performs the same command on all passed DataStore Objects. Then asserts that the results are the same.
     After passing this check the first result is returned.
+
+    The stores are called at the same time, each store from its own worker thread, so a call takes as long as the
+    slowest store instead of all of them added up. Results are compared by a digest of their content. Writes always go
+    to all stores. Only set_device() for new devices calls the first store on its own first, so the other stores store
+    them with the device_ids the first store picked. How reads are answered depends on the read policy:
+        READ_VERIFY: All stores are read and must return the same result (the default).
+        READ_PRIMARY: Only the first store is read.
+        READ_FIRST_RESPONSE: All stores are read, the first result that comes back is used.
+        READ_QUORUM: All stores are read, the first result returned by a majority of the stores is used.
     """
+    READ_VERIFY = "verify"
+    READ_PRIMARY = "primary"
+    READ_FIRST_RESPONSE = "first_response"
+    READ_QUORUM = "quorum"
+    READ_POLICIES = [READ_VERIFY, READ_PRIMARY, READ_FIRST_RESPONSE, READ_QUORUM]
 
-    def __init__(self, dbs):
+    def __init__(self, dbs, read_policy=None):
         super(MultiStore, self).__init__()
         self.dbs = dbs
         if len(self.dbs) <= 1:
             raise DataStoreException("The MultiStore is designed to be used with multiple databases. "
                                      "Expected > 1 dbs, got {}".format(len(self.dbs)))
+        self.read_policy = read_policy if read_policy is not None else self.READ_VERIFY
+        if self.read_policy not in self.READ_POLICIES:
+            raise DataStoreException("Unknown read policy '{}', expected one of {}".format(self.read_policy,
+                                                                                        self.READ_POLICIES))
+        # One worker per store: stores run in parallel, but a single store is never used by two workers at once.
+        self._executors = [ThreadPoolExecutor(max_workers=1) for _ in self.dbs]
+        self._timings_lock = threading.Lock()
+        self._timings = [{"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0} for _ in self.dbs]
+
+    @staticmethod
+    def _result_digest(result):
+        """
+        A digest of the content of a result, equal results have equal digests.
+        :param result: What a DataStore function returned
+        :return: str
+        """
+        try:
+            content = json.dumps(result, sort_keys=True, default=str)
+        except (TypeError, ValueError):
+            content = repr(result)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
 
     @staticmethod
     def _all_results_equal(results):
-        for result1 in results:
-            for result2 in results:
-                if result1 != result2:
-                    raise DataStoreException("Returned results from multiple databases were different. "
-                                             "Got {} and {}.".format(result1, result2))
+        digests = [MultiStore._result_digest(result) for result in results]
+        for index, digest in enumerate(digests):
+            if digest != digests[0]:
+                raise DataStoreException("Returned results from multiple databases were different. "
+                                         "Got {} and {}.".format(results[0], results[index]))
+
+    def get_store_timings(self):
+        """
+        How long the calls to each store took.
+        :return: A list with a dict per store (in the order the stores were given): store, calls, errors,
+                 total_seconds and max_seconds.
+        """
+        with self._timings_lock:
+            timings = [dict(timing) for timing in self._timings]
+        for db, timing in zip(self.dbs, timings):
+            timing["store"] = type(db).__name__
+        return timings
+
+    def _timed_call(self, index, function_name, args):
+        """Runs in the worker thread of store index."""
+        start = time.time()
+        failed = True
+        try:
+            result = getattr(self.dbs[index], function_name)(*args)
+            failed = False
+            return result
+        finally:
+            elapsed = time.time() - start
+            with self._timings_lock:
+                timing = self._timings[index]
+                timing["calls"] += 1
+                timing["total_seconds"] += elapsed
+                timing["max_seconds"] = max(timing["max_seconds"], elapsed)
+                if failed:
+                    timing["errors"] += 1
+
+    def _submit(self, function_name, args, first=0):
+        # Stores change their arguments (i.e. set_device() writes the device_id into device_info), so every store but
+        # the first one called gets its own copy, made before any store runs.
+        store_args = [args] + [copy.deepcopy(args) for _ in self._executors[first + 1:]]
+        return [self._executors[index].submit(self._timed_call, index, function_name, store_args[index - first])
+                for index in range(first, len(self._executors))]
+
+    def _call_primary(self, function_name, args):
+        return self._executors[0].submit(self._timed_call, 0, function_name, args).result()
 
     def _call_function(self, function_name, args):
-        results = list()
-        for db in self.dbs:
-            func = getattr(db, function_name)
-            results.append(func(*args))
+        """
+        Call function_name on all stores and check that they all returned the same result.
+        :return: The results of all stores, in store order.
+        """
+        futures = self._submit(function_name, args)
+        wait(futures)
+        # future.result() raises what the store raised, for the first store that failed.
+        results = [future.result() for future in futures]
 
         self._all_results_equal(results)
         return results
 
+    def _read(self, function_name, args):
+        """
+        Call function_name on the stores as the read policy says.
+        :return: The result
+        """
+        if self.read_policy == self.READ_VERIFY:
+            return self._call_function(function_name, args)[0]
+        if self.read_policy == self.READ_PRIMARY:
+            return self._call_primary(function_name, args)
+
+        if self.read_policy == self.READ_QUORUM:
+            needed = len(self.dbs) // 2 + 1
+        else:
+            needed = 1
+        votes = dict()
+        errors = list()
+        pending = set(self._submit(function_name, args))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as ex:  # pylint: disable=broad-except
+                    errors.append(ex)
+                    continue
+                digest = self._result_digest(result)
+                count, first_result = votes.get(digest, (0, result))
+                votes[digest] = (count + 1, first_result)
+                if count + 1 >= needed:
+                    return first_result
+        if len(errors) == len(self.dbs):
+            raise errors[0]
+        raise DataStoreException("No {} of the {} databases returned the same result for {}, got {} different results "
+                                 "and {} errors.".format(needed, len(self.dbs), function_name, len(votes),
+                                                         len(errors)))
+
     def get_device(self, device_name):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_device(device_name)
-        results = self._call_function("get_device", [device_name])
-        return results[0]
+        return self._read("get_device", [device_name])
 
-    def list_devices(self, filters=None):
+    def list_devices(self, filters=None, fields=None):
         """
         See @DataStore description
         """
-        super(MultiStore, self).list_devices(filters)
-        results = self._call_function("list_devices", [filters])
-        return results[0]
+        super(MultiStore, self).list_devices(filters, fields)
+        return self._read("list_devices", [filters, fields])
 
     def set_device(self, device_info):
         """
         See @DataStore description
         """
         super(MultiStore, self).set_device(device_info)
-        results = self._call_function("set_device", [device_info])
-        return results[0]
+        device_list = device_info if isinstance(device_info, list) else [device_info]
+        if all(device.get("device_id") is not None for device in device_list):
+            results = self._call_function("set_device", [device_info])
+            return results[0]
+
+        # Each store would pick its own device_id for a new device, and they don't always pick the same one (i.e. a
+        # FileStore reuses the id of a deleted device, a PostgresStore doesn't). The first store picks the ids, then the
+        # other stores get the devices with those ids.
+        device_ids = self._call_primary("set_device", [device_info])
+        device_list = copy.deepcopy(device_list)
+        for device, device_id in zip(device_list, device_ids):
+            device["device_id"] = device_id
+        futures = self._submit("set_device", [device_list if isinstance(device_info, list) else device_list[0]], 1)
+        wait(futures)
+        results = [device_ids] + [future.result() for future in futures]
+        self._all_results_equal(results)
+        return device_ids
 
     def delete_device(self, device_name):
         """
@@ -76,24 +210,49 @@ class MultiStore(DataStore):
         See @DataStore description
         """
         super(MultiStore, self).get_device_history(device_name)
-        results = self._call_function("get_device_history", [device_name])
-        return results[0]
+        return self._read("get_device_history", [device_name])
+
+    def get_devices(self, device_list, include_related=()):
+        """
+        See @DataStore description
+        """
+        self.logger.debug("DataStore.get_devices called, include_related={}".format(include_related),
+                          device_name=device_list)
+        return self._read("get_devices", [device_list, include_related])
+
+    def subscribe(self, callback=None, entities=None):
+        """
+        See @DataStore description
+
+        Writes go to all stores, so following the first store that publishes changes is enough.
+        """
+        for db in self.dbs:
+            try:
+                return db.subscribe(callback, entities)
+            except DataStoreException:
+                continue
+        return super(MultiStore, self).subscribe(callback, entities)
+
+    def list_devices_as_of(self, timestamp, device_list=None):
+        """
+        See @DataStore description
+        """
+        self.logger.debug("DataStore.list_devices_as_of called: {}".format(timestamp), device_name=device_list)
+        return self._read("list_devices_as_of", [timestamp, device_list])
 
     def get_profile(self, profile_name=None):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_profile(profile_name)
-        results = self._call_function("get_profile", [profile_name])
-        return results[0]
+        return self._read("get_profile", [profile_name])
 
     def list_profiles(self, filters=None):
         """
         See @DataStore description
         """
         super(MultiStore, self).list_profiles(filters)
-        results = self._call_function("list_profiles", [filters])
-        return results[0]
+        return self._read("list_profiles", [filters])
 
     def set_profile(self, profile_info):
         """
@@ -101,6 +260,7 @@ class MultiStore(DataStore):
         """
         super(MultiStore, self).set_profile(profile_info)
         results = self._call_function("set_profile", [profile_info])
+        self.profile_cache.invalidate()
         return results[0]
 
     def delete_profile(self, profile_name):
@@ -109,6 +269,7 @@ class MultiStore(DataStore):
         """
         super(MultiStore, self).delete_profile(profile_name)
         results = self._call_function("delete_profile", [profile_name])
+        self.profile_cache.invalidate()
         return results[0]
 
     def list_logs(self, device_name=None, limit=100):
@@ -116,16 +277,14 @@ class MultiStore(DataStore):
         See @DataStore description
         """
         super(MultiStore, self).list_logs(device_name, limit)
-        results = self._call_function("list_logs", [device_name, limit])
-        return results[0]
+        return self._read("list_logs", [device_name, limit])
 
     def list_logs_between_timeslice(self, begin, end, device_name=None, limit=100):
         """
         See @DataStore description
         """
         super(MultiStore, self).list_logs_between_timeslice(begin, end, device_name, limit)
-        results = self._call_function("list_logs_between_timeslice", [begin, end, device_name, limit])
-        return results[0]
+        return self._read("list_logs_between_timeslice", [begin, end, device_name, limit])
 
     def add_log(self, level, msg, device_name=None, process=None):
         """
@@ -140,16 +299,14 @@ class MultiStore(DataStore):
         See @DataStore description
         """
         super(MultiStore, self).get_configuration_value(key)
-        results = self._call_function("get_configuration_value", [key])
-        return results[0]
+        return self._read("get_configuration_value", [key])
 
     def list_configuration(self):
         """
         See @DataStore description
         """
         super(MultiStore, self).list_configuration()
-        results = self._call_function("list_configuration", [])
-        return results[0]
+        return self._read("list_configuration", [])
 
     def set_configuration(self, key, value):
         """
@@ -172,16 +329,14 @@ class MultiStore(DataStore):
         See @DataStore description
         """
         super(MultiStore, self).list_groups()
-        results = self._call_function("list_groups", [])
-        return results[0]
+        return self._read("list_groups", [])
 
     def get_group_devices(self, group):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_group_devices(group)
-        results = self._call_function("get_group_devices", [group])
-        return results[0]
+        return self._read("get_group_devices", [group])
 
     def add_to_group(self, device_list, group):
         """
@@ -189,6 +344,7 @@ class MultiStore(DataStore):
         """
         super(MultiStore, self).add_to_group(device_list, group)
         results = self._call_function("add_to_group", [device_list, group])
+        self.group_cache.invalidate()
         return results[0]
 
     def remove_from_group(self, device_list, group):
@@ -197,6 +353,7 @@ class MultiStore(DataStore):
         """
         super(MultiStore, self).remove_from_group(device_list, group)
         results = self._call_function("remove_from_group", [device_list, group])
+        self.group_cache.invalidate()
         return results[0]
 
     # UTIL FUNCTIONS
@@ -205,16 +362,14 @@ class MultiStore(DataStore):
         See @DataStore description
         """
         super(MultiStore, self).get_device_types()
-        results = self._call_function("get_device_types", [])
-        return results[0]
+        return self._read("get_device_types", [])
 
     def get_log_levels(self):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_log_levels()
-        results = self._call_function("get_log_levels", [])
-        return results[0]
+        return self._read("get_log_levels", [])
 
     # CANNED QUERIES
     def get_node(self, device_name=None):
@@ -222,40 +377,36 @@ class MultiStore(DataStore):
         See @DataStore description
         """
         super(MultiStore, self).get_node()
-        results = self._call_function("get_node", [device_name])
-        return results[0]
+        return self._read("get_node", [device_name])
 
     def get_bmc(self, device_name=None):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_bmc()
-        results = self._call_function("get_bmc", [device_name])
-        return results[0]
+        return self._read("get_bmc", [device_name])
 
     def get_pdu(self, device_name=None):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_pdu()
-        results = self._call_function("get_pdu", [device_name])
-        return results[0]
+        return self._read("get_pdu", [device_name])
 
     def get_profile_devices(self, profile_name):
         """
         See @DataStore description
         """
         super(MultiStore, self).get_profile_devices(profile_name)
-        results = self._call_function("get_profile_devices", [profile_name])
-        return results[0]
+        return self._read("get_profile_devices", [profile_name])
 
     def export_to_file(self, file_location):
         """
         See @DataStore description
         """
         super(MultiStore, self).export_to_file(file_location)
-        results = self._call_function("export_to_file", [file_location])
-        return results[0]
+        # Every store would write the same file, at the same time. Export what the first store has.
+        return self._call_primary("export_to_file", [file_location])
 
     def import_from_file(self, file_location):
         """
@@ -264,3 +415,24 @@ class MultiStore(DataStore):
         super(MultiStore, self).import_from_file(file_location)
         results = self._call_function("import_from_file", [file_location])
         return results[0]
+
+    def export_to_stream(self, file_location):
+        """
+        See @DataStore description
+        """
+        # Every store would write the same file, at the same time. Export what the first store has.
+        return self._call_primary("export_to_stream", [file_location])
+
+    def import_from_stream(self, file_location, batch_size=None, progress=None):
+        """
+        See @DataStore description. progress is only reported for the first store.
+        """
+        futures = [executor.submit(self._timed_call, index, "import_from_stream",
+                                   [file_location, batch_size, progress if index == 0 else None])
+                   for index, executor in enumerate(self._executors)]
+        wait(futures)
+        results = [future.result() for future in futures]
+        self._all_results_equal(results)
+        self.group_cache.invalidate()
+        self.profile_cache.invalidate()
+        return results[0]
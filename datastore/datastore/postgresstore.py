@@ -9,55 +9,224 @@ For handling the DataStore inteerface in postgres
 import json
 import copy
 import logging
+import time
+import queue
 import datetime
+import threading
+from contextlib import contextmanager
 import psycopg2
 from ClusterShell.NodeSet import NodeSet, RESOLVER_NOGROUP
 from .datastore import DataStore, DataStoreException
 from .utilities import DataStoreUtilities
+from .connection_pool import ConnectionPool
 
 
 class PostgresLogHandler(logging.Handler):
     """
     Log handler for prints log statments to the database.
-    """
 
-    def __init__(self, datastore):
+    emit() only puts the record on a bounded queue. A background thread writes the queued records with one multi-row
+    INSERT per batch, when batch_size records are waiting, flush_seconds after the first of them was queued, on
+    flush() and on close(). Logging calls never wait for the database, unless the queue is full and the overflow
+    policy is OVERFLOW_BLOCK.
+    """
+    BATCH_SIZE = 200
+    FLUSH_SECONDS = 1.0
+    QUEUE_SIZE = 10000
+    # What emit() does with a record when the queue is full.
+    OVERFLOW_DROP_OLDEST = "drop_oldest"
+    OVERFLOW_DROP_NEWEST = "drop_newest"
+    OVERFLOW_BLOCK = "block"
+    _FLUSH = "flush"
+    _STOP = "stop"
+
+    def __init__(self, datastore, batch_size=None, flush_seconds=None, queue_size=None, overflow=None):
+        """
+        :param datastore: The PostgresStore to write to
+        :param batch_size: The most records in one INSERT, defaults to BATCH_SIZE
+        :param flush_seconds: The longest a record waits for more records, defaults to FLUSH_SECONDS
+        :param queue_size: The most records that wait to be written, defaults to QUEUE_SIZE
+        :param overflow: One of the OVERFLOW_* policies, defaults to OVERFLOW_DROP_OLDEST
+        """
         super(PostgresLogHandler, self).__init__()
         self.datastore = datastore
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.flush_seconds = flush_seconds if flush_seconds is not None else self.FLUSH_SECONDS
+        self.overflow = overflow or self.OVERFLOW_DROP_OLDEST
+        if self.overflow not in [self.OVERFLOW_DROP_OLDEST, self.OVERFLOW_DROP_NEWEST, self.OVERFLOW_BLOCK]:
+            raise DataStoreException("Unknown log overflow policy '{}'".format(self.overflow))
+        self.queue = queue.Queue(queue_size or self.QUEUE_SIZE)
+        # Records that were dropped because the queue was full, or could not be written.
+        self.dropped = 0
+        self.failed = 0
+        self._reported_dropped = 0
+        self._writer = None
+        self._counter_lock = threading.Lock()
 
     def emit(self, record):
+        entry = (record.name, datetime.datetime.utcfromtimestamp(record.created), record.levelno,
+                 getattr(record, "device_name", None), record.msg)
+        self._start_writer()
+        if self.overflow == self.OVERFLOW_BLOCK:
+            self.queue.put(entry)
+            return
+        try:
+            self.queue.put_nowait(entry)
+            return
+        except queue.Full:
+            pass
+        if self.overflow == self.OVERFLOW_DROP_OLDEST:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.queue.put_nowait(entry)
+            except (queue.Empty, queue.Full):
+                pass
+        with self._counter_lock:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Wait until every record queued so far is written.
+        """
+        if self._writer is not None and self._writer.is_alive():
+            self.queue.put(self._FLUSH)
+            self.queue.join()
+
+    def close(self):
+        """
+        Write the queued records and stop the background thread.
+        """
+        if self._writer is not None and self._writer.is_alive():
+            self.queue.put(self._STOP)
+            self._writer.join()
+        self._writer = None
+        super(PostgresLogHandler, self).close()
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        with self._counter_lock:
+            if self._writer is None:
+                writer = threading.Thread(target=self._write_loop, name="PostgresLogHandler")
+                writer.daemon = True
+                writer.start()
+                self._writer = writer
+
+    def _write_loop(self):
+        while True:
+            batch = list()
+            command = self.queue.get()
+            deadline = time.time() + self.flush_seconds
+            while command not in [self._FLUSH, self._STOP]:
+                batch.append(command)
+                remaining = deadline - time.time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    command = None
+                    break
+                try:
+                    command = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    command = None
+                    break
+
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+            if command is not None:
+                self.queue.task_done()
+            if command == self._STOP:
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self._counter_lock:
+            dropped = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+        if dropped:
+            batch = batch + [(self.__class__.__name__, datetime.datetime.utcnow(), logging.WARNING, None,
+                              "{} log records were dropped, the log queue was full".format(dropped))]
         try:
-            self.datastore.add_log(record.levelno, record.msg, getattr(record, "device_name", None), record.name)
+            self._add_logs(batch)
+            return
+        except Exception:
+            pass
+        # One bad record fails the whole INSERT, write them one at a time to lose only the bad ones.
+        for entry in batch:
+            try:
+                self._add_logs([entry])
+            except Exception:
+                with self._counter_lock:
+                    self.failed += 1
+
+    def _add_logs(self, entries):
+        try:
+            self.datastore.add_logs(entries)
         except psycopg2.InterfaceError:
-            self.datastore.connect()
-            self.datastore.add_log(record.levelno, record.msg, getattr(record, "device_name", None), record.name)
+            # Only this thread's connection is broken, the other threads keep theirs.
+            self.datastore.reset_connection()
+            self.datastore.add_logs(entries)
 
 
 class PostgresStore(DataStore):
     """
     Data Store interface.
-    """
 
-    def __init__(self, location, log_level=None):
+    Every thread gets its own connection and cursor from a bounded ConnectionPool, so threads never share a cursor or
+    a transaction. A thread keeps its connection until release_connection() is called or the thread ends.
+    """
+    POOL_SIZE = 8
+    POOL_TIMEOUT_SECONDS = 30
+    # Stored procedures that are called often enough to be prepared once per connection.
+    PREPARED_PROCEDURES = {
+        "public.get_device_details": 1,
+        "public.get_profile": 1,
+        "public.get_configuration_value": 1,
+        "public.add_log": 5,
+    }
+
+    def __init__(self, location, log_level=None, pool_size=None):
         """
         Creates the object with parameters passed in. Then calles the connect method, and sets up
         the logger for use.
         :param location:
         :param log_level:
+        :param pool_size: The most connections that are open at one time, defaults to PostgresStore.POOL_SIZE
         """
         super(PostgresStore, self).__init__()
         self.connection_uri = location
-        self.connection = None
-        self.cursor = None
+        self.pool_size = pool_size if pool_size is not None else self.POOL_SIZE
+        self.pool = None
+        self._local = threading.local()
         self.connect()
         self.log_level = log_level if log_level is not None else DataStore.LOG_LEVEL
         self._setup_postgres_logger(log_level)
 
     def __del__(self):
-        if self.cursor is not None:
-            self.cursor.close()
-        if self.connection is not None:
-            self.connection.close()
+        if getattr(self, "pool", None) is not None:
+            self.pool.close()
+
+    @property
+    def connection(self):
+        """The connection of the calling thread"""
+        return self._get_pooled_connection().connection
+
+    @property
+    def cursor(self):
+        """The cursor of the calling thread"""
+        return self._get_pooled_connection().cursor
+
+    @cursor.setter
+    def cursor(self, cursor):
+        self._get_pooled_connection().cursor = cursor
+
+    def _get_pooled_connection(self):
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is None:
+            pooled = self.pool.acquire()
+            self._local.pooled = pooled
+        return pooled
 
     def _setup_postgres_logger(self, log_level):
         if log_level is None:
@@ -78,25 +247,102 @@ class PostgresStore(DataStore):
 
     def connect(self):
         """
-        Close any open connections, and make them again. This will destroy any uncommited changes.
+        Close any open connections, and make them again. This will destroy any uncommited changes, in every thread.
+
+        :return:
+        """
+        if self.pool is not None:
+            self.pool.close()
+        self._local = threading.local()
+        self.pool = ConnectionPool(self.connection_uri, self.pool_size, self.POOL_TIMEOUT_SECONDS)
+        # Connect right away, so a bad connection string is reported here.
+        self._get_pooled_connection()
+
+    def reset_connection(self):
+        """
+        Replace the calling thread's connection with a new one, i.e. after it broke. The uncommited changes of this
+        thread are lost.
+        :return:
+        """
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is None:
+            self._get_pooled_connection()
+        else:
+            self._local.pooled = self.pool.replace(pooled)
+
+    def release_connection(self):
+        """
+        Give the calling thread's connection back to the pool, for threads that are done with the DataStore but keep
+        running. Uncommited changes are rolled back. The next call from this thread gets a connection again.
+        :return:
+        """
+        pooled = getattr(self._local, "pooled", None)
+        if pooled is not None:
+            self._local.pooled = None
+            self.pool.release(pooled)
 
+    def get_pool_stats(self):
+        """
+        :return: dict of connection pool counters, see ConnectionPool.stats()
+        """
+        return self.pool.stats()
+
+    def _commit(self):
+        """
+        Commit the calling thread's changes, unless they are part of a larger transaction (see _import_transaction).
         :return:
         """
-        if getattr(self, "cursor", None) is not None:
-            self.cursor.close()
-            self.connection.close()
+        if not getattr(self._local, "in_transaction", False):
+            self.connection.commit()
 
-        self.connection = psycopg2.connect(self.connection_uri)
-        if self.connection is None:
-            raise DataStoreException("Unable to connect to postgres with connection: `{}`".format(self.connection_uri))
-        self.cursor = self.connection.cursor()
+    @contextmanager
+    def _import_transaction(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        The whole import is one transaction, a failed import leaves the database as it was.
+        """
+        self._local.in_transaction = True
+        try:
+            yield
+        except BaseException:
+            self._local.in_transaction = False
+            self.connection.rollback()
+            self.group_cache.invalidate()
+            self.profile_cache.invalidate()
+            raise
+        self._local.in_transaction = False
+        # Devices were imported with their device_id, new devices have to get ids after them.
+        self.cursor.execute("SELECT setval(pg_get_serial_sequence('public.device', 'device_id'), "
+                            "COALESCE(MAX(device_id), 0) + 1, false) FROM public.device;")
+        self.connection.commit()
+
+    def _callproc(self, procedure, args):
+        """
+        cursor.callproc() for procedures in PREPARED_PROCEDURES goes through a statement that is prepared once for each
+        connection. Other procedures are called with cursor.callproc().
+        :param procedure: Name of the stored procedure
+        :param args: list of arguments
+        :return:
+        """
+        arg_count = self.PREPARED_PROCEDURES.get(procedure)
+        if arg_count is None or arg_count != len(args):
+            self.cursor.callproc(procedure, args)
+            return
+        pooled = self._get_pooled_connection()
+        statement = procedure.replace(".", "_")
+        if statement not in pooled.prepared:
+            placeholders = ", ".join("${}".format(index + 1) for index in range(arg_count))
+            pooled.cursor.execute("PREPARE {} AS SELECT * FROM {}({});".format(statement, procedure, placeholders))
+            pooled.prepared.add(statement)
+        pooled.cursor.execute("EXECUTE {}({});".format(statement, ", ".join(["%s"] * arg_count)), args)
 
     def get_device(self, device_name):
         """
         See @DataStore for function description. Only implementation details here.
         """
         super(PostgresStore, self).get_device(device_name)
-        self.cursor.callproc("public.get_device_details", [str(device_name)])
+        self._callproc("public.get_device_details", [str(device_name)])
         result = self.cursor.fetchall()
         self.logger.debug("DataStore.get_device database result: {}".format(result))
         devices = SqlParser.get_device_from_results(result)
@@ -106,16 +352,45 @@ class PostgresStore(DataStore):
         self.logger.info("DataStore.get_device: {}".format(device))
         return device
 
-    def list_devices(self, filters=None):
+    def get_devices(self, device_list, include_related=()):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        public.get_devices returns the devices and their related devices in one query, the names are matched to the
+        returned devices here.
+        """
+        self.logger.debug("DataStore.get_devices called, include_related={}".format(include_related),
+                          device_name=device_list)
+        if not isinstance(device_list, list):
+            device_list = self.expand_device_list(device_list)
+        if not device_list:
+            return dict()
+        self._callproc("public.get_devices", [[str(name) for name in device_list], list(include_related or ())])
+        result = self.cursor.fetchall()
+        self.logger.debug("DataStore.get_devices database result: {}".format(result))
+        found = SqlParser.get_device_from_results(result)
+        devices = self._match_device_names(device_list, found)
+        related = [name for name in self._related_device_names(devices.values(), include_related)
+                   if name not in devices]
+        devices.update(self._match_device_names(related, found))
+        return devices
+
+    def list_devices(self, filters=None, fields=None):
         """
         See @DataStore for function description. Only implementation details here.
+
+        Filters and fields are handled by the database where it can, see SqlParser.prepare_device_list_query. The
+        filters are applied once more to the returned rows, for the filter values that SQL doesn't compare the way
+        python does.
         """
-        super(PostgresStore, self).list_devices(filters)
-        self.cursor.callproc("public.get_device_details", [None])
+        super(PostgresStore, self).list_devices(filters, fields)
+        query, args = SqlParser.prepare_device_list_query(filters, fields)
+        self.cursor.execute(query, args)
         result = self.cursor.fetchall()
         self.logger.debug("DataStore.list_devices database result: {}".format(result))
         devices = SqlParser.get_device_from_results(result)
         filtered_devices = DataStoreUtilities.filter_dict(devices, filters)
+        filtered_devices = DataStoreUtilities.project_dict(filtered_devices, fields)
         self.logger.info("DataStore.list_devices: {}".format(filtered_devices))
         return filtered_devices
 
@@ -128,19 +403,25 @@ class PostgresStore(DataStore):
         if not isinstance(device_info_list, list):
             device_info_list = [device_info_list]
 
-        set_ids = list()
-        # TODO: change this for loop into one batch upsert query.
-        for device_info in device_info_list:
-            args = SqlParser.prepare_device_for_query(self._remove_profile_from_device(device_info)[0])
-            self.cursor.callproc("public.upsert_device", args)
-            result = self.cursor.fetchall()
-            self.logger.debug("DataStore.set_device database result: {}".format(result))
-            if result is None or len(result) != 1 or result[0][0] != 1:
-                raise DataStoreException("Upsert query affected {} rows, excepted 1".format(result[0][0] if result else 0))
-            set_ids.append(result[0][1])
+        if not device_info_list:
+            return list()
 
-        self.connection.commit()
-        return set_ids
+        # One round trip for the whole list, the ids come back in the order of device_info_list.
+        devices = self._remove_profile_from_device(device_info_list)
+        self.cursor.callproc("public.upsert_devices", [SqlParser.prepare_devices_for_query(devices)])
+        result = self.cursor.fetchall()
+        self.logger.debug("DataStore.set_device database result: {}".format(result))
+        if result is None or len(result) != len(devices):
+            self.connection.rollback()
+            raise DataStoreException("Upsert query returned {} rows, excepted {}".format(len(result) if result else 0,
+                                                                                        len(devices)))
+        for row in result:
+            if row[0] != 1:
+                self.connection.rollback()
+                raise DataStoreException("Upsert query affected {} rows, excepted 1".format(row[0]))
+
+        self._commit()
+        return [row[1] for row in result]
 
     def delete_device(self, device_list):
         """
@@ -149,21 +430,27 @@ class PostgresStore(DataStore):
         super(PostgresStore, self).delete_device(device_list)
         if not isinstance(device_list, list):
             device_list = [device_list]
+        if not device_list:
+            return list()
 
+        device_names = [str(device_name) for device_name in device_list]
+        self.cursor.callproc("public.delete_devices", [device_names])
+        result = self.cursor.fetchall()
+        self.logger.debug("DataStore.delete_device database result: {}".format(result))
+        if result is None or len(result) != len(device_names):
+            self.connection.rollback()
+            raise DataStoreException("Delete query returned {} rows, excepted {}".format(len(result) if result else 0,
+                                                                                        len(device_names)))
         deleted_device_ids = list()
-
-        for device_name in device_list:
-            device_name = str(device_name)
-            self.cursor.callproc("public.delete_device", [device_name])
-            result = self.cursor.fetchall()
-            self.logger.debug("DataStore.delete_device database result: {}".format(result))
-            if result is None or result[0][0] > 1:
-                raise DataStoreException("Delete query affected {} rows, excepted 1".format(result[0][0] if result else 0))
-            if result[0][0] == 1:
+        for row in result:
+            if row[0] > 1:
+                self.connection.rollback()
+                raise DataStoreException("Delete query affected {} rows, excepted 1".format(row[0]))
+            if row[0] == 1:
                 # The affected device_id
-                self.logger.debug("DataStore.delete_device deleted device: {}".format(result[0][1]))
-                deleted_device_ids.append(result[0][1])
-        self.connection.commit()
+                self.logger.debug("DataStore.delete_device deleted device: {}".format(row[1]))
+                deleted_device_ids.append(row[1])
+        self._commit()
 
         return deleted_device_ids
 
@@ -181,12 +468,44 @@ class PostgresStore(DataStore):
         self.logger.info("DataStore.get_device_history: {}".format(devices))
         return devices
 
+    def list_devices_as_of(self, timestamp, device_list=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        public.get_devices_as_of reads device and device_history through their sys_period indexes.
+        """
+        self.logger.debug("DataStore.list_devices_as_of called: {}".format(timestamp), device_name=device_list)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+        device_names = None if device_list is None else self.expand_device_list(device_list)
+        self.cursor.callproc("public.get_devices_as_of", [timestamp, device_names])
+        result = self.cursor.fetchall()
+        self.logger.debug("DataStore.list_devices_as_of database result: {}".format(result))
+        devices = SqlParser.get_device_from_results(result)
+        for device in devices:
+            device.pop("sys_period", None)
+        return devices
+
+    def subscribe(self, callback=None, entities=None):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        Triggers on the device, profile, group and configuration tables pg_notify() every committed change, the
+        ChangeFeed LISTENs on its own connection outside the pool.
+        """
+        from .change_feed import ChangeFeed
+        feed = ChangeFeed(self.connection_uri, entities, self.logger)
+        feed.listen()
+        if callback is not None:
+            feed.start(callback)
+        return feed
+
     def get_profile(self, profile_name):
         """
         See @DataStore for function description. Only implementation details here.
         """
         super(PostgresStore, self).get_profile(profile_name)
-        self.cursor.callproc("public.get_profile", [str(profile_name)])
+        self._callproc("public.get_profile", [str(profile_name)])
         result = self.cursor.fetchall()
         self.logger.debug("DataStore.get_profile database result: {}".format(result))
         profiles = SqlParser.get_profile_from_results(result)
@@ -201,7 +520,7 @@ class PostgresStore(DataStore):
         See @DataStore for function description. Only implementation details here.
         """
         super(PostgresStore, self).list_profiles(filters)
-        self.cursor.callproc("public.get_profile", [None])
+        self._callproc("public.get_profile", [None])
         result = self.cursor.fetchall()
         self.logger.debug("DataStore.list_profiles database result: {}".format(result))
         profiles = SqlParser.get_profile_from_results(result)
@@ -221,7 +540,8 @@ class PostgresStore(DataStore):
         self.logger.debug("DataStore.set_profile database result: {}".format(result))
         if result is None or len(result) != 1 or result[0][0] > 1:
             raise DataStoreException("Upsert query affected {} rows, excepted 1".format(result[0][0] if result else 0))
-        self.connection.commit()
+        self._commit()
+        self.profile_cache.invalidate()
         if int(result[0][0]) == 1:
             self.logger.info("DataStore.set_profile affected profile: {}".format(profile_name))
             return profile_name
@@ -239,7 +559,8 @@ class PostgresStore(DataStore):
         self.logger.debug("DataStore.delete_profile database result: {}".format(result))
         if result is None or len(result) != 1 or result[0][0] > 1:
             raise DataStoreException("Delete query affected {} rows, excepted 1".format(result[0][0] if result else 0))
-        self.connection.commit()
+        self._commit()
+        self.profile_cache.invalidate()
         if result[0][0] == 1:
             self.logger.info("DataStore.delete_profile affected profile: {}".format(profile_name))
             return profile_name
@@ -276,19 +597,54 @@ class PostgresStore(DataStore):
         No logging should happen inside this function... or it would be a recersive loop.
         """
         super(PostgresStore, self).add_log(level, msg, device_name, process)
-        self.cursor.callproc("public.add_log",
-                             [str(process), datetime.datetime.utcnow(), level, str(device_name), str(msg)])
+        self._callproc("public.add_log",
+                       [str(process), datetime.datetime.utcnow(), level, str(device_name), str(msg)])
         result = self.cursor.fetchall()
         if result is None or len(result) != 1 or result[0][0] != 1:
             raise DataStoreException("log add query affected {} rows, excepted 1".format(result[0][0] if result else 0))
+        self._commit()
+
+    def add_logs(self, log_entries):
+        """
+        Add many logs with one multi-row INSERT, used by PostgresLogHandler. No logging should happen inside this
+        function either.
+        :param log_entries: list of (process, timestamp, level, device_name, msg) tuples
+        :return:
+        """
+        if not log_entries:
+            return
+        args = list()
+        for process, timestamp, level, device_name, msg in log_entries:
+            args.extend([str(process), timestamp, level, str(device_name), str(msg)])
+        # The same columns add_log fills in, device_id is NULL when the device_name isn't a device.
+        values = ", ".join(["(%s, %s, %s, public.get_device_id(%s), %s)"] * len(log_entries))
+        try:
+            self.cursor.execute("INSERT INTO public.log (process, timestamp, level, device_id, message) VALUES {};"
+                                .format(values), args)
+            self.connection.commit()
+        except psycopg2.Error:
+            self.connection.rollback()
+            raise
+
+    def expire_logs(self, older_than, summarize=False):
+        """
+        Drop the monthly log partitions that end before older_than. Only whole months are dropped.
+        :param older_than: datetime, logs from months that end at or before it are removed.
+        :param summarize: Keep per day, device, process and level counts of the dropped logs in log_summary.
+        :return: The number of dropped partitions
+        """
+        self.cursor.callproc("public.expire_log_partitions", [older_than, summarize])
+        result = self.cursor.fetchall()
         self.connection.commit()
+        self.logger.info("DataStore.expire_logs: Dropped {} log partitions".format(result[0][0]))
+        return result[0][0]
 
     def get_configuration_value(self, key):
         """
         See @DataStore for function description. Only implementation details here.
         """
         super(PostgresStore, self).get_configuration_value(key)
-        self.cursor.callproc("public.get_configuration_value", [key])
+        self._callproc("public.get_configuration_value", [key])
         result = self.cursor.fetchall()
         self.logger.debug("DataStore.get_configuration_value database result: {}".format(result))
         if result is not None and len(result) > 0:
@@ -317,7 +673,7 @@ class PostgresStore(DataStore):
         self.logger.debug("DataStore.set_configuration database result: {}".format(result))
         if result is None or len(result) != 1 or result[0][0] > 1:
             raise DataStoreException("Upsert query affected {} rows, excepted 1".format(result[0][0] if result else 0))
-        self.connection.commit()
+        self._commit()
         if result[0][0] == 1:
             self.logger.info("DataStore.delete_configuration updated key {}".format(key))
             return key
@@ -335,7 +691,7 @@ class PostgresStore(DataStore):
         self.logger.debug("DataStore.delete_configuration database result: {}".format(result))
         if result is None or len(result) > 1 or result[0][0] > 1:
             raise DataStoreException("Delete query affected {} rows, excepted 1".format(result[0][0] if result else 0))
-        self.connection.commit()
+        self._commit()
         if result[0][0] == 1:
             self.logger.info("DataStore.delete_configuration deleted key {}".format(key))
             return key
@@ -376,7 +732,8 @@ class PostgresStore(DataStore):
 
         self.cursor.callproc("public.upsert_group", [group, str(updated_device_set)])
         result = self.cursor.fetchall()
-        self.connection.commit()
+        self._commit()
+        self.group_cache.invalidate()
         self.logger.debug("upsert_group result: {}".format(result))
         return updated_device_set
 
@@ -404,15 +761,30 @@ class PostgresStore(DataStore):
             result = self.cursor.fetchall()
             self.logger.debug("upsert_group result: {}".format(result))
 
-        self.connection.commit()
+        self._commit()
+        self.group_cache.invalidate()
         return updated_device_set
 
+    def _get_stored_profile_names(self, device_names):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        All devices are looked up with one query, by hostname.
+        """
+        device_names = [str(device_name) for device_name in device_names if device_name is not None]
+        if not device_names:
+            return dict()
+        self.cursor.execute("SELECT hostname, profile_name FROM public.device "
+                            "WHERE hostname = ANY(%s) AND profile_name IS NOT NULL;", [device_names])
+        return dict(self.cursor.fetchall())
+
     # CANNED QUERIES
     def get_devices_by_type(self, device_type, device_name=None):
         """
-                See @DataStore for function description. Only implementation details here.
-                """
-        # super(PostgresStore, self).get_pdu()
+        See @DataStore for function description. Only implementation details here.
+        """
+        if device_name is None:
+            return self.list_devices({"device_type": device_type})
         self.cursor.execute("SELECT * FROM public.get_device_details(%s) WHERE device_type = %s;",
                             [device_name, device_type])
         result = self.cursor.fetchall()
@@ -475,8 +847,7 @@ class PostgresStore(DataStore):
                 self.set_profile(profile)
 
             devices = fs.list_devices()
-            for device in devices:
-                self.set_device(device)
+            self.set_device(devices)
         except Exception as ex:
             # Rollback any changes by closing the cursor / connection
             self.connect()
@@ -493,20 +864,54 @@ class PostgresStore(DataStore):
                 self.set_profile(profile)
 
             self.logger.info("Importing from file: Reverting devices:")
-            for device in old_devices:
-                self.set_device(device)
+            self.set_device(old_devices)
 
             # raise the exception that happened earlier
             raise
 
+    def _iter_stored_devices(self, batch_size):
+        """
+        See @DataStore for function description. Only implementation details here.
+
+        A server side cursor fetches batch_size devices at a time.
+        """
+        cursor = self.connection.cursor(name="export_devices")
+        cursor.itersize = batch_size
+        try:
+            # No profile properties, devices are exported as they are stored.
+            cursor.execute("SELECT device_id, device_type, properties, hostname, ip_address, mac_address, profile_name,"
+                           " NULL FROM public.device ORDER BY device_id;")
+            for row in cursor:
+                yield SqlParser.get_device_from_results([row])[0]
+        finally:
+            cursor.close()
+            self.connection.rollback()
+
+    def _clear_for_import(self):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        self.cursor.execute("DELETE FROM public.device;")
+        self.cursor.execute("DELETE FROM public.profile;")
+        self.cursor.execute("DELETE FROM public.configuration;")
+        self.cursor.execute("DELETE FROM public.device_group;")
+        self._commit()
+
+    def _set_group(self, group, device_list):
+        """
+        See @DataStore for function description. Only implementation details here.
+        """
+        self.cursor.callproc("public.upsert_group", [group, device_list])
+        self.cursor.fetchall()
+        self._commit()
+
     def _delete_database(self):
         old_config = self.list_configuration()
         for config in old_config:
             self.delete_configuration(config["key"])
 
         old_devices = self.list_devices()
-        for device in old_devices:
-            self.delete_device(device["device_id"])
+        self.delete_device([device["device_id"] for device in old_devices])
 
         old_profiles = self.list_profiles()
         for profile in old_profiles:
@@ -519,6 +924,7 @@ class SqlParser(object):
     """
     Helper class for converting SQL results to objects and objects to SQL params.
     """
+    DEVICE_COLUMNS = ("device_id", "device_type", "hostname", "ip_address", "mac_address", "profile_name")
 
     @staticmethod
     def get_device_from_results(results):
@@ -627,6 +1033,79 @@ class SqlParser(object):
 
         return groups
 
+    @staticmethod
+    def prepare_device_list_query(filters=None, fields=None):
+        """
+        Builds the query for list_devices. The query returns the same columns as get_device_details, so the rows can be
+        parsed by get_device_from_results.
+
+        Filters on the device_id, device_type, hostname, ip_address, mac_address and profile_name columns compare the
+        column. Filters on any other key use JSONB containment on the device properties, or on the profile properties
+        when the device doesn't have that key itself. Only string and number values are compared in SQL, all other
+        filters (i.e. None, lists, dicts) have to be applied to the results.
+
+        With fields, only the requested columns and properties (and the ones needed for filtering) are returned, the
+        others are NULL.
+        :param filters: dict of key value pairs that a device must match.
+        :param fields: list of keys to return, or None to return everything.
+        :return: (query, args) for cursor.execute()
+        """
+        filters = filters or dict()
+        if fields is not None:
+            # The filters are applied again to the results, so the filtered keys are needed too.
+            fields = set(fields).union(filters.keys())
+
+        property_names = None
+        if fields is not None:
+            property_names = sorted(field for field in fields if field not in SqlParser.DEVICE_COLUMNS)
+        args = list()
+
+        def column(name):
+            """A device column, or NULL if it isn't needed"""
+            if fields is None or name in fields:
+                return "device.{}".format(name)
+            return "NULL"
+
+        def properties(table):
+            """The properties of the table, or only the needed ones"""
+            if property_names is None:
+                return "{}.properties".format(table)
+            if not property_names:
+                return "NULL"
+            args.append(property_names)
+            return "(SELECT jsonb_object_agg(key, value) FROM jsonb_each({}.properties) WHERE key = ANY(%s))"\
+                .format(table)
+
+        # In the order of type_device_details
+        select = [column("device_id"), column("device_type"), properties("device"), column("hostname"),
+                  column("ip_address"), column("mac_address"), column("profile_name"), properties("profile"),
+                  "device.sys_period" if fields is None or "sys_period" in fields else "NULL"]
+
+        conditions = list()
+        for key in sorted(filters):
+            value = filters[key]
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                continue
+            if key in SqlParser.DEVICE_COLUMNS:
+                if key == "device_id" and not isinstance(value, int):
+                    continue
+                if key != "device_id" and not isinstance(value, str):
+                    continue
+                conditions.append("device.{} = %s".format(key))
+                args.append(value)
+            else:
+                conditions.append("(device.properties @> %s::jsonb OR (profile.properties @> %s::jsonb AND "
+                                  "NOT COALESCE(device.properties ? %s, false)))")
+                document = json.dumps({key: value})
+                args.extend([document, document, key])
+
+        query = "SELECT {} FROM public.device LEFT JOIN public.profile ON device.profile_name = profile.profile_name"\
+            .format(", ".join(select))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY device.device_id;"
+        return query, args
+
     @staticmethod
     def prepare_profile_for_query(profile):
         """
@@ -655,6 +1134,31 @@ class SqlParser(object):
             object in the returned array.
         :return: [profile_name:string, properties:json_string]
         """
+        columns, properties = SqlParser._split_device(device)
+        return [columns["device_id"], columns["device_type"], columns["hostname"], columns["ip_address"],
+                columns["mac_address"], columns["hardware_type"], columns["profile_name"], json.dumps(properties)]
+
+    @staticmethod
+    def prepare_devices_for_query(devices):
+        """
+        Takes a list of dicts and creates the argument for the upsert_devices stored procedure.
+        :param devices: A list of dicts, each handled like the device in prepare_device_for_query.
+        :return: json_string of a list of objects with the device columns and a 'properties' object.
+        """
+        documents = list()
+        for device in devices:
+            columns, properties = SqlParser._split_device(device)
+            columns["properties"] = properties
+            documents.append(columns)
+        return json.dumps(documents)
+
+    @staticmethod
+    def _split_device(device):
+        """
+        Separates the values that have their own column in the device table from the other properties.
+        :param device: dict, left unchanged
+        :return: (dict of column values as string or None, dict of properties)
+        """
 
         def pop_to_string(dvc, param):
             """Converts whats given to a string or None"""
@@ -664,16 +1168,12 @@ class SqlParser(object):
             return temp
 
         # Handle a dict
-        device = copy.deepcopy(device)
         if not isinstance(device, dict):
             raise RuntimeError("Cannot prepare device of unknown type for query, please pass a dict.")
-        device_id = pop_to_string(device, 'device_id')
-        device_type = pop_to_string(device, "device_type")
-        hostname = pop_to_string(device, "hostname")
-        ip_address = pop_to_string(device, "ip_address")
-        mac_address = pop_to_string(device, "mac_address")
-        hardware_type = pop_to_string(device, "hardware_type")
-        profile_name = pop_to_string(device, "profile_name")
+        device = copy.deepcopy(device)
+        columns = dict()
+        for column in ["device_id", "device_type", "hostname", "ip_address", "mac_address", "hardware_type",
+                       "profile_name"]:
+            columns[column] = pop_to_string(device, column)
         device.pop("sys_period", None)
-        return [device_id, device_type, hostname, ip_address, mac_address, hardware_type, profile_name,
-                json.dumps(device)]
+        return columns, device
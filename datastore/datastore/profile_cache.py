@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Profiles by name, so adding or removing profile values for many devices looks every profile up once.
+"""
+import time
+import threading
+
+
+class ProfileCache(object):
+    """
+    Remembers get_profile() results (including profiles that don't exist) until the store changes a profile (see
+    invalidate()) or the store reports a different _get_cache_key(). Stores that can't tell when another process
+    changed a profile (the key is None) look profiles up again after MAX_AGE_SECONDS.
+    """
+    MAX_AGE_SECONDS = 10
+
+    def __init__(self, datastore):
+        self.datastore = datastore
+        self._lock = threading.RLock()
+        self._profiles = dict()
+        self._key = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        """
+        Forget all profiles.
+        :return:
+        """
+        with self._lock:
+            self._profiles = dict()
+
+    def get_profiles(self, profile_names):
+        """
+        :param profile_names: iterable of profile names, may repeat
+        :return: dict of profile name to profile, None for profiles that don't exist.
+        """
+        with self._lock:
+            self._refresh()
+            profiles = dict()
+            for profile_name in profile_names:
+                if profile_name in profiles:
+                    continue
+                if profile_name not in self._profiles:
+                    self._profiles[profile_name] = self.datastore.get_profile(profile_name)
+                profiles[profile_name] = self._profiles[profile_name]
+            return profiles
+
+    def _refresh(self):
+        key = self.datastore._get_cache_key()
+        if key != self._key or (key is None and time.time() - self._loaded_at >= self.MAX_AGE_SECONDS):
+            self._profiles = dict()
+            self._key = key
+            self._loaded_at = time.time()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+A line by line (NDJSON) export format, so exports and imports never hold a whole DataStore in memory.
+"""
+import json
+from .datastore import DataStoreException
+
+
+class RecordStream(object):
+    """
+    The first line is a header, every other line is one record:
+        {"format": "datastore-ndjson", "version": 1}
+        {"type": "configuration", "data": {"key": "log_file_path", "value": "/tmp/datastore.log"}}
+        {"type": "profile", "data": {"profile_name": "compute", ...}}
+        {"type": "group", "data": {"group": "compute", "device_list": "c[1-100]"}}
+        {"type": "device", "data": {"device_id": 1, "device_type": "node", ...}}
+    Records are written in that order, so profiles exist before the devices that use them are imported.
+    """
+    FORMAT = "datastore-ndjson"
+    VERSION = 1
+    CONFIGURATION = "configuration"
+    PROFILE = "profile"
+    GROUP = "group"
+    DEVICE = "device"
+    RECORD_TYPES = [CONFIGURATION, PROFILE, GROUP, DEVICE]
+
+    @staticmethod
+    def write(file_location, sections):
+        """
+        Write the records one by one.
+        :param file_location:
+        :param sections: list of (record type, iterable of record data), the iterables are consumed while writing.
+        :return: dict of record type to the number of records written
+        """
+        counts = dict((record_type, 0) for record_type in RecordStream.RECORD_TYPES)
+        with open(file_location, "w") as stream_file:
+            stream_file.write(json.dumps({"format": RecordStream.FORMAT, "version": RecordStream.VERSION}) + "\n")
+            for record_type, records in sections:
+                for data in records:
+                    stream_file.write(json.dumps({"type": record_type, "data": data}, sort_keys=True,
+                                                 default=str) + "\n")
+                    counts[record_type] += 1
+        return counts
+
+    @staticmethod
+    def read(file_location):
+        """
+        Read the records one by one.
+        :param file_location:
+        :return: generator of (record type, record data)
+        :raise DataStoreException: When the file is not in this format or has a line that can't be parsed.
+        """
+        with open(file_location) as stream_file:
+            if not RecordStream._is_header(stream_file.readline()):
+                raise DataStoreException("{} is not a {} version {} file".format(file_location, RecordStream.FORMAT,
+                                                                                RecordStream.VERSION))
+            for line_number, line in enumerate(stream_file, 2):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    record_type = record["type"]
+                    data = record["data"]
+                except (ValueError, KeyError, TypeError):
+                    raise DataStoreException("Could not parse line {} of {}".format(line_number, file_location))
+                if record_type not in RecordStream.RECORD_TYPES:
+                    raise DataStoreException("Unknown record type '{}' on line {} of {}".format(record_type, line_number,
+                                                                                               file_location))
+                yield record_type, data
+
+    @staticmethod
+    def is_stream(file_location):
+        """
+        :param file_location:
+        :return: True if the file starts with the header of this format.
+        """
+        with open(file_location) as stream_file:
+            return RecordStream._is_header(stream_file.readline())
+
+    @staticmethod
+    def _is_header(line):
+        try:
+            header = json.loads(line)
+        except ValueError:
+            return False
+        return isinstance(header, dict) and header.get("format") == RecordStream.FORMAT and \
+            header.get("version") == RecordStream.VERSION
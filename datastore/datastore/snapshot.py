@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+A compact binary copy of a FileStore's JSON file, for fast startup.
+"""
+import os
+import sys
+import mmap
+import struct
+import marshal
+
+
+class DeviceSnapshot(object):
+    """
+    <file>.snapshot holds the same data as the JSON file in a layout that can be mapped and read piecemeal:
+
+        magic | python major, minor | header length | header | device record | device record | ...
+
+    The header (marshal) has everything except the devices, the offset of every device record and lookup tables
+    from device_id, hostname and ip_address to a record. Each device record is marshaled on its own, so looking up
+    one device decodes one record. The snapshot remembers which JSON file it was made from (inode, size, mtime) and is
+    ignored once the JSON file changes. marshal's format depends on the python version, which is checked too.
+    """
+    SUFFIX = ".snapshot"
+    MAGIC = b"DSSNAP01"
+    PREFIX = struct.Struct("<8sBBQ")
+    LOOKUP_KEYS = ("device_id", "hostname", "ip_address")
+
+    def __init__(self, source_location):
+        self.source_location = source_location
+        self.location = source_location + self.SUFFIX
+        self.sections = None
+        self._file = None
+        self._map = None
+        self._header = None
+
+    def exists(self):
+        """
+        :return: True if there is a snapshot file on disk
+        """
+        return os.path.isfile(self.location)
+
+    def write(self, parsed_file, device_key):
+        """
+        Write a new snapshot of parsed_file, which must be the current contents of the JSON source file.
+        :param parsed_file: dict as read from the JSON file
+        :param device_key: The key of the device list in parsed_file
+        :return:
+        """
+        devices = parsed_file.get(device_key)
+        sections = dict((key, value) for key, value in parsed_file.items() if key != device_key)
+        records = [marshal.dumps(device) for device in devices or []]
+        lookups = dict((key, dict()) for key in self.LOOKUP_KEYS)
+        for position, device in enumerate(devices or []):
+            for key in self.LOOKUP_KEYS:
+                try:
+                    lookups[key].setdefault(device.get(key), position)
+                except TypeError:
+                    pass
+        for lookup in lookups.values():
+            lookup.pop(None, None)
+
+        record_lengths = [len(record) for record in records]
+        header = marshal.dumps({
+            "source": self._source_signature(),
+            "sections": sections,
+            "has_devices": devices is not None,
+            "record_lengths": record_lengths,
+            "lookups": lookups,
+        })
+        prefix = self.PREFIX.pack(self.MAGIC, sys.version_info[0], sys.version_info[1], len(header))
+
+        temp_location = "{}.tmp.{}".format(self.location, os.getpid())
+        with open(temp_location, "wb") as snapshot_file:
+            snapshot_file.write(prefix)
+            snapshot_file.write(header)
+            for record in records:
+                snapshot_file.write(record)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_location, self.location)
+
+    def open(self):
+        """
+        Map the snapshot and read its header.
+        :return: True when there is a snapshot made from the current JSON file, False otherwise.
+        """
+        self.close()
+        if not self.exists():
+            return False
+        try:
+            snapshot_file = open(self.location, "rb")
+        except IOError:
+            return False
+        try:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            snapshot_file.close()
+            return False
+
+        try:
+            magic, major, minor, header_length = self.PREFIX.unpack_from(snapshot_map, 0)
+            if magic != self.MAGIC or (major, minor) != tuple(sys.version_info[:2]):
+                raise ValueError("Snapshot from another format or python version")
+            header_end = self.PREFIX.size + header_length
+            header = marshal.loads(snapshot_map[self.PREFIX.size:header_end])
+            if header.get("source") != self._source_signature():
+                raise ValueError("Snapshot is older than its source")
+        except (struct.error, ValueError, EOFError, TypeError):
+            snapshot_map.close()
+            snapshot_file.close()
+            return False
+
+        offsets = list()
+        offset = header_end
+        for length in header["record_lengths"]:
+            offsets.append(offset)
+            offset += length
+        header["offsets"] = offsets
+
+        self._file = snapshot_file
+        self._map = snapshot_map
+        self._header = header
+        self.sections = header["sections"]
+        return True
+
+    def is_open(self):
+        """
+        :return: True while a snapshot is mapped
+        """
+        return self._map is not None
+
+    def has_devices(self):
+        """
+        :return: True if the source file had a device list (even an empty one)
+        """
+        return self._header["has_devices"]
+
+    def find(self, device_name):
+        """
+        Decode one device, found by device_id, hostname or ip_address (In that priority order).
+        :param device_name:
+        :return: A new device dict or None
+        """
+        for key in self.LOOKUP_KEYS:
+            try:
+                position = self._header["lookups"][key].get(device_name)
+            except TypeError:
+                return None
+            if position is not None:
+                return self._read_record(position)
+        return None
+
+    def devices(self):
+        """
+        Decode every device.
+        :return: A new list of device dicts, in file order
+        """
+        return [self._read_record(position) for position in range(len(self._header["offsets"]))]
+
+    def close(self):
+        """
+        Unmap the snapshot.
+        :return:
+        """
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._file = None
+        self._map = None
+        self._header = None
+        self.sections = None
+
+    def remove(self):
+        """
+        Delete the snapshot file, if there is one.
+        :return:
+        """
+        self.close()
+        if self.exists():
+            os.remove(self.location)
+
+    def _read_record(self, position):
+        offset = self._header["offsets"][position]
+        length = self._header["record_lengths"][position]
+        return marshal.loads(self._map[offset:offset + length])
+
+    def _source_signature(self):
+        try:
+            stat = os.stat(self.source_location)
+        except OSError:
+            return None
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
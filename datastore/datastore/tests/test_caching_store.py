@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the CachingDataStore class
+"""
+
+import unittest
+from mock import MagicMock
+from ..datastore import DataStore
+from ..caching_store import CachingDataStore
+
+
+class TestCachingDataStore(unittest.TestCase):
+
+    DEVICES = [
+        {"device_id": 1, "device_type": "node", "hostname": "c1", "ip_address": "10.0.0.1", "profile_name": "compute"},
+        {"device_id": 2, "device_type": "node", "hostname": "c2", "ip_address": "10.0.0.2", "bmc": "b2"},
+        {"device_id": 3, "device_type": "bmc", "hostname": "b2", "ip_address": "10.0.1.2"},
+    ]
+
+    def setUp(self):
+        self.store = MagicMock(spec=DataStore)
+        self.store._get_cache_key.return_value = None
+        self.store.get_device.side_effect = self.get_device
+        self.store.list_devices.side_effect = lambda filters=None, fields=None: [dict(d) for d in self.DEVICES]
+        self.store.get_devices.side_effect = self.get_devices
+        self.store.get_profile.return_value = {"profile_name": "compute", "port": 22}
+        self.store.get_profile_names.return_value = ["compute"]
+        self.store.get_configuration_value.return_value = "value"
+        self.store.list_groups.return_value = {"compute": "c[1-2]"}
+        self.store.get_group_devices.return_value = "c[1-2]"
+        self.cache = CachingDataStore(self.store)
+
+    def get_device(self, device_name):
+        for device in self.DEVICES:
+            if str(device_name) in (str(device["device_id"]), device["hostname"], device["ip_address"]):
+                return dict(device)
+        return None
+
+    def get_devices(self, device_list, include_related=()):
+        devices = dict((name, self.get_device(name)) for name in device_list)
+        for name in DataStore._related_device_names(list(devices.values()), include_related):
+            devices.setdefault(name, self.get_device(name))
+        return devices
+
+    def test_names_keep_their_type(self):
+        numbered = {"device_id": 4, "device_type": "node", "hostname": "1", "ip_address": "10.0.0.4"}
+        self.DEVICES = self.DEVICES + [numbered]
+        self.store.get_device.side_effect = lambda name: next(
+            (dict(d) for d in self.DEVICES if name in (d["device_id"], d["hostname"], d["ip_address"])), None)
+        self.cache.list_devices()
+        self.assertEqual("c1", self.cache.get_device(1)["hostname"])
+        self.assertEqual(4, self.cache.get_device("1")["device_id"])
+        self.assertEqual(0, self.store.get_device.call_count)
+
+    def test_get_device(self):
+        device = self.cache.get_device("c1")
+        device["hostname"] = "changed"
+        self.assertEqual("c1", self.cache.get_device("c1")["hostname"])
+        # The same device, by its other names.
+        self.assertEqual("c1", self.cache.get_device(1)["hostname"])
+        self.assertEqual("c1", self.cache.get_device("10.0.0.1")["hostname"])
+        self.assertIsNone(self.cache.get_device("unknown"))
+        self.assertIsNone(self.cache.get_device("unknown"))
+        self.assertEqual(2, self.store.get_device.call_count)
+        self.assertEqual({"hits": 4, "misses": 2, "entries": 4}, self.cache.get_cache_stats()["device"])
+
+        self.cache.set_device({"device_id": 1, "device_type": "node", "hostname": "c1"})
+        self.store.set_device.assert_called_once()
+        self.cache.get_device("c1")
+        self.assertEqual(3, self.store.get_device.call_count)
+
+        self.cache.delete_device("c1")
+        self.cache.get_device("c1")
+        self.assertEqual(4, self.store.get_device.call_count)
+
+    def test_prefetch_devices(self):
+        self.cache.prefetch_devices("c[1-3]")
+        self.assertEqual("c2", self.cache.get_device("c2")["hostname"])
+        self.assertEqual("c1", self.cache.get_device("c1")["hostname"])
+        self.assertIsNone(self.cache.get_device("c3"))
+        self.store.get_device.assert_not_called()
+        self.assertEqual(1, self.store.get_devices.call_count)
+        # Everything is cached already.
+        self.cache.prefetch_devices("c[1-2]")
+        self.assertEqual(1, self.store.get_devices.call_count)
+        # Only the related device of a cached device is read.
+        self.cache.prefetch_devices(["c2"], include_related=("bmc",))
+        self.store.get_devices.assert_called_with(["b2"])
+
+    def test_get_devices(self):
+        self.cache.get_device("c1")
+        devices = self.cache.get_devices("c[1-3]", include_related=("bmc",))
+        self.assertEqual(["c1", "c2", "c3", "b2"], list(devices.keys()))
+        self.assertEqual(3, devices["b2"]["device_id"])
+        self.assertIsNone(devices["c3"])
+        self.store.get_devices.assert_called_once_with(["c2", "c3"], ("bmc",))
+        self.assertEqual(1, self.store.get_device.call_count)
+
+    def test_profiles(self):
+        self.cache.get_device("c1")
+        self.cache.get_profile("compute")
+        self.cache.get_profile("compute")
+        self.assertEqual(1, self.store.get_profile.call_count)
+
+        self.cache.set_profile({"profile_name": "compute", "port": 23})
+        self.cache.get_profile("compute")
+        self.cache.get_device("c1")
+        self.assertEqual(2, self.store.get_profile.call_count)
+        self.assertEqual(2, self.store.get_device.call_count)
+
+    def test_configuration(self):
+        self.assertEqual("value", self.cache.get_configuration_value("key"))
+        self.cache.get_configuration_value("key")
+        self.cache.get_configuration_value("other")
+        self.assertEqual(2, self.store.get_configuration_value.call_count)
+
+        self.cache.set_configuration("key", "new")
+        self.cache.get_configuration_value("key")
+        self.cache.get_configuration_value("other")
+        self.assertEqual(3, self.store.get_configuration_value.call_count)
+
+    def test_groups(self):
+        self.assertEqual(["c1", "c2"], self.cache.expand_device_list("@compute"))
+        self.cache.list_groups()
+        self.cache.get_group_devices("compute")
+        self.cache.get_group_devices("compute")
+        self.assertEqual(1, self.store.list_groups.call_count)
+        self.assertEqual(1, self.store.get_group_devices.call_count)
+
+        self.cache.add_to_group("c3", "compute")
+        self.store.list_groups.return_value = {"compute": "c[1-3]"}
+        self.assertEqual(["c1", "c2", "c3"], self.cache.expand_device_list("@compute"))
+        self.cache.get_group_devices("compute")
+        self.assertEqual(2, self.store.get_group_devices.call_count)
+
+    def test_ttl_and_size(self):
+        cache = CachingDataStore(self.store, ttl_seconds=0)
+        cache.get_configuration_value("key")
+        cache.get_configuration_value("key")
+        self.assertEqual(2, self.store.get_configuration_value.call_count)
+
+        cache = CachingDataStore(self.store, max_entries=2)
+        for key in ["a", "b", "c", "a"]:
+            cache.get_configuration_value(key)
+        self.assertEqual(6, self.store.get_configuration_value.call_count)
+        self.assertEqual(2, cache.get_cache_stats()["configuration"]["entries"])
+
+    def test_store_changed(self):
+        self.store._get_cache_key.return_value = 1
+        self.cache.get_device("c1")
+        self.cache.get_device("c1")
+        self.store._get_cache_key.return_value = 2
+        self.cache.get_device("c1")
+        self.assertEqual(2, self.store.get_device.call_count)
+
+    def test_write_during_read(self):
+        def get_device(device_name):
+            # Another thread writes while the store is being read.
+            self.cache.clear_cache([CachingDataStore.DEVICE])
+            return self.get_device(device_name)
+        self.store.get_device.side_effect = get_device
+        self.cache.get_device("c1")
+        self.cache.get_device("c1")
+        self.assertEqual(2, self.store.get_device.call_count)
+
+    def test_follow_changes(self):
+        self.store.subscribe.return_value = "feed"
+        self.assertEqual("feed", self.cache.follow_changes())
+        apply_change = self.store.subscribe.call_args[0][0]
+        self.cache.get_device("c1")
+        self.cache.get_configuration_value("key")
+        self.cache.get_configuration_value("other")
+        apply_change({"entity": "configuration", "operation": "update", "key": "key"})
+        self.assertEqual(1, self.cache.get_cache_stats()["configuration"]["entries"])
+        self.assertEqual(3, self.cache.get_cache_stats()["device"]["entries"])
+        apply_change({"entity": "device", "operation": "delete", "key": "1"})
+        self.assertEqual(0, self.cache.get_cache_stats()["device"]["entries"])
+        apply_change({"entity": None, "operation": "reset", "key": None})
+        self.assertEqual(0, self.cache.get_cache_stats()["configuration"]["entries"])
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the ChangeFeed class
+"""
+
+import unittest
+import threading
+import psycopg2
+from mock import patch, MagicMock
+from ..change_feed import ChangeFeed
+from ..datastore import DataStoreException
+
+
+class Notify(object):
+    def __init__(self, payload):
+        self.payload = payload
+
+
+@patch("select.select")
+@patch("psycopg2.connect")
+class TestChangeFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.logger = MagicMock()
+
+    def queue(self, mock_connect, *payloads):
+        mock_connect.return_value.notifies = [Notify(payload) for payload in payloads]
+
+    def test_poll(self, mock_connect, mock_select):
+        feed = ChangeFeed("uri", logger=self.logger)
+        feed.listen()
+        mock_connect.return_value.cursor.return_value.execute.assert_called_once_with("LISTEN datastore_changes;")
+        self.queue(mock_connect, '{"entity": "device", "operation": "update", "key": "1"}', 'not json',
+                   '{"entity": "group", "operation": "delete", "key": "compute"}')
+        self.assertEqual([{"entity": "device", "operation": "update", "key": "1"},
+                          {"entity": "group", "operation": "delete", "key": "compute"}], feed.poll(0))
+        mock_select.assert_not_called()
+        self.logger.warning.assert_called_once()
+
+        self.assertEqual([], feed.poll(0.5))
+        mock_select.assert_called_once_with([mock_connect.return_value], [], [], 0.5)
+
+    def test_entities(self, mock_connect, mock_select):
+        with self.assertRaises(DataStoreException):
+            ChangeFeed("uri", entities=["log"])
+        feed = ChangeFeed("uri", entities=["profile"])
+        feed.listen()
+        self.queue(mock_connect, '{"entity": "device", "operation": "insert", "key": "1"}',
+                   '{"entity": "profile", "operation": "insert", "key": "compute"}')
+        self.assertEqual(["profile"], [change["entity"] for change in feed.poll(0)])
+
+    def test_reconnect(self, mock_connect, mock_select):
+        feed = ChangeFeed("uri", logger=self.logger)
+        feed.listen()
+        mock_connect.return_value.poll.side_effect = psycopg2.OperationalError("gone")
+        self.queue(mock_connect)
+        self.assertEqual([], feed.poll(0))
+        mock_connect.return_value.close.assert_called_once()
+
+        mock_connect.side_effect = psycopg2.OperationalError("still gone")
+        self.assertEqual([], feed.poll(0))
+        mock_connect.side_effect = None
+        mock_connect.return_value.poll.side_effect = None
+        self.assertEqual([{"entity": None, "operation": ChangeFeed.RESET, "key": None}], feed.poll(0))
+        self.assertEqual([], feed.poll(0))
+
+        with self.assertRaises(DataStoreException):
+            mock_connect.side_effect = psycopg2.OperationalError("no database")
+            ChangeFeed("uri").listen()
+
+    def test_start(self, mock_connect, mock_select):
+        called = threading.Event()
+        changes = list()
+
+        def callback(change):
+            changes.append(change)
+            called.set()
+            raise RuntimeError("callbacks errors are logged")
+
+        feed = ChangeFeed("uri", logger=self.logger)
+        feed.listen()
+        self.queue(mock_connect, '{"entity": "configuration", "operation": "update", "key": "key"}')
+        with feed.start(callback):
+            self.assertTrue(called.wait(5))
+            with self.assertRaises(DataStoreException):
+                feed.start(callback)
+        self.assertEqual([{"entity": "configuration", "operation": "update", "key": "key"}], changes)
+        self.logger.error.assert_called_once()
+        self.assertEqual([], list(feed))
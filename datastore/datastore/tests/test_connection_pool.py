@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the ConnectionPool class
+"""
+
+import unittest
+import threading
+import psycopg2
+from mock import patch, MagicMock
+from ..connection_pool import ConnectionPool
+from ..datastore import DataStoreException
+from ..postgresstore import PostgresStore
+
+
+@patch("psycopg2.connect")
+class TestConnectionPool(unittest.TestCase):
+
+    CONNECTION_STRING = "host=abc port=1234 dbname=foo user=foo password=foo"
+
+    @staticmethod
+    def new_connection(*args):
+        return MagicMock()
+
+    def run_in_thread(self, function):
+        result = dict()
+
+        def target():
+            try:
+                result["value"] = function()
+            except DataStoreException as ex:
+                result["error"] = ex
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+        return result
+
+    def test_bounded(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        pool = ConnectionPool(self.CONNECTION_STRING, 1, timeout=0.05)
+        pooled = pool.acquire()
+
+        result = self.run_in_thread(pool.acquire)
+        self.assertIsInstance(result.get("error"), DataStoreException)
+        self.assertEqual(1, mock_connect.call_count)
+
+        pool.release(pooled)
+        pooled.connection.rollback.assert_called_once()
+        result = self.run_in_thread(pool.acquire)
+        self.assertIs(result.get("value"), pooled)
+
+        stats = pool.stats()
+        self.assertEqual(1, stats["timed_out"])
+        self.assertEqual(2, stats["acquired"])
+        self.assertEqual(1, stats["max_size"])
+        self.assertGreater(stats["max_wait_seconds"], 0.04)
+
+    def test_wait_for_release(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        pool = ConnectionPool(self.CONNECTION_STRING, 1, timeout=5)
+        pooled = pool.acquire()
+        timer = threading.Timer(0.05, pool.release, [pooled])
+        timer.start()
+
+        result = self.run_in_thread(pool.acquire)
+        self.assertIs(result.get("value"), pooled)
+        self.assertEqual(1, pool.stats()["waited"])
+
+    def test_reclaim_from_ended_thread(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        pool = ConnectionPool(self.CONNECTION_STRING, 1, timeout=0.05)
+        result = self.run_in_thread(pool.acquire)
+
+        # The thread ended without releasing its connection.
+        self.assertIs(pool.acquire(), result["value"])
+        self.assertEqual(1, mock_connect.call_count)
+
+    def test_health_check(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        pool = ConnectionPool(self.CONNECTION_STRING, 2, health_check_seconds=0)
+        pooled = pool.acquire()
+        pool.release(pooled)
+        pooled.cursor.execute.side_effect = psycopg2.OperationalError("server closed the connection")
+
+        new_pooled = pool.acquire()
+        self.assertIsNot(new_pooled, pooled)
+        pooled.connection.close.assert_called_once()
+        self.assertEqual(1, pool.stats()["replaced"])
+        self.assertEqual(1, pool.stats()["in_use"])
+
+    def test_closed(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        pool = ConnectionPool(self.CONNECTION_STRING, 2)
+        pooled = pool.acquire()
+        pool.close()
+        pooled.connection.close.assert_called_once()
+        with self.assertRaises(DataStoreException):
+            pool.acquire()
+
+    def test_postgres_store_threads(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        postgres = PostgresStore(self.CONNECTION_STRING, None)
+        main_cursor = postgres.cursor
+
+        result = self.run_in_thread(lambda: postgres.cursor)
+        self.assertIsNot(result["value"], main_cursor)
+        self.assertIs(postgres.cursor, main_cursor)
+
+        # The connection of the ended thread is only taken back when the pool runs out.
+        self.assertEqual(2, postgres.get_pool_stats()["in_use"])
+        postgres.release_connection()
+        self.assertEqual(1, postgres.get_pool_stats()["in_use"])
+
+    def test_postgres_store_prepared(self, mock_connect):
+        mock_connect.side_effect = self.new_connection
+        postgres = PostgresStore(self.CONNECTION_STRING, None)
+        postgres.add_log = self.new_connection
+        postgres.cursor.fetchall.return_value = []
+
+        postgres.get_device("node1")
+        postgres.get_device("node2")
+        statements = [call[0][0] for call in postgres.cursor.execute.call_args_list]
+        self.assertEqual(statements, ["PREPARE public_get_device_details AS SELECT * FROM "
+                                      "public.get_device_details($1);",
+                                      "EXECUTE public_get_device_details(%s);",
+                                      "EXECUTE public_get_device_details(%s);"])
+
+        old_cursor = postgres.cursor
+        postgres.reset_connection()
+        self.assertIsNot(postgres.cursor, old_cursor)
+        postgres.get_device("node1")
+        self.assertEqual(2, postgres.cursor.execute.call_count)
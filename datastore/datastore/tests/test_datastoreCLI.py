@@ -541,6 +541,19 @@ class TestFunctionalReturnCodes(unittest.TestCase):
             self.assertEqual(result, command["out"], "Failed to execute command '{}'. Actual: {} Expected: {}"
                              .format(command["cmd"], result, command["out"]))
 
+    def test_export_import_ndjson(self):
+        export_file = tempfile.NamedTemporaryFile("w", delete=False)
+        export_file.close()
+        devices = self.fs.list_devices()
+        self.assertEqual(0, self.dscli.parse_and_run(['export', export_file.name, '--format', 'ndjson']))
+        self.fs.delete_device("test_hostname")
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            result = self.dscli.parse_and_run(['import', export_file.name, '--batch-size', '1', '--progress'])
+        self.assertEqual(0, result)
+        self.assertIn("Imported 2 devices", output.getvalue())
+        self.assertEqual(devices, self.fs.list_devices())
+        os.remove(export_file.name)
+
 
 if __name__ == '__main__':
     unittest.main()
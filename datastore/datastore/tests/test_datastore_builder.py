@@ -14,6 +14,7 @@ from .. import DataStoreBuilder, DataStoreException, DataStore
 from ..filestore import FileStore
 from ..postgresstore import PostgresStore
 from .. multistore import MultiStore
+from ..caching_store import CachingDataStore
 
 
 class TestDataStoreBuilder(unittest.TestCase):
@@ -101,6 +102,15 @@ class TestDataStoreBuilder(unittest.TestCase):
         self.dsb.add_postgres_db("")
         multistore = self.dsb.build()
         self.assertTrue(isinstance(multistore, MultiStore))
+        self.assertEqual(MultiStore.READ_VERIFY, multistore.read_policy)
+
+        multistore = self.dsb.set_read_policy(MultiStore.READ_FIRST_RESPONSE).build()
+        self.assertEqual(MultiStore.READ_FIRST_RESPONSE, multistore.read_policy)
+
+        cached = self.dsb.set_cache(ttl_seconds=5, max_entries=10).build()
+        self.assertTrue(isinstance(cached, CachingDataStore))
+        self.assertTrue(isinstance(cached.datastore, MultiStore))
+        self.assertEqual({"hits": 0, "misses": 0, "entries": 0}, cached.get_cache_stats()["device"])
 
     def test_build_no_options(self):
         with self.assertRaises(DataStoreException):
@@ -127,6 +137,10 @@ class TestDataStoreBuilder(unittest.TestCase):
         result = DataStoreBuilder.get_datastore_from_string("garbage")
         self.assertEqual(type(result), PostgresStore)
 
+        result = DataStoreBuilder.get_datastore_from_string("postgres://foo:bar", cache=True)
+        self.assertEqual(type(result), CachingDataStore)
+        self.assertEqual(type(result.datastore), PostgresStore)
+
         mock_ps.side_effect = Exception("Mocked exception")
 
         result = DataStoreBuilder.get_datastore_from_string(temp_file.name)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the DeviceHistoryLog class
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from ..datastore import DataStore, DataStoreException
+from ..device_history import DeviceHistoryLog
+
+
+class TestDeviceHistoryLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.history = DeviceHistoryLog(os.path.join(self.directory, "datastore"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_as_of(self):
+        self.assertFalse(self.history.exists())
+        self.assertEqual({}, self.history.as_of(100))
+        self.history.append([(1, {"device_id": 1, "hostname": "c1"}), (2, {"device_id": 2, "hostname": "c2"})], 100)
+        self.history.append([(1, {"device_id": 1, "hostname": "n1"})], 200)
+        self.history.append([(2, None)], 300)
+        with open(self.history.location, "a") as history_file:
+            history_file.write("{\"ts\": 400, \"device_id\": 1, \"dev")
+
+        self.assertEqual({}, self.history.as_of(99))
+        self.assertEqual(["c1", "c2"], [device["hostname"] for device in self.history.as_of(100).values()])
+        self.assertEqual(["n1", "c2"], [device["hostname"] for device in self.history.as_of(299.5).values()])
+        self.assertEqual({1: {"device_id": 1, "hostname": "n1"}}, self.history.as_of(1000))
+
+    def test_versions(self):
+        self.history.append([(1, {"device_id": 1, "hostname": "c1"})], 100)
+        self.history.append([(1, {"device_id": 1, "hostname": "n1"})], 200)
+        self.history.append([(1, None)], 300)
+        self.history.append([(1, {"device_id": 1, "hostname": "x1"})], 400)
+        versions = self.history.versions()
+        self.assertEqual(["c1", "n1", "x1"], [device["hostname"] for device in versions])
+        self.assertEqual((DeviceHistoryLog.to_datetime(100), DeviceHistoryLog.to_datetime(200)),
+                         versions[0]["sys_period"])
+        self.assertEqual(DeviceHistoryLog.to_datetime(300), versions[1]["sys_period"][1])
+        self.assertIsNone(versions[2]["sys_period"][1])
+
+    def test_timestamps(self):
+        self.assertEqual(1506588077.5, DeviceHistoryLog.to_timestamp(datetime(2017, 9, 28, 8, 41, 17, 500000)))
+        date = DeviceHistoryLog.to_datetime(1506588077.5)
+        self.assertEqual(1506588077.5, DeviceHistoryLog.to_timestamp(date))
+        self.assertEqual(8, date.hour)
+
+    def test_stores_without_history(self):
+        self.assertNotIn("list_devices_as_of", DataStore.__abstractmethods__)
+        store_class = type("StoreWithoutHistory", (DataStore,), {})
+        store_class.__abstractmethods__ = frozenset()
+        store = store_class()
+        with self.assertRaises(DataStoreException):
+            store.list_devices_as_of(datetime(2017, 9, 1))
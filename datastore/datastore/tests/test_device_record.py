@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the DeviceRecord class
+"""
+
+import json
+import copy
+import pickle
+import unittest
+from datetime import datetime
+from mock import patch
+from .. import device_record
+from ..device_record import DeviceRecord
+
+
+class TestDeviceRecord(unittest.TestCase):
+
+    DEVICE = {"device_id": 1, "device_type": "node", "hostname": "c1", "profile_name": "compute_node",
+              "bmc": "bmc1", "pdu_list": ["pdu1"], "port": 22}
+
+    def test_read_like_a_dict(self):
+        record = DeviceRecord(self.DEVICE)
+        self.assertEqual(self.DEVICE, record)
+        self.assertEqual(self.DEVICE, dict(record))
+        self.assertEqual(len(self.DEVICE), len(record))
+        self.assertEqual("c1", record["hostname"])
+        self.assertEqual(["pdu1"], record["pdu_list"])
+        self.assertEqual("bmc1", record.get("bmc"))
+        self.assertIsNone(record.get("ip_address"))
+        self.assertEqual("default", record.get("missing", "default"))
+        self.assertIn("port", record)
+        self.assertNotIn("ip_address", record)
+        with self.assertRaises(KeyError):
+            record["ip_address"]
+        with self.assertRaises(KeyError):
+            record["missing"]
+        self.assertEqual(set(self.DEVICE.keys()), set(record.keys()))
+        self.assertEqual(self.DEVICE, json.loads(json.dumps(record.to_dict())))
+
+    def test_read_only(self):
+        record = DeviceRecord(self.DEVICE)
+        with self.assertRaises(AttributeError):
+            record.hostname = "c2"
+        with self.assertRaises(TypeError):
+            record["hostname"] = "c2"
+        device = record.to_dict()
+        device["pdu_list"].append("pdu2")
+        record["pdu_list"].append("pdu2")
+        self.assertEqual(["pdu1"], record["pdu_list"])
+        self.assertEqual(self.DEVICE, record.copy())
+
+    def test_copies(self):
+        record = DeviceRecord(self.DEVICE)
+        self.assertEqual(record, DeviceRecord(record))
+        self.assertEqual(record, copy.deepcopy(record))
+        self.assertEqual(record, pickle.loads(pickle.dumps(record)))
+        self.assertEqual({}, DeviceRecord({}).to_dict())
+        self.assertIn("DeviceRecord(", repr(record))
+
+    def test_not_json_properties(self):
+        device = dict(self.DEVICE, sys_period=datetime(2017, 9, 1))
+        record = DeviceRecord(device)
+        self.assertEqual(device, record)
+        record["pdu_list"].append("pdu2")
+        self.assertEqual(["pdu1"], record["pdu_list"])
+
+    def test_interned(self):
+        first = DeviceRecord(json.loads(json.dumps(self.DEVICE)))
+        second = DeviceRecord(json.loads(json.dumps(self.DEVICE)))
+        self.assertIs(first.profile_name, second.profile_name)
+        self.assertIs(list(first.properties().keys())[0], list(second.properties().keys())[0])
+
+    def test_decoded_once(self):
+        device_record._decode.cache_clear()
+        record = DeviceRecord(self.DEVICE)
+        with patch.object(device_record.json, "loads", wraps=json.loads) as loads:
+            self.assertEqual(["pdu1"], record["pdu_list"])
+            self.assertIn("port", record)
+            self.assertEqual(len(self.DEVICE), len(record))
+            self.assertEqual(self.DEVICE, record.to_dict())
+        self.assertEqual(1, loads.call_count)
+        record["pdu_list"].append("pdu2")
+        self.assertEqual(["pdu1"], record["pdu_list"])
+
+    def test_stays_compact(self):
+        record = DeviceRecord(self.DEVICE)
+        self.assertEqual(self.DEVICE, record.to_dict())
+        self.assertIsInstance(record._properties, str)
@@ -11,10 +11,17 @@ import json
 import tempfile
 import os
 import logging
+from mock import patch
 from ..filestore import FileStore
+from ..utilities import JsonParser
+from ..write_ahead_log import WriteAheadLog
+from ..snapshot import DeviceSnapshot
+from .. import device_history
+from ..device_history import DeviceHistoryLog
 from random import randint
 from .. import DataStoreException
 from dateutil import parser as date_parse
+from datetime import datetime
 from datastore import get_logger, DataStore
 
 
@@ -207,6 +214,21 @@ class TestFileStore(unittest.TestCase):
 
     def tearDown(self):
         os.remove(self.FILE_STRING)
+        os.remove(self.FILE_STRING + ".lock")
+
+    def test_lock_location(self):
+        self.assertEqual(self.FILE_STRING + ".lock", self.fs.file_lock.location)
+        lock_location = self.FILE_STRING + ".other.lock"
+        store = FileStore(self.FILE_STRING, None, lock_location)
+        self.assertEqual(lock_location, store.file_lock.location)
+        self.assertTrue(os.path.isfile(lock_location))
+        os.remove(lock_location)
+        read_only = os.path.join(tempfile.gettempdir(), "read_only_dir", "config.json")
+        with patch("os.access", return_value=False):
+            fallback = FileStore.default_lock_location(read_only)
+        self.assertEqual(tempfile.gettempdir(), os.path.dirname(fallback))
+        self.assertNotEqual(fallback, FileStore.default_lock_location(read_only + "2"))
+        self.assertEqual(self.FILE_STRING + ".lock", FileStore.default_lock_location(self.FILE_STRING))
 
     def test_file_init(self):
         FileStore(self.FILE_STRING, None)
@@ -245,6 +267,17 @@ class TestFileStore(unittest.TestCase):
         devices = self.fs.list_devices({"foo": "not_found_filter"})
         self.assertEqual(0, len(devices))
 
+    def test_device_list_filters_and_fields(self):
+        devices = self.fs.list_devices({"device_type": "test_dev_type_test", "tests": "are_awesome"})
+        self.assertEqual([2], [device.get("device_id") for device in devices])
+
+        devices = self.fs.list_devices({"profile_name": "compute_node"}, ["hostname", "port", "not_a_key"])
+        self.assertEqual(devices, [{"hostname": "test_hostname", "port": 22},
+                                   {"hostname": "test_hostname2", "port": 22}])
+
+        devices = self.fs.list_devices({"device_type": "Invalid type"})
+        self.assertEqual(0, len(devices))
+
     def test_device_upsert(self):
         num = randint(0, 4500000)
         num1 = randint(0, 4500000)
@@ -374,6 +407,19 @@ class TestFileStore(unittest.TestCase):
     def test_remove_profile_from_device(self):
         self.assertIsNone(self.fs._remove_profile_from_device(None))
 
+    def test_profile_cache(self):
+        with patch.object(self.fs, "get_profile", wraps=self.fs.get_profile) as get_profile:
+            devices = self.fs.list_devices()
+            self.fs.list_devices()
+            self.assertEqual(1, get_profile.call_count)
+        self.assertEqual("test_pass", devices[0].get("password"))
+        # The stored devices don't get the profile values.
+        self.assertNotIn("password", self.fs.parsed_file[self.fs.DEVICE_KEY][0])
+
+        self.fs.set_profile({"profile_name": "compute_node", "password": "new_pass"})
+        self.assertEqual("new_pass", self.fs.get_device("test_hostname").get("password"))
+        self.assertIsNone(self.fs.get_device("test_hostname").get("port"))
+
     def test_get_logs(self):
         result = self.fs.list_logs()
         self.assertEqual(15, len(result))
@@ -392,6 +438,43 @@ class TestFileStore(unittest.TestCase):
         result = self.fs.get_device("127.0.0.2")
         self.assertEqual(result.get("device_id"), 2)
 
+    def test_device_catalog_after_update(self):
+        device = self.fs.get_device("test_hostname")
+        device["hostname"] = "renamed_hostname"
+        device["device_type"] = "other_type"
+        self.fs.set_device(device)
+
+        self.assertIsNone(self.fs.get_device("test_hostname"))
+        self.assertEqual(1, self.fs.get_device("renamed_hostname").get("device_id"))
+        self.assertEqual(1, self.fs.get_device("127.0.0.1").get("device_id"))
+        self.assertEqual(1, len(self.fs.get_devices_by_type("test_dev_type_test")))
+        self.assertEqual(1, len(self.fs.get_devices_by_type("other_type")))
+        self.assertEqual(2, len(self.fs.list_devices()))
+
+    def test_device_catalog_after_delete(self):
+        self.fs.delete_device(["test_hostname", 1])
+        self.assertIsNone(self.fs.get_device("test_hostname"))
+        self.assertEqual(2, self.fs.get_device("test_hostname2").get("device_id"))
+        self.assertEqual(1, len(self.fs.get_profile_devices("compute_node")))
+
+        device_id = self.fs.set_device({"device_type": "node", "hostname": "new_device"})[0]
+        self.assertEqual(3, device_id)
+        self.assertEqual(3, self.fs.get_device("new_device").get("device_id"))
+        self.assertEqual(1, len(self.fs.get_devices_by_type("node")))
+
+    def test_device_catalog_after_import(self):
+        import_file = tempfile.NamedTemporaryFile("w", delete=False)
+        import_file.write(self.FILE_CONFIG_MOCKED)
+        import_file.close()
+        self.fs.import_from_file(import_file.name)
+        os.remove(import_file.name)
+
+        self.assertIsNone(self.fs.get_device("test_hostname"))
+        self.assertEqual(3, self.fs.get_device("bmc1").get("device_id"))
+        self.assertEqual(2, len(self.fs.get_devices_by_type("bmc")))
+        self.assertEqual(2, len(self.fs.get_profile_devices("compute_node")))
+        self.assertEqual(6, self.fs.set_device({"device_type": "node", "hostname": "c3"})[0])
+
     def test_config(self):
         result = self.fs.get_configuration_value("invalid")
         self.assertIsNone(result)
@@ -431,6 +514,19 @@ class TestFileStore(unittest.TestCase):
         device = self.fs.get_device("not-here")
         self.assertIsNone(device)
 
+    def test_get_devices(self):
+        device = self.fs.get_device("test_hostname")
+        device["bmc"] = "test_hostname2"
+        device["pdu_list"] = [["127.0.0.2", 1], "not-here"]
+        self.fs.set_device(device)
+        devices = self.fs.get_devices(["test_hostname", "missing"], include_related=("bmc", "pdu_list"))
+        self.assertEqual(["test_hostname", "missing", "test_hostname2", "not-here"], list(devices.keys()))
+        self.assertEqual(1, devices["test_hostname"]["device_id"])
+        self.assertIsNone(devices["missing"])
+        self.assertEqual(2, devices["test_hostname2"]["device_id"])
+        self.assertIsNone(devices["not-here"])
+        self.assertEqual(["127.0.0.1"], list(self.fs.get_devices(["127.0.0.1"]).keys()))
+
     def test_invalid_log_level(self):
         with self.assertRaises(DataStoreException):
             self.fs.add_log(1, "not important msg")
@@ -486,11 +582,91 @@ class TestFileStore(unittest.TestCase):
         self.assertEqual(self.fs.get_configuration_value("config"), "is_mocked")
         os.remove(import_file.name)
 
+    def test_export_import_stream_base(self):
+        stored = self.fs._iter_stored_devices(100)
+        self.assertEqual(stored, list(DataStore._iter_stored_devices(self.fs, 100)))
+        stream_file = tempfile.NamedTemporaryFile("w", delete=False)
+        stream_file.close()
+        with patch.object(FileStore, "_iter_stored_devices", DataStore._iter_stored_devices):
+            self.fs.export_to_stream(stream_file.name)
+        self.fs.import_from_stream(stream_file.name)
+        self.assertEqual(stored, self.fs._iter_stored_devices(100))
+        self.assertNotIn("image", stored[0])
+        os.remove(stream_file.name)
+
+    def test_export_import_stream(self):
+        stream_file = tempfile.NamedTemporaryFile("w", delete=False)
+        stream_file.close()
+        devices = self.fs.list_devices()
+        profiles = self.fs.list_profiles()
+        groups = self.fs.list_groups()
+        counts = self.fs.export_to_stream(stream_file.name)
+        self.assertEqual(2, counts["device"])
+        self.assertEqual(3, counts["group"])
+
+        self.fs.set_device({"device_type": "node", "hostname": "c5"})
+        self.fs.set_profile({"profile_name": "other"})
+        self.fs.add_to_group("c5", "test4")
+        progress = list()
+        counts = self.fs.import_from_stream(stream_file.name, batch_size=1, progress=progress.append)
+        self.assertEqual([1, 2], [count["device"] for count in progress])
+        self.assertEqual(1, counts["profile"])
+        self.assertEqual(devices, self.fs.list_devices())
+        self.assertEqual(profiles, self.fs.list_profiles())
+        self.assertEqual(groups, self.fs.list_groups())
+        self.assertEqual(["c1", "c99", "n3"], self.fs.expand_device_list("@test"))
+
+        # A file in another format is refused before anything is deleted.
+        with self.assertRaises(DataStoreException):
+            self.fs.import_from_stream(self.FILE_STRING)
+        self.assertEqual(devices, self.fs.list_devices())
+        os.remove(stream_file.name)
 
     def test_device_history(self):
         with self.assertRaises(DataStoreException):
             self.fs.get_device_history("foo")
 
+    def test_device_history_as_of(self):
+        with self.assertRaises(DataStoreException):
+            self.fs.list_devices_as_of(datetime(2017, 9, 1))
+        with patch.object(device_history, "time") as mock_time:
+            mock_time.time.return_value = 100
+            self.fs.set_configuration(FileStore.HISTORY_KEY, True)
+            mock_time.time.return_value = 200
+            device = self.fs.get_device(1)
+            device["ip_address"] = "127.0.0.9"
+            self.fs.set_device(device)
+            mock_time.time.return_value = 300
+            with self.fs.batch():
+                self.fs.delete_device("test_hostname2")
+                self.fs.set_device({"device_id": 5, "device_type": "node", "hostname": "c5"})
+        self.addCleanup(os.remove, self.fs.history.location)
+
+        def at(timestamp):
+            return datetime.utcfromtimestamp(timestamp)
+
+        self.assertEqual([], self.fs.list_devices_as_of(at(99)))
+        devices = self.fs.list_devices_as_of(at(100))
+        self.assertEqual([1, 2], [device["device_id"] for device in devices])
+        self.assertNotIn("password", devices[0])
+        devices = self.fs.list_devices_as_of(at(250), "test_hostname,127.0.0.2")
+        self.assertEqual(["127.0.0.9", "127.0.0.2"], [device["ip_address"] for device in devices])
+        self.assertEqual([1, 5], [device["device_id"] for device in self.fs.list_devices_as_of(at(300))])
+
+        diffs = self.fs.diff_devices(at(150), at(300))
+        self.assertEqual([1, 2, 5], [diff["device_id"] for diff in diffs])
+        self.assertEqual({"ip_address": ["127.0.0.1", "127.0.0.9"]}, diffs[0]["changed"])
+        self.assertIsNone(diffs[1]["after"])
+        self.assertIsNone(diffs[2]["before"])
+        self.assertEqual("c5", diffs[2]["hostname"])
+        self.assertEqual([], self.fs.diff_devices(at(200), at(250)))
+
+        history = self.fs.get_device_history("test_hostname")
+        self.assertEqual(["127.0.0.1"], [device["ip_address"] for device in history])
+        self.assertEqual((DeviceHistoryLog.to_datetime(100), DeviceHistoryLog.to_datetime(200)),
+                         history[0]["sys_period"])
+        self.assertEqual(4, len(self.fs.get_device_history()))
+
     def test_add_log(self):
         self.fs.add_log(logging.WARNING, "This is a test")
         self.fs.add_log(logging.WARNING, "This is a test", "c1")
@@ -528,6 +704,16 @@ class TestFileStore(unittest.TestCase):
 
         self.assertEqual(len(list(self.fs.get_group_devices("test2"))), 0)
 
+    def test_group_expansion_follows_changes(self):
+        self.assertEqual(["c1", "c99", "n3"], self.fs.expand_device_list("@test"))
+        self.assertEqual(["test", "test2"], self.fs.get_device_groups("c1"))
+
+        self.fs.add_to_group("c98", "test1")
+        self.assertEqual(["c1", "c98", "c99", "n3"], self.fs.expand_device_list("@test"))
+        self.fs.remove_from_group("c1", "test")
+        self.assertEqual(["test2"], self.fs.get_device_groups("c1"))
+        self.assertEqual(["test", "test1"], self.fs.get_device_groups("c[98-99]"))
+
 
 class TestFileStoreEmptyFile(unittest.TestCase):
     FILE_STRING = "unknown, to be constructed in setUpClass(cls)"
@@ -711,6 +897,246 @@ class TestFileStoreInvalidLogs(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             result = self.fs.list_logs()
 
+class TestFileStoreJournal(unittest.TestCase):
+    FILE_CONFIG = """{
+  "configuration_variables": {
+    "file_store_journal_max_records": 5
+  },
+  "device": [
+    {
+      "device_id": 1,
+      "device_type": "node",
+      "hostname": "c1"
+    }
+  ]
+}"""
+
+    def setUp(self):
+        temp_file = tempfile.NamedTemporaryFile("w", delete=False)
+        temp_file.write(self.FILE_CONFIG)
+        temp_file.close()
+        self.FILE_STRING = temp_file.name
+        self.JOURNAL_STRING = self.FILE_STRING + WriteAheadLog.SUFFIX
+        self.fs = FileStore(self.FILE_STRING, None)
+
+    def tearDown(self):
+        for location in [self.FILE_STRING, self.JOURNAL_STRING, self.FILE_STRING + ".lock"]:
+            if os.path.isfile(location):
+                os.remove(location)
+
+    def read_file(self):
+        with open(self.FILE_STRING) as snapshot:
+            return json.load(snapshot)
+
+    def test_changes_are_journaled(self):
+        before = self.read_file()
+        self.fs.set_device({"device_type": "node", "hostname": "c2"})
+        self.fs.set_profile({"profile_name": "test", "port": 22})
+        self.fs.add_to_group("c[1-2]", "compute")
+
+        self.assertTrue(os.path.isfile(self.JOURNAL_STRING))
+        self.assertEqual(before.get("device"), self.read_file().get("device"))
+
+        reopened = FileStore(self.FILE_STRING, None)
+        self.assertEqual(2, reopened.get_device("c2").get("device_id"))
+        self.assertEqual(22, reopened.get_profile("test").get("port"))
+        self.assertEqual("c[1-2]", reopened.get_group_devices("compute"))
+
+    def test_deletes_are_journaled(self):
+        self.fs.set_configuration("foo", "bar")
+        self.fs.delete_configuration("foo")
+        self.fs.delete_device("c1")
+
+        reopened = FileStore(self.FILE_STRING, None)
+        self.assertIsNone(reopened.get_configuration_value("foo"))
+        self.assertIsNone(reopened.get_device("c1"))
+
+    def test_compaction(self):
+        for index in range(2, 8):
+            self.fs.set_device({"device_type": "node", "hostname": "c{}".format(index)})
+
+        self.assertGreater(len(self.read_file().get("device")), 1)
+        self.assertLess(self.fs.journal.record_count, 5)
+        self.assertEqual(7, len(FileStore(self.FILE_STRING, None).list_devices()))
+
+    def test_torn_journal_record(self):
+        self.fs.set_device({"device_type": "node", "hostname": "c2"})
+        with open(self.JOURNAL_STRING, "a") as journal_file:
+            journal_file.write('{"op": "put", "section": "device", "key": 3, "val')
+
+        reopened = FileStore(self.FILE_STRING, None)
+        self.assertIsNotNone(reopened.get_device("c2"))
+        self.assertEqual(2, len(reopened.list_devices()))
+
+    def test_replaced_file_ignores_journal(self):
+        self.fs.set_device({"device_type": "node", "hostname": "c2"})
+        with open(self.FILE_STRING, "w") as snapshot:
+            snapshot.write(self.FILE_CONFIG)
+
+        reopened = FileStore(self.FILE_STRING, None)
+        self.assertIsNone(reopened.get_device("c2"))
+
+    def test_batch(self):
+        with patch.object(JsonParser, "write_file") as mock_write:
+            self.fs.set_configuration(FileStore.JOURNAL_MAX_RECORDS_KEY, None)
+            mock_write.reset_mock()
+            with self.fs.batch():
+                for index in range(2, 20):
+                    self.fs.set_device({"device_type": "node", "hostname": "c{}".format(index)})
+                self.fs.delete_device("c1")
+                self.assertEqual(0, mock_write.call_count)
+            self.assertEqual(1, mock_write.call_count)
+        self.assertEqual(18, len(self.fs.list_devices()))
+
+    def test_batch_rollback(self):
+        with self.assertRaises(DataStoreException):
+            with self.fs.batch():
+                self.fs.set_device({"device_type": "node", "hostname": "c2"})
+                self.fs.set_device({"hostname": "c3"})
+
+        self.assertIsNone(self.fs.get_device("c2"))
+        self.assertIsNone(FileStore(self.FILE_STRING, None).get_device("c2"))
+
+    def test_journal_turned_off(self):
+        self.fs.set_device({"device_type": "node", "hostname": "c2"})
+        self.fs.delete_configuration(FileStore.JOURNAL_MAX_RECORDS_KEY)
+
+        self.assertFalse(os.path.isfile(self.JOURNAL_STRING))
+        self.assertEqual(2, len(self.read_file().get("device")))
+
+
+class TestFileStoreSnapshot(unittest.TestCase):
+    FILE_CONFIG = """{
+  "configuration_variables": {
+    "file_store_snapshot": true
+  },
+  "device": [
+    {"device_id": 1, "device_type": "node", "hostname": "c1", "ip_address": "10.0.0.1", "profile_name": "compute"},
+    {"device_id": 2, "device_type": "node", "hostname": "c2", "ip_address": "10.0.0.2", "profile_name": "compute"},
+    {"device_id": 3, "device_type": "bmc", "hostname": "bmc1"}
+  ],
+  "profile": [
+    {"profile_name": "compute", "port": 22}
+  ]
+}"""
+
+    def setUp(self):
+        temp_file = tempfile.NamedTemporaryFile("w", delete=False)
+        temp_file.write(self.FILE_CONFIG)
+        temp_file.close()
+        self.FILE_STRING = temp_file.name
+        self.SNAPSHOT_STRING = self.FILE_STRING + DeviceSnapshot.SUFFIX
+        self.fs = FileStore(self.FILE_STRING, None)
+
+    def tearDown(self):
+        for location in [self.FILE_STRING, self.SNAPSHOT_STRING, self.FILE_STRING + ".lock"]:
+            if os.path.isfile(location):
+                os.remove(location)
+
+    def test_snapshot_is_used(self):
+        self.assertTrue(os.path.isfile(self.SNAPSHOT_STRING))
+        with patch.object(JsonParser, "read_file") as mock_read:
+            fs = FileStore(self.FILE_STRING, None)
+            self.assertEqual(0, mock_read.call_count)
+
+        device = fs.get_device("10.0.0.2")
+        self.assertEqual(2, device.get("device_id"))
+        self.assertEqual(22, device.get("port"))
+        self.assertEqual(3, fs.get_device("bmc1").get("device_id"))
+        self.assertEqual(1, fs.get_device(1).get("device_id"))
+        self.assertIsNone(fs.get_device("c4"))
+        self.assertFalse(fs._devices_loaded)
+        self.assertEqual(22, fs.get_profile("compute").get("port"))
+
+        self.assertEqual(2, len(fs.get_devices_by_type("node")))
+        self.assertTrue(fs._devices_loaded)
+
+    def test_writes_keep_devices(self):
+        fs = FileStore(self.FILE_STRING, None)
+        fs.set_configuration("foo", "bar")
+        self.assertEqual(3, len(FileStore(self.FILE_STRING, None).list_devices()))
+
+        fs = FileStore(self.FILE_STRING, None)
+        fs.set_device({"device_type": "node", "hostname": "c4"})
+        fs = FileStore(self.FILE_STRING, None)
+        self.assertEqual(4, fs.get_device("c4").get("device_id"))
+        self.assertEqual(4, len(fs.list_devices()))
+
+    def test_json_changed(self):
+        config = json.loads(self.FILE_CONFIG)
+        config["device"].pop()
+        with open(self.FILE_STRING, "w") as config_file:
+            json.dump(config, config_file)
+
+        fs = FileStore(self.FILE_STRING, None)
+        self.assertIsNone(fs.get_device("bmc1"))
+        self.assertEqual(2, len(fs.list_devices()))
+
+    def test_snapshot_turned_off(self):
+        self.fs.set_configuration(FileStore.SNAPSHOT_KEY, False)
+        self.assertFalse(os.path.isfile(self.SNAPSHOT_STRING))
+        self.assertEqual(3, len(FileStore(self.FILE_STRING, None).list_devices()))
+
+
+def _concurrent_writer(location, writer, count):
+    fs = FileStore(location, logging.CRITICAL)
+    for index in range(count):
+        fs.set_device({"device_type": "node", "hostname": "w{}-{}".format(writer, index)})
+        fs.set_configuration("writer{}".format(writer), index)
+
+
+class TestFileStoreSharedFile(unittest.TestCase):
+
+    def setUp(self):
+        temp_file = tempfile.NamedTemporaryFile("w", delete=False)
+        temp_file.write('{"configuration_variables": {"log_file_path": "/tmp/datastore.log"}}')
+        temp_file.close()
+        self.FILE_STRING = temp_file.name
+        self.fs = FileStore(self.FILE_STRING, None)
+
+    def tearDown(self):
+        for location in [self.FILE_STRING, self.FILE_STRING + ".lock"]:
+            if os.path.isfile(location):
+                os.remove(location)
+
+    def test_sees_other_writers(self):
+        other = FileStore(self.FILE_STRING, None)
+        other.set_device({"device_type": "node", "hostname": "c1"})
+        self.assertEqual(1, self.fs.get_device("c1").get("device_id"))
+
+        self.fs.set_device({"device_type": "node", "hostname": "c2"})
+        self.assertEqual(2, other.get_device("c2").get("device_id"))
+        self.assertEqual(2, len(other.list_devices()))
+
+    def test_no_reload_when_unchanged(self):
+        with patch.object(JsonParser, "read_file", wraps=JsonParser.read_file) as mock_read:
+            for _ in range(10):
+                self.fs.list_devices()
+                self.fs.get_configuration_value("log_file_path")
+            self.assertEqual(0, mock_read.call_count)
+
+            FileStore(self.FILE_STRING, None).set_configuration("foo", "bar")
+            mock_read.reset_mock()
+            self.assertEqual("bar", self.fs.get_configuration_value("foo"))
+            self.assertEqual(1, mock_read.call_count)
+
+    def test_concurrent_writers(self):
+        import multiprocessing
+        writers = [multiprocessing.Process(target=_concurrent_writer, args=(self.FILE_STRING, writer, 10))
+                   for writer in range(6)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+            self.assertEqual(0, writer.exitcode)
+
+        devices = self.fs.list_devices()
+        self.assertEqual(60, len(devices))
+        self.assertEqual(60, len(set(device.get("device_id") for device in devices)))
+        for writer in range(6):
+            self.assertEqual(9, self.fs.get_configuration_value("writer{}".format(writer)))
+
+
 expansion_tests = {
     "accept_lists": ["node1,node2,node3", ["node1", "node2", "node3"]],
     "sequential_numbers": ["node[1-3]", ["node1", "node2", "node3"]],
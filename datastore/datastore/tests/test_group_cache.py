@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the GroupCache class
+"""
+
+import unittest
+from mock import MagicMock
+from ClusterShell.NodeSet import NodeSet
+from ..group_cache import GroupCache
+
+
+class TestGroupCache(unittest.TestCase):
+
+    def setUp(self):
+        self.datastore = MagicMock()
+        self.datastore._get_cache_key.return_value = 1
+        self.datastore.list_groups.return_value = {
+            "test": "@test1,c1,n3",
+            "test1": "c99,@test2",
+            "test2": "c[1-23]",
+            "loop": "@loop,x1",
+        }
+        self.cache = GroupCache(self.datastore)
+
+    def test_nested_groups(self):
+        self.assertEqual("c[1-23,99],n3", self.cache.get_group_nodes("test"))
+        self.assertEqual("c[1-23,99]", self.cache.get_group_nodes("test1"))
+        self.assertEqual("x1", self.cache.get_group_nodes("loop"))
+        self.assertEqual("", self.cache.get_group_nodes("unknown"))
+        self.assertEqual(["test", "test1", "test2", "loop"], self.cache.get_group_names())
+        self.assertEqual(1, self.datastore.list_groups.call_count)
+
+    def test_device_groups(self):
+        self.assertEqual(["test", "test1", "test2"], self.cache.get_device_groups(NodeSet("c5")))
+        self.assertEqual(["test"], self.cache.get_device_groups(NodeSet("c5,n3")))
+        self.assertEqual([], self.cache.get_device_groups(NodeSet("c5,x1")))
+        self.assertEqual(1, self.datastore.list_groups.call_count)
+
+    def test_invalidate(self):
+        self.cache.get_group_names()
+        version = self.cache.version
+        self.cache.get_group_names()
+        self.assertEqual(version, self.cache.version)
+
+        self.datastore.list_groups.return_value = {"test2": "c[1-2]"}
+        self.cache.invalidate()
+        self.assertEqual("c[1-2]", self.cache.get_group_nodes("test2"))
+        self.assertGreater(self.cache.version, version)
+
+        # Changed by another process.
+        self.datastore.list_groups.return_value = {"test2": "c3"}
+        self.datastore._get_cache_key.return_value = 2
+        self.assertEqual(["test2"], self.cache.get_device_groups(NodeSet("c3")))
+        self.assertEqual(3, self.datastore.list_groups.call_count)
+
+    def test_max_age(self):
+        self.datastore._get_cache_key.return_value = None
+        self.cache.get_group_names()
+        self.cache.get_group_names()
+        self.assertEqual(1, self.datastore.list_groups.call_count)
+        self.cache._loaded_at -= GroupCache.MAX_AGE_SECONDS
+        self.cache.get_group_names()
+        self.assertEqual(2, self.datastore.list_groups.call_count)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the LogReader class
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from ..log_reader import LogReader
+
+
+class TestLogReader(unittest.TestCase):
+
+    DELIMITER = ";;\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "datastore.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self, filename, timestamps):
+        with open(filename, "w") as log_file:
+            for timestamp in timestamps:
+                log_file.write("{} / record {};;\n".format(timestamp, timestamp))
+
+    @staticmethod
+    def parse_timestamp(line):
+        return int(line.split(" / ")[0])
+
+    def test_reverse_records(self):
+        self.write_log(self.filename, range(100))
+        with open(self.filename, "a") as log_file:
+            log_file.write("partial")
+        # Blocks smaller than a record, so records and delimiters are split over blocks.
+        reader = LogReader(self.DELIMITER, block_size=7)
+        records = list(reader.reverse_records(self.filename))
+        self.assertEqual(101, len(records))
+        self.assertEqual("partial", records[0])
+        self.assertEqual("99 / record 99", records[1])
+        self.assertEqual("0 / record 0", records[-1])
+
+    def test_tail(self):
+        self.write_log(self.filename, range(100, 200))
+        self.write_log(self.filename + ".1", range(100))
+        reader = LogReader(self.DELIMITER, block_size=16)
+        filenames = LogReader.rotated_files(self.filename, 3)
+        self.assertEqual([self.filename, self.filename + ".1"], filenames)
+
+        result = reader.tail(filenames, 5, self.parse_timestamp)
+        self.assertEqual([195, 196, 197, 198, 199], result)
+        result = reader.tail(filenames, 150, self.parse_timestamp, lambda timestamp: timestamp % 10 == 0)
+        self.assertEqual(list(range(0, 200, 10)), result)
+        self.assertEqual([], reader.tail(filenames, 0))
+
+    def test_tail_between(self):
+        self.write_log(self.filename, range(1000, 2000))
+        self.write_log(self.filename + ".1", range(1000))
+        self.write_log(self.filename + ".2", range(-1000, 0))
+        reader = LogReader(self.DELIMITER, self.parse_timestamp, checkpoint_bytes=256)
+        filenames = LogReader.rotated_files(self.filename, 2)
+
+        def in_slice(timestamp):
+            return 1490 < timestamp < 1510
+
+        result = reader.tail_between(filenames, 1490, 1510, 100, self.parse_timestamp, in_slice)
+        self.assertEqual(list(range(1491, 1510)), result)
+        start, stop = reader.get_index(self.filename).byte_range(1490, 1510)
+        self.assertGreater(start, 0)
+        self.assertLess(stop, os.path.getsize(self.filename))
+
+        # A slice over the rotation.
+        result = reader.tail_between(filenames, 980, 1020, 100, self.parse_timestamp, lambda t: 980 < t < 1020)
+        self.assertEqual(list(range(981, 1020)), result)
+        result = reader.tail_between(filenames, 980, 1020, 5, self.parse_timestamp, lambda t: 980 < t < 1020)
+        self.assertEqual(list(range(1015, 1020)), result)
+
+        # Appending extends the index, rotating keeps it.
+        with open(self.filename, "a") as log_file:
+            log_file.write("2000 / record 2000;;\n")
+        result = reader.tail_between(filenames, 1990, 2010, 100, self.parse_timestamp, lambda t: 1990 < t < 2010)
+        self.assertEqual(list(range(1991, 2001)), result)
+
+    def test_out_of_order(self):
+        self.write_log(self.filename, list(range(500, 1000)) + list(range(500)))
+        reader = LogReader(self.DELIMITER, self.parse_timestamp, checkpoint_bytes=256)
+        self.assertFalse(reader.get_index(self.filename).usable)
+        result = reader.tail_between([self.filename], 10, 20, 100, self.parse_timestamp, lambda t: 10 < t < 20)
+        self.assertEqual(list(range(11, 20)), result)
@@ -6,6 +6,8 @@
 import unittest
 from ..datastore import DataStore, DataStoreException
 from ..multistore import MultiStore
+import time
+from datetime import datetime
 from random import randint
 from mock import MagicMock
 
@@ -19,6 +21,11 @@ class TestMultiStore(unittest.TestCase):
     def setUp(self):
         self.fs = MagicMock(spec=DataStore)
         self.ps = self.fs
+        # Both stores are the same mock, which is called from two threads at once. Create its return values up front,
+        # so both calls return the same one.
+        for name in dir(DataStore):
+            if not name.startswith("_") and callable(getattr(DataStore, name)):
+                getattr(self.fs, name).return_value
         self.ms = MultiStore([self.fs, self.ps])
 
     def test_init(self):
@@ -45,6 +52,119 @@ class TestMultiStore(unittest.TestCase):
         self.ms._all_results_equal([[{}], [{}]])
         self.ms._all_results_equal([[{"foo": "bar", "1": 2}], [{"foo": "bar", "1": 2}]])
 
+    def test_all_results_differ(self):
+        with self.assertRaises(DataStoreException):
+            self.ms._all_results_equal([{"foo": "bar"}, {"foo": "baz"}])
+        with self.assertRaises(DataStoreException):
+            self.ms._all_results_equal([[1, 2], [2, 1]])
+        self.ms._all_results_equal([{"a": 1, "b": 2}, {"b": 2, "a": 1}])
+
+    def make_stores(self, *results):
+        stores = list()
+        for result in results:
+            store = MagicMock(spec=DataStore)
+            store.get_device.return_value = result
+            stores.append(store)
+        return stores
+
+    def test_read_policies(self):
+        with self.assertRaises(DataStoreException):
+            MultiStore(self.make_stores(1, 1), "fastest")
+
+        stores = self.make_stores({"hostname": "a"}, {"hostname": "b"}, {"hostname": "b"})
+        with self.assertRaises(DataStoreException):
+            MultiStore(stores).get_device("a")
+
+        stores[1].get_device.reset_mock()
+        self.assertEqual({"hostname": "a"}, MultiStore(stores, MultiStore.READ_PRIMARY).get_device("a"))
+        self.assertEqual(0, stores[1].get_device.call_count)
+
+        self.assertEqual({"hostname": "b"}, MultiStore(stores, MultiStore.READ_QUORUM).get_device("a"))
+        stores[2].get_device.side_effect = DataStoreException("down")
+        with self.assertRaises(DataStoreException):
+            MultiStore(stores, MultiStore.READ_QUORUM).get_device("a")
+
+    def test_first_response(self):
+        stores = self.make_stores({"hostname": "slow"}, {"hostname": "fast"})
+
+        def slow(device_name):
+            time.sleep(0.5)
+            return {"hostname": "slow"}
+        stores[0].get_device.side_effect = slow
+        ms = MultiStore(stores, MultiStore.READ_FIRST_RESPONSE)
+        start = time.time()
+        self.assertEqual({"hostname": "fast"}, ms.get_device("a"))
+        self.assertLess(time.time() - start, 0.4)
+
+        stores[1].get_device.side_effect = DataStoreException("down")
+        self.assertEqual({"hostname": "slow"}, ms.get_device("a"))
+        stores[0].get_device.side_effect = DataStoreException("down")
+        with self.assertRaises(DataStoreException):
+            ms.get_device("a")
+
+    def test_parallel_writes(self):
+        stores = self.make_stores(None, None)
+
+        def slow(device_info):
+            time.sleep(0.2)
+            return [1]
+        for store in stores:
+            store.set_device.side_effect = slow
+        ms = MultiStore(stores)
+        start = time.time()
+        self.assertEqual([1], ms.set_device({"device_id": 1, "device_type": "node", "hostname": "test"}))
+        self.assertLess(time.time() - start, 0.35)
+
+        timings = ms.get_store_timings()
+        self.assertEqual(2, len(timings))
+        self.assertEqual(1, timings[0]["calls"])
+        self.assertEqual(0, timings[0]["errors"])
+        self.assertGreater(timings[1]["max_seconds"], 0.15)
+
+    def test_own_arguments(self):
+        stores = self.make_stores(None, None)
+        stored = list()
+
+        def store_device(device_info):
+            device_info["port"] = 22
+            stored.append(device_info)
+            return [device_info["device_id"]]
+        for store in stores:
+            store.set_device.side_effect = store_device
+        ms = MultiStore(stores)
+        device = {"device_id": 1, "device_type": "node", "hostname": "test"}
+        self.assertEqual([1], ms.set_device(device))
+        self.assertEqual(2, len(stored))
+        self.assertIn(device, stored)
+        self.assertIsNot(stored[0], stored[1])
+        self.assertEqual(stored[0], stored[1])
+
+    def test_new_device_ids(self):
+        stores = self.make_stores(None, None)
+        stored = list()
+
+        def store_device(next_id):
+            def _set_device(device_info):
+                devices = device_info if isinstance(device_info, list) else [device_info]
+                for device in devices:
+                    if device.get("device_id") is None:
+                        device["device_id"] = next_id
+                    stored.append(device)
+                return [device["device_id"] for device in devices]
+            return _set_device
+        stores[0].set_device.side_effect = store_device(5)
+        stores[1].set_device.side_effect = store_device(9)
+        ms = MultiStore(stores)
+        device = {"device_type": "node", "hostname": "test"}
+        self.assertEqual([5], ms.set_device(device))
+        self.assertEqual([5, 5], [device["device_id"] for device in stored])
+        self.assertIs(device, stored[0])
+
+        del stored[:]
+        self.assertEqual([5, 3], ms.set_device([{"device_type": "node", "hostname": "new"},
+                                                {"device_id": 3, "device_type": "node", "hostname": "old"}]))
+        self.assertEqual([5, 3, 5, 3], [device["device_id"] for device in stored])
+
     def test_call_function(self):
         test_func = MagicMock()
         # DataStore.test_func = classmethod(test_func)
@@ -81,6 +201,22 @@ class TestMultiStore(unittest.TestCase):
         self.ms.get_device_history()
         self.ms.get_device_history("compute-29")
 
+    def test_get_devices(self):
+        self.ms.get_devices("c[1-2]", include_related=("bmc",))
+        self.fs.get_devices.assert_called_with("c[1-2]", ("bmc",))
+
+    def test_subscribe(self):
+        self.fs.subscribe.side_effect = DataStoreException("FileStore does not publish changes.")
+        with self.assertRaises(DataStoreException):
+            self.ms.subscribe()
+        self.fs.subscribe.side_effect = [DataStoreException("FileStore does not publish changes."), "feed"]
+        self.assertEqual("feed", self.ms.subscribe(None, ["device"]))
+        self.fs.subscribe.side_effect = None
+
+    def test_list_devices_as_of(self):
+        self.ms.list_devices_as_of(datetime(2017, 9, 1))
+        self.fs.list_devices_as_of.assert_called_with(datetime(2017, 9, 1), None)
+
     def test_get_profile(self):
         self.ms.get_profile("invalid")
         self.ms.get_profile("compute-29")
@@ -9,8 +9,13 @@ Tests for the RemoteAccessData class
 import unittest
 import tempfile
 import os
+import json
+import time
+import logging
+import threading
+import psycopg2
 from mock import patch, MagicMock
-from ..postgresstore import PostgresStore
+from ..postgresstore import PostgresStore, PostgresLogHandler, SqlParser
 from ..datastore import DataStoreException
 from random import randint
 from datetime import datetime, timedelta
@@ -86,6 +91,7 @@ class TestPostgresDB(unittest.TestCase):
         self.postgres = PostgresStore(self.CONNECTION_STRING, None)
         self.log_add_org = self.postgres.add_log
         self.postgres.add_log = self.func
+        self.postgres.add_logs = self.func
 
     def test_connect(self, mock_connect):
         self.set_expected(mock_connect, [])
@@ -137,6 +143,30 @@ class TestPostgresDB(unittest.TestCase):
         self.assertEqual(1, len(result))
         self.assertEqual(result[0], self.TEST_DEVICE2)
 
+    def test_device_list_fields(self, mock_connect):
+        self.set_expected(mock_connect, [self.TEST_POSTGRES_DEVICE, self.TEST_POSTGRES_DEVICE2])
+        result = self.postgres.list_devices({"device_type": "test_device_type"}, ["hostname", "port"])
+        self.assertEqual(result, [{"hostname": "test_hostname", "port": 22}])
+
+        query, args = self.postgres.cursor.execute.call_args[0]
+        self.assertIn("WHERE device.device_type = %s ORDER BY device.device_id;", query)
+        self.assertEqual(args, [["port"], ["port"], "test_device_type"])
+
+    def test_prepare_device_list_query(self, mock_connect):
+        query, args = SqlParser.prepare_device_list_query()
+        self.assertNotIn("WHERE", query)
+        self.assertIn("device.properties, ", query)
+        self.assertEqual(args, [])
+
+        query, args = SqlParser.prepare_device_list_query({"device_id": 3, "rack": 4, "tags": ["a"], "hostname": None})
+        self.assertIn("device.device_id = %s AND (device.properties @> %s::jsonb OR", query)
+        # Lists and None can't be compared in SQL, those are left to DataStoreUtilities.filter_dict()
+        self.assertEqual(args, [3, '{"rack": 4}', '{"rack": 4}', "rack"])
+
+        query, args = SqlParser.prepare_device_list_query({"device_id": "3"}, ["hostname"])
+        self.assertNotIn("WHERE", query)
+        self.assertIn("SELECT device.device_id, NULL, NULL, device.hostname, NULL, NULL, NULL, NULL, NULL", query)
+
     def test_device_upsert(self, mock_connect):
         self.set_expected(mock_connect, [(1, 2, None, None, None, None, None, None, None)])
         with self.assertRaises(DataStoreException):
@@ -157,6 +187,47 @@ class TestPostgresDB(unittest.TestCase):
             # Exception due to too many things being updated, only one should of been updated.
             self.postgres.set_device({"device_type": "test_device_type", "attr": "is_added"})
 
+    def test_device_upsert_batch(self, mock_connect):
+        self.set_expected(mock_connect, [(1, 7), (1, 3), (1, 8)])
+        cursor = self.postgres.cursor
+        cursor.callproc.reset_mock()
+        devices = [{"device_type": "node", "hostname": "n{}".format(index), "rack": 4} for index in range(3)]
+        devices[1]["device_id"] = 3
+
+        result = self.postgres.set_device(devices)
+        self.assertEqual(result, [7, 3, 8])
+        cursor.callproc.assert_called_once()
+        procedure, args = cursor.callproc.call_args[0]
+        self.assertEqual(procedure, "public.upsert_devices")
+        documents = json.loads(args[0])
+        self.assertEqual([document["hostname"] for document in documents], ["n0", "n1", "n2"])
+        self.assertEqual([document["device_id"] for document in documents], [None, "3", None])
+        self.assertEqual(documents[0]["properties"], {"rack": 4})
+
+        self.set_expected(mock_connect, [(1, 7), (1, 3)])
+        with self.assertRaises(DataStoreException):
+            # One row is expected for every device
+            self.postgres.set_device(devices)
+        self.postgres.connection.rollback.assert_called_once()
+
+        self.set_expected(mock_connect, [])
+        self.postgres.cursor.callproc.reset_mock()
+        self.assertListEmpty(self.postgres.set_device([]))
+        self.postgres.cursor.callproc.assert_not_called()
+
+    def test_device_delete_batch(self, mock_connect):
+        self.set_expected(mock_connect, [(1, 3), (0, None), (1, 5)])
+        cursor = self.postgres.cursor
+        cursor.callproc.reset_mock()
+
+        result = self.postgres.delete_device(["node1", "missing", 5])
+        self.assertEqual(result, [3, 5])
+        cursor.callproc.assert_called_once_with("public.delete_devices", [["node1", "missing", "5"]])
+
+        self.set_expected(mock_connect, [(1, 3), (2, 5), (0, None)])
+        with self.assertRaises(DataStoreException):
+            self.postgres.delete_device(["node1", "node2", "node3"])
+
     def assertListEmpty(self, pList):
         self.assertListEqual(pList, [])
 
@@ -217,6 +288,46 @@ class TestPostgresDB(unittest.TestCase):
         result = self.postgres.get_device_history(self.TEST_DEVICE.get("hostname"))
         self.assertEqual(result, [self.TEST_DEVICE])
 
+    def test_get_devices(self, mock_connect):
+        device = self.TEST_POSTGRES_DEVICE[:2] + [{"bmc": "test_hostname2"}] + self.TEST_POSTGRES_DEVICE[3:]
+        self.set_expected(mock_connect, [device, self.TEST_POSTGRES_DEVICE2])
+        devices = self.postgres.get_devices("test_hostname,c1", include_related=("bmc",))
+        self.assertEqual(["c1", "test_hostname", "test_hostname2"], list(devices.keys()))
+        self.assertIsNone(devices["c1"])
+        self.assertEqual("test_pass", devices["test_hostname"]["password"])
+        self.assertEqual(2, devices["test_hostname2"]["device_id"])
+        self.postgres.cursor.callproc.assert_called_once_with("public.get_devices",
+                                                              [["c1", "test_hostname"], ["bmc"]])
+
+        self.postgres.cursor.callproc.reset_mock()
+        self.assertEqual(dict(), self.postgres.get_devices([]))
+        self.postgres.cursor.callproc.assert_not_called()
+
+    def test_subscribe(self, mock_connect):
+        self.set_expected(mock_connect, [])
+        callback = MagicMock()
+        with patch("datastore.change_feed.ChangeFeed.start") as mock_start:
+            feed = self.postgres.subscribe(callback, ["device"])
+        self.assertEqual(self.CONNECTION_STRING, feed.connection_uri)
+        self.assertEqual({"device"}, feed.entities)
+        mock_start.assert_called_once_with(callback)
+        mock_connect.return_value.cursor.return_value.execute.assert_called_with("LISTEN datastore_changes;")
+        feed.close()
+
+    def test_list_devices_as_of(self, mock_connect):
+        self.set_expected(mock_connect, [self.TEST_POSTGRES_DEVICE[:7] + [None, "[2017-09-01,)"]])
+        result = self.postgres.list_devices_as_of(datetime(2017, 9, 2), "test_hostname,c[1-2]")
+        self.assertEqual(1, len(result))
+        self.assertNotIn("sys_period", result[0])
+        self.assertNotIn("password", result[0])
+        procedure, args = self.postgres.cursor.callproc.call_args[0]
+        self.assertEqual("public.get_devices_as_of", procedure)
+        self.assertEqual(0, args[0].utcoffset().total_seconds())
+        self.assertEqual(["c1", "c2", "test_hostname"], args[1])
+
+        self.postgres.list_devices_as_of(datetime(2017, 9, 2))
+        self.assertIsNone(self.postgres.cursor.callproc.call_args[0][1][1])
+
     def test_profile_get(self, mock_connect):
         # Single item
         self.set_expected(mock_connect, [self.TEST_POSTGRES_PROFILE])
@@ -289,6 +400,12 @@ class TestPostgresDB(unittest.TestCase):
         result = self.postgres.list_logs_between_timeslice(datetime.utcnow(), datetime.utcnow() - timedelta(days=1))
         self.assertEqual(3, len(result))
 
+    def test_expire_logs(self, mock_connect):
+        self.set_expected(mock_connect, [(3,)])
+        older_than = datetime.utcnow() - timedelta(days=90)
+        self.assertEqual(3, self.postgres.expire_logs(older_than, summarize=True))
+        self.postgres.cursor.callproc.assert_called_with("public.expire_log_partitions", [older_than, True])
+
     def test_log_add(self, mock_connect):
         import logging
         self.set_expected(mock_connect, [(1,)])
@@ -476,6 +593,36 @@ class TestPostgresDB(unittest.TestCase):
 
         os.remove(import_file.name)
 
+    def test_import_from_stream(self, mock_connect):
+        from ..record_stream import RecordStream
+        self.set_expected(mock_connect, [[1]])
+        stream_file = tempfile.NamedTemporaryFile("w", delete=False)
+        stream_file.close()
+        RecordStream.write(stream_file.name, [
+            (RecordStream.PROFILE, [self.TEST_PROFILE]),
+            (RecordStream.GROUP, [{"group": "group1", "device_list": "d1"}]),
+            (RecordStream.DEVICE, [dict(self.TEST_DEVICE, device_id=device_id) for device_id in range(5)]),
+        ])
+        connection = mock_connect.return_value
+        connection.commit.reset_mock()
+        batches = list()
+        self.postgres.set_device = MagicMock(side_effect=lambda devices: batches.append(len(devices)))
+        counts = self.postgres.import_from_stream(stream_file.name, batch_size=2)
+        self.assertEqual(5, counts["device"])
+        self.assertEqual([2, 2, 1], batches)
+        # Committed once, at the end.
+        connection.commit.assert_called_once()
+        connection.rollback.assert_not_called()
+
+        self.set_expected(mock_connect, [[1]])
+        self.postgres.set_profile = MagicMock(side_effect=Exception("The mocked exception"))
+        connection.commit.reset_mock()
+        with self.assertRaises(Exception):
+            self.postgres.import_from_stream(stream_file.name)
+        connection.commit.assert_not_called()
+        connection.rollback.assert_called_once()
+        os.remove(stream_file.name)
+
     def test_database_delete(self, mock_connect):
         self.set_expected(mock_connect, [])
         old_config, old_devices, old_profiles = self.postgres._delete_database()
@@ -524,5 +671,103 @@ class TestPostgresDB(unittest.TestCase):
         except RuntimeError as run_ex:
             self.assertEqual(str(run_ex), "Group non_existing doesn't exist")
 
+
+class TestPostgresLogHandler(unittest.TestCase):
+    """Tests for the queued, batched log handler."""
+
+    def setUp(self):
+        self.datastore = MagicMock()
+        self.written = list()
+        self.datastore.add_logs.side_effect = lambda entries: self.written.append(list(entries))
+
+    def make_record(self, msg, level=logging.INFO, device_name=None):
+        record = logging.LogRecord("Datastore", level, __file__, 1, msg, None, None)
+        record.device_name = device_name
+        return record
+
+    def test_batches(self):
+        handler = PostgresLogHandler(self.datastore, batch_size=3, flush_seconds=10)
+        for index in range(7):
+            handler.emit(self.make_record("message {}".format(index), device_name="node{}".format(index)))
+        handler.flush()
+
+        self.assertEqual([len(batch) for batch in self.written], [3, 3, 1])
+        process, timestamp, level, device_name, msg = self.written[0][0]
+        self.assertEqual(("Datastore", logging.INFO, "node0", "message 0"), (process, level, device_name, msg))
+        self.assertIsInstance(timestamp, datetime)
+        handler.close()
+        self.assertIsNone(handler._writer)
+
+    def test_flush_on_time(self):
+        handler = PostgresLogHandler(self.datastore, batch_size=100, flush_seconds=0.01)
+        handler.emit(self.make_record("message"))
+        for _ in range(500):
+            if self.written:
+                break
+            time.sleep(0.01)
+        self.assertEqual(1, len(self.written))
+        handler.close()
+
+    def test_close_writes_queued(self):
+        handler = PostgresLogHandler(self.datastore, batch_size=100, flush_seconds=10)
+        handler.emit(self.make_record("message"))
+        handler.close()
+        self.assertEqual(1, len(self.written))
+
+    def test_overflow(self):
+        block = threading.Event()
+        self.datastore.add_logs.side_effect = lambda entries: block.wait(5) and self.written.append(list(entries))
+        handler = PostgresLogHandler(self.datastore, batch_size=1, flush_seconds=0, queue_size=2)
+        handler.emit(self.make_record("taken by the writer"))
+        for _ in range(500):
+            if handler.queue.empty():
+                break
+            time.sleep(0.01)
+        for index in range(4):
+            handler.emit(self.make_record("message {}".format(index)))
+        self.assertEqual(2, handler.dropped)
+        block.set()
+        handler.close()
+
+        messages = [entry[4] for batch in self.written for entry in batch]
+        self.assertEqual(messages[:2], ["taken by the writer", "message 2"])
+        # The next write reports the dropped records
+        self.assertIn("2 log records were dropped", messages[2])
+        self.assertEqual(messages[3], "message 3")
+
+        handler = PostgresLogHandler(self.datastore, overflow=PostgresLogHandler.OVERFLOW_DROP_NEWEST, queue_size=1)
+        handler.queue.put("queued before the writer")
+        handler._writer = MagicMock()
+        handler.emit(self.make_record("message"))
+        self.assertEqual(1, handler.dropped)
+        self.assertEqual("queued before the writer", handler.queue.get_nowait())
+
+        with self.assertRaises(DataStoreException):
+            PostgresLogHandler(self.datastore, overflow="unknown")
+
+    def test_failed_batch(self):
+        def add_logs(entries):
+            if any(entry[4] == "bad" for entry in entries):
+                raise psycopg2.IntegrityError("valid_log_levels")
+            self.written.append(list(entries))
+
+        self.datastore.add_logs.side_effect = add_logs
+        handler = PostgresLogHandler(self.datastore, batch_size=3, flush_seconds=10)
+        for msg in ["good", "bad", "good"]:
+            handler.emit(self.make_record(msg))
+        handler.close()
+        self.assertEqual([[entry[4] for entry in batch] for batch in self.written], [["good"], ["good"]])
+        self.assertEqual(1, handler.failed)
+
+    def test_broken_connection(self):
+        self.datastore.add_logs.side_effect = [psycopg2.InterfaceError("connection already closed"), None]
+        handler = PostgresLogHandler(self.datastore)
+        handler.emit(self.make_record("message"))
+        handler.close()
+        self.datastore.reset_connection.assert_called_once()
+        self.assertEqual(2, self.datastore.add_logs.call_count)
+        self.assertEqual(0, handler.failed)
+
+
 if __name__ == '__main__':
     unittest.main()
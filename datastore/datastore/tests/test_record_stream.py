@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+Tests for the RecordStream class
+"""
+
+import os
+import tempfile
+import unittest
+from ..record_stream import RecordStream
+from .. import DataStoreException
+
+
+class TestRecordStream(unittest.TestCase):
+
+    def setUp(self):
+        stream_file = tempfile.NamedTemporaryFile("w", delete=False)
+        stream_file.close()
+        self.filename = stream_file.name
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_write_read(self):
+        devices = ({"device_id": device_id, "hostname": "c{}".format(device_id)} for device_id in range(3))
+        counts = RecordStream.write(self.filename, [
+            (RecordStream.CONFIGURATION, [{"key": "log_file_path", "value": "/tmp/test.log"}]),
+            (RecordStream.GROUP, [{"group": "compute", "device_list": "c[0-2]"}]),
+            (RecordStream.DEVICE, devices),
+        ])
+        self.assertEqual({"configuration": 1, "profile": 0, "group": 1, "device": 3}, counts)
+        self.assertTrue(RecordStream.is_stream(self.filename))
+
+        records = list(RecordStream.read(self.filename))
+        self.assertEqual(5, len(records))
+        self.assertEqual(("configuration", {"key": "log_file_path", "value": "/tmp/test.log"}), records[0])
+        self.assertEqual(("device", {"device_id": 2, "hostname": "c2"}), records[-1])
+
+    def test_bad_file(self):
+        with open(self.filename, "w") as stream_file:
+            stream_file.write("{\"device\": []}")
+        self.assertFalse(RecordStream.is_stream(self.filename))
+        with self.assertRaises(DataStoreException):
+            list(RecordStream.read(self.filename))
+
+        RecordStream.write(self.filename, [])
+        with open(self.filename, "a") as stream_file:
+            stream_file.write("{\"type\": \"device\", \"data\": {}}\n\n{\"type\": \"device\"\n")
+        records = RecordStream.read(self.filename)
+        self.assertEqual(("device", {}), next(records))
+        with self.assertRaises(DataStoreException):
+            next(records)
+
+        RecordStream.write(self.filename, [])
+        with open(self.filename, "a") as stream_file:
+            stream_file.write("{\"type\": \"unknown\", \"data\": {}}\n")
+        with self.assertRaises(DataStoreException):
+            list(RecordStream.read(self.filename))
@@ -52,6 +52,25 @@ gorilla;;""")
 
         os.remove(temp_file.name)
 
+    def test_project_dict(self):
+        objs = [{"a": 1, "b": 2}, {"b": 3}]
+        self.assertIs(DataStoreUtilities.project_dict(objs, None), objs)
+        self.assertEqual(DataStoreUtilities.project_dict(objs, ["a"]), [{"a": 1}, {}])
+
+    def test_merge_and_strip_profiles(self):
+        profiles = {"compute": {"profile_name": "compute", "port": 22, "user": "root"}, "missing": None}
+        devices = [{"hostname": "c1", "profile_name": "compute", "port": 23, "user": None},
+                   {"hostname": "c2", "profile_name": "missing"},
+                   {"hostname": "c3"}]
+        merged = DataStoreUtilities.merge_profiles(devices, profiles)
+        self.assertEqual(merged[0], {"hostname": "c1", "profile_name": "compute", "port": 23, "user": "root"})
+        self.assertIs(merged[1], devices[1])
+        self.assertIs(merged[2], devices[2])
+        self.assertIsNone(devices[0]["user"])
+
+        stripped = DataStoreUtilities.strip_profiles(merged, {0: "compute", 1: "missing"}, profiles)
+        self.assertEqual(stripped[0], {"hostname": "c1", "profile_name": "compute", "port": 23})
+
     def test_json_read_file(self):
         temp_file = tempfile.NamedTemporaryFile("w", delete=False)
         temp_file.write("""{}""")
@@ -117,6 +136,21 @@ gorilla;;""")
         except FileNotFound as fnf:
             self.assertEqual(str(fnf), "'File /root/not-allowed not found.'")
 
+    def test_json_write_is_atomic(self):
+        temp_file = tempfile.NamedTemporaryFile("w", delete=False)
+        temp_file.write("{}")
+        temp_file.close()
+        os.chmod(temp_file.name, 0o640)
+        JsonParser.write_file(temp_file.name, {"one": 1})
+
+        self.assertEqual({"one": 1}, JsonParser.read_file(temp_file.name))
+        self.assertEqual(0o640, os.stat(temp_file.name).st_mode & 0o777)
+        temp_dir = os.path.dirname(temp_file.name)
+        leftovers = [name for name in os.listdir(temp_dir)
+                     if name.startswith(os.path.basename(temp_file.name) + ".tmp")]
+        self.assertEqual([], leftovers)
+        os.remove(temp_file.name)
+
     def test_json_get_string(self):
         result = JsonParser.get_file_content_string({"one": 1, "two": "two"})
         self.assertEqual('{\n  "one": 1,\n  "two": "two"\n}', result)
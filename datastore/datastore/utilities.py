@@ -5,9 +5,11 @@
 """
 Common utilities that DataStore users or implementers need.
 """
+import os
 import json
 from os import linesep
 from ClusterShell.NodeSet import expand, fold, grouplist, NodeSetParseError
+from .log_reader import LogReader
 
 
 class DeviceUtilities(object):
@@ -59,40 +61,14 @@ class DataStoreUtilities(object):
         """
         Tries to emulate the function of tail on linux machines by retrieving the last x lines from a file.
         Allows for two functions, a formatter and lo_filter to be passed in for advanced usage.
+        The file is read backwards from its end, only until enough lines were found.
         :param filename:
         :param lines:
         :param formatter:
         :param log_filter:
         :return:
         """
-        num_lines = int(lines)
-
-        with open(filename) as opened_file:
-            content = opened_file.read().split(DataStoreUtilities.LINE_DELIMITER)
-
-        # delete the empty element introduced by the split function
-        content = [_f for _f in content if _f]
-        count = len(content)
-
-        # Handle case when limit is larger than count
-        if num_lines >= count:
-            num_lines = count
-
-        lines = list()
-        i = count - 1
-        while i >= 0 and len(lines) < num_lines:
-            line = content[i]
-            if formatter is not None:
-                line = formatter(line)
-            if log_filter is not None:
-                if log_filter(line):
-                    lines.append(line)
-            else:
-                lines.append(line)
-            i -= 1
-
-        lines.reverse()
-        return lines
+        return LogReader(DataStoreUtilities.LINE_DELIMITER).tail([filename], lines, formatter, log_filter)
 
     @staticmethod
     def filter_dict(list_to_filter, filters):
@@ -118,6 +94,59 @@ class DataStoreUtilities(object):
 
         return filtered_objs
 
+    @staticmethod
+    def project_dict(list_to_project, fields):
+        """
+            Keep only the keys listed in fields, for each dict in list_to_project. Keys that a dict doesn't have are
+            left out, not set to None.
+        :param list_to_project: A list of dicts
+        :param fields: list of keys to keep, or None to keep every key.
+        :return: A list
+        """
+        if fields is None:
+            return list_to_project
+        return [dict((key, obj[key]) for key in fields if key in obj) for obj in list_to_project]
+
+    @staticmethod
+    def merge_profiles(devices, profiles):
+        """
+            Fill in the values of a device's profile that the device doesn't set (or sets to None). Every profile's
+            items are taken once for the whole list, not once per device.
+        :param devices: A list of device dicts
+        :param profiles: dict of profile_name to profile, None for profiles that don't exist
+        :return: A list with a merged copy of every device that has a known profile, the other devices as they are.
+        """
+        profile_items = dict((profile_name, list(profile.items())) for profile_name, profile in profiles.items()
+                             if profile is not None)
+        merged_devices = list()
+        for device in devices:
+            items = profile_items.get(device.get("profile_name"))
+            if items is not None:
+                device = dict(device)
+                for key, value in items:
+                    if device.get(key) is None:
+                        device[key] = value
+            merged_devices.append(device)
+        return merged_devices
+
+    @staticmethod
+    def strip_profiles(devices, profile_names, profiles):
+        """
+            Remove the values a device has in common with its profile, in place. The opposite of merge_profiles().
+        :param devices: A list of device dicts
+        :param profile_names: dict of index in devices to the profile_name of that device
+        :param profiles: dict of profile_name to profile, None for profiles that don't exist
+        :return: devices
+        """
+        profile_items = dict((profile_name, [(key, value) for key, value in profile.items() if key != "profile_name"])
+                             for profile_name, profile in profiles.items() if profile is not None)
+        for index, profile_name in profile_names.items():
+            device = devices[index]
+            for key, value in profile_items.get(profile_name, ()):
+                if key in device and device[key] == value:
+                    device.pop(key)
+        return devices
+
 
 class JsonParser(object):
     """Class to parse a Json file"""
@@ -142,20 +171,51 @@ class JsonParser(object):
     @staticmethod
     def write_file(file_path, content):
         """
-        Tries to format the content into JSON and put it in a file at the file_path.
+        Tries to format the content into JSON and put it in a file at the file_path. The content is written to a
+        temporary file in the same directory, fsync'd and renamed over file_path, so a crash leaves either the old or
+        the new file, never a half-written one.
         :param file_path: str
         :param content: str
         :return:
         """
         try:
-            with open(file_path, "w") as json_file:
-                json_file.write(json.dumps(content, sort_keys=True, indent=2, separators=(',', ': ')))
-        except IOError as io_error:
-            print(io_error)
-            raise FileNotFound(file_path)
+            data = json.dumps(content, sort_keys=True, indent=2, separators=(',', ': '))
         except ValueError:
             raise NonParsableFile(file_path)
 
+        target_path = os.path.realpath(file_path)
+        temp_path = "{}.tmp.{}".format(target_path, os.getpid())
+        try:
+            with open(temp_path, "w") as json_file:
+                json_file.write(data)
+                json_file.flush()
+                os.fsync(json_file.fileno())
+            if os.path.isfile(target_path):
+                os.chmod(temp_path, os.stat(target_path).st_mode & 0o7777)
+            os.replace(temp_path, target_path)
+        except (IOError, OSError) as io_error:
+            print(io_error)
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+            raise FileNotFound(file_path)
+        JsonParser._fsync_directory(os.path.dirname(target_path))
+
+    @staticmethod
+    def _fsync_directory(directory):
+        """
+        Make a rename in directory durable. Not every platform/filesystem allows this, so failures are ignored.
+        """
+        try:
+            directory_fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(directory_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(directory_fd)
+
     @staticmethod
     def get_file_content_string(file_content):
         """ This method allows to get a human readable abtraction of a dict
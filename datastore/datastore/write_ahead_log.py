@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2017 Intel Corp.
+#
+"""
+An append-only change journal that sits next to a FileStore's JSON file.
+"""
+import os
+import json
+from .utilities import FileNotFound
+
+
+class WriteAheadLog(object):
+    """
+    Changes are appended to <snapshot>.journal as one JSON record per line, instead of rewriting the whole snapshot
+    for every change. The first line of the journal identifies the snapshot the records apply to, so a journal that
+    was already compacted into a newer snapshot (or a snapshot that was replaced by hand) is never replayed twice.
+    """
+    SUFFIX = ".journal"
+
+    def __init__(self, snapshot_location):
+        self.snapshot_location = snapshot_location
+        self.location = snapshot_location + self.SUFFIX
+        self.record_count = 0
+
+    def exists(self):
+        """
+        :return: True if there is a journal file on disk
+        """
+        return os.path.isfile(self.location)
+
+    def read(self):
+        """
+        Read the records that still have to be applied on top of the snapshot. A partially written last record (i.e.
+        from a crash in the middle of an append) is ignored.
+        :return: A list of records, empty if there is no journal or it belongs to another snapshot.
+        """
+        self.record_count = 0
+        if not self.exists():
+            return list()
+
+        records = list()
+        with open(self.location) as journal_file:
+            header = self._parse_line(journal_file.readline())
+            if header is None or header.get("snapshot") != self._snapshot_signature():
+                return list()
+            for line in journal_file:
+                record = self._parse_line(line)
+                if record is None:
+                    break
+                records.append(record)
+
+        self.record_count = len(records)
+        return records
+
+    def append(self, records):
+        """
+        Durably add records to the end of the journal. All records are written with one write and one fsync.
+        :param records: list of JSON serializable dicts
+        :return:
+        """
+        if not self.exists():
+            self.reset()
+        data = "".join(json.dumps(record, sort_keys=True) + "\n" for record in records)
+        try:
+            with open(self.location, "a") as journal_file:
+                journal_file.write(data)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+        except IOError:
+            raise FileNotFound(self.location)
+        self.record_count += len(records)
+
+    def reset(self):
+        """
+        Start an empty journal for the snapshot as it is on disk right now. Call this after writing a new snapshot.
+        :return:
+        """
+        temp_location = "{}.tmp.{}".format(self.location, os.getpid())
+        try:
+            with open(temp_location, "w") as journal_file:
+                journal_file.write(json.dumps({"snapshot": self._snapshot_signature()}) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(temp_location, self.location)
+        except (IOError, OSError):
+            raise FileNotFound(self.location)
+        self.record_count = 0
+
+    def remove(self):
+        """
+        Delete the journal file, if there is one.
+        :return:
+        """
+        if self.exists():
+            os.remove(self.location)
+        self.record_count = 0
+
+    def _snapshot_signature(self):
+        try:
+            stat = os.stat(self.snapshot_location)
+        except OSError:
+            return None
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def _parse_line(line):
+        if not line.endswith("\n"):
+            return None
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None